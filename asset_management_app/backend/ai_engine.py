@@ -1,4 +1,11 @@
-from typing import List, Optional
+import heapq
+import threading
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import models
 from .models import RiskProfile, MarketTrend, RecommendedAsset, Asset # Asset is needed for fetching all assets
 
 # This is a very basic placeholder for the AI engine.
@@ -16,6 +23,163 @@ MOCK_ASSETS_POOL = [
     models.Asset(id=106, name="Blue Chip Dividend Stock", ticker_symbol="BCDS", asset_type="Stock", current_price=120.0),
 ]
 
+TOP_K = 5 # Number of recommendations returned per request
+SCORE_THRESHOLD = 0.5 # Only recommend if score is above this threshold
+
+# --- Scoring rules ---
+# The rules are plain tables rather than if/elif branches, so that they can be
+# compiled into a lookup matrix and applied to whole arrays of assets at once.
+
+DEFAULT_RULE = (0.5, "General recommendation.")
+
+# Rule-based logic based on risk profile: risk_profile -> asset_type -> (score, rationale)
+RISK_PROFILE_RULES = {
+    RiskProfile.low: {
+        "Bond": (0.8, "Bonds are generally lower risk."),
+        "Stock": (0.3, "Stocks are generally higher risk."),
+    },
+    RiskProfile.medium: {
+        "ETF": (0.7, "ETFs and diversified stocks fit a medium risk profile."),
+        "Stock": (0.7, "ETFs and diversified stocks fit a medium risk profile."),
+        "REIT": (0.6, "Real estate can offer diversification."),
+    },
+    RiskProfile.high: {
+        "Stock": (0.8, "Equities form the core of a high-risk portfolio."),
+        "ETF": (0.8, "Equities form the core of a high-risk portfolio."),
+        "REIT": (0.7, "REITs can provide good returns."),
+    },
+}
+
+# Asset-specific exceptions, checked before RISK_PROFILE_RULES (first match wins):
+# risk_profile -> [(field, value, asset_type or None for any type, score, rationale)]
+RISK_PROFILE_OVERRIDES = {
+    RiskProfile.low: [
+        ("name", "Blue Chip Dividend Stock", "Stock", 0.65, "Blue chip stocks can be part of a low-risk portfolio."),
+    ],
+    RiskProfile.medium: [
+        ("name", "Emerging Markets Debt", "Bond", 0.55, "Emerging market debt offers higher yield with moderate risk."),
+    ],
+    RiskProfile.high: [
+        ("ticker_symbol", "TIF", None, 0.85, "Tech funds can offer high growth, suitable for high risk tolerance."),
+    ],
+}
+
+# Rule-based logic based on market trends (very simplified):
+# market_trend -> asset_type -> (score adjustment, rationale suffix)
+MARKET_TREND_ADJUSTMENTS = {
+    MarketTrend.bullish: {
+        "Stock": (0.1, " Positive outlook in bullish market."), # Increase score in bullish market
+        "ETF": (0.1, " Positive outlook in bullish market."),
+    },
+    MarketTrend.bearish: {
+        "Bond": (0.1, " Potential safe haven in bearish market."), # Bonds might be favored
+        "Stock": (-0.1, " Caution for stocks in bearish market."),
+    },
+    MarketTrend.neutral: {},
+}
+
+
+class ScoringTable:
+    # The rules for one (risk_profile, market_trend) pair compiled into a
+    # (rule x adjustment) matrix of final scores, eligibility flags and rationales.
+    # Scoring an array of assets is then a couple of integer lookups per asset.
+
+    def __init__(self, risk_profile: RiskProfile, market_trend: MarketTrend):
+        base_rules = RISK_PROFILE_RULES.get(risk_profile, {})
+        self.overrides = RISK_PROFILE_OVERRIDES.get(risk_profile, [])
+        adjustments = MARKET_TREND_ADJUSTMENTS.get(market_trend, {})
+
+        # Every asset type a rule mentions gets a code; code 0 is "any other type"
+        self.asset_types = sorted(set(base_rules) | set(adjustments) | {o[2] for o in self.overrides if o[2]})
+        self.type_codes = {asset_type: code for code, asset_type in enumerate(self.asset_types, start=1)}
+
+        # Rule rows: 0 = default, then one per asset type, then one per override
+        rules = [DEFAULT_RULE]
+        rules += [base_rules.get(asset_type, DEFAULT_RULE) for asset_type in self.asset_types]
+        rules += [(o[3], o[4]) for o in self.overrides]
+        # Adjustment columns: one per asset type code
+        columns = [(0.0, "")] + [adjustments.get(asset_type, (0.0, "")) for asset_type in self.asset_types]
+
+        shape = (len(rules), len(columns))
+        self.scores = np.zeros(shape, dtype=np.float64) # rounded, as returned to clients
+        self.eligible = np.zeros(shape, dtype=bool)
+        self.rationales = []
+        for r, (score, rationale) in enumerate(rules):
+            for c, (adjustment, suffix) in enumerate(columns):
+                # Same float arithmetic as the original per-asset rules, so results match exactly
+                if adjustment > 0:
+                    final_score = min(1.0, score + adjustment)
+                elif adjustment < 0:
+                    final_score = max(0.0, score + adjustment)
+                else:
+                    final_score = score
+                self.scores[r, c] = round(final_score, 2)
+                self.eligible[r, c] = final_score > SCORE_THRESHOLD
+                self.rationales.append(rationale + suffix)
+        self.n_columns = len(columns)
+
+    def encode_types(self, asset_types: np.ndarray) -> np.ndarray:
+        # Map asset_type strings to type codes, looking up each distinct value only once
+        uniques, inverse = np.unique(asset_types.astype(str), return_inverse=True)
+        codes = np.array([self.type_codes.get(u, 0) for u in uniques], dtype=np.intp)
+        return codes[inverse.reshape(-1)]
+
+    def score(self, asset_types: np.ndarray, names: np.ndarray, tickers: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Returns (rounded scores, eligibility mask, cell index for rationale lookup) per asset
+        type_codes = self.encode_types(asset_types)
+        rule_rows = type_codes.copy()
+        fields = {"name": names, "ticker_symbol": tickers}
+        # Apply overrides in reverse so that the first matching override wins
+        first_override_row = len(self.asset_types) + 1
+        for i in reversed(range(len(self.overrides))):
+            field, value, asset_type, _, _ = self.overrides[i]
+            mask = fields[field] == value
+            if asset_type is not None:
+                mask &= type_codes == self.type_codes[asset_type]
+            rule_rows[mask] = first_override_row + i
+        return self.scores[rule_rows, type_codes], self.eligible[rule_rows, type_codes], rule_rows * self.n_columns + type_codes
+
+
+@lru_cache(maxsize=None)
+def get_scoring_table(risk_profile: RiskProfile, market_trend: MarketTrend) -> ScoringTable:
+    return ScoringTable(RiskProfile(risk_profile), MarketTrend(market_trend))
+
+
+def select_top_k(scores: np.ndarray, eligible: np.ndarray, k: int = TOP_K) -> np.ndarray:
+    # Indices of the k best eligible assets, best first. Ties keep input order, matching
+    # a stable sort by score, but only O(n) work is done via argpartition.
+    candidates = np.flatnonzero(eligible)
+    if candidates.size > k:
+        candidate_scores = scores[candidates]
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        threshold = candidate_scores[top].min()
+        above = candidates[candidate_scores > threshold]
+        ties = candidates[candidate_scores == threshold][:k - above.size]
+        candidates = np.concatenate([above, ties])
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def score_asset_arrays(
+    risk_profile: RiskProfile,
+    market_trends: MarketTrend,
+    asset_types: Sequence[str],
+    names: Sequence[str],
+    tickers: Sequence[str],
+    k: int = TOP_K
+) -> List[Tuple[int, float, str]]:
+    # Scores parallel sequences of asset attributes in one pass and returns the
+    # top k as (position, suitability_score, rationale) tuples, best first.
+    if len(asset_types) == 0:
+        return []
+    table = get_scoring_table(risk_profile, market_trends)
+    scores, eligible, cells = table.score(
+        np.asarray(asset_types, dtype=object),
+        np.asarray(names, dtype=object),
+        np.asarray(tickers, dtype=object)
+    )
+    return [(int(i), float(scores[i]), table.rationales[cells[i]]) for i in select_top_k(scores, eligible, k)]
+
+
 def get_asset_recommendations(
     risk_profile: RiskProfile,
     market_trends: MarketTrend,
@@ -23,77 +187,185 @@ def get_asset_recommendations(
     all_available_assets: Optional[List[Asset]] = None # Pass available assets
 ) -> List[RecommendedAsset]:
 
-    recommendations: List[RecommendedAsset] = []
-
     # If no specific assets are passed, use the mock pool
     # In a real app, you'd query from db using crud.get_assets(db, limit=some_large_number)
     assets_to_consider = all_available_assets if all_available_assets else MOCK_ASSETS_POOL
 
-    for asset in assets_to_consider:
-        suitability_score = 0.5  # Default score
-        rationale = "General recommendation."
-
-        # Rule-based logic based on risk profile
-        if risk_profile == RiskProfile.low:
-            if asset.asset_type == "Bond":
-                suitability_score = 0.8
-                rationale = "Bonds are generally lower risk."
-            elif asset.asset_type == "Stock" and asset.name == "Blue Chip Dividend Stock":
-                suitability_score = 0.65
-                rationale = "Blue chip stocks can be part of a low-risk portfolio."
-            elif asset.asset_type == "Stock":
-                suitability_score = 0.3
-                rationale = "Stocks are generally higher risk."
-
-        elif risk_profile == RiskProfile.medium:
-            if asset.asset_type == "ETF" or asset.asset_type == "Stock":
-                suitability_score = 0.7
-                rationale = "ETFs and diversified stocks fit a medium risk profile."
-            elif asset.asset_type == "REIT":
-                suitability_score = 0.6
-                rationale = "Real estate can offer diversification."
-            elif asset.asset_type == "Bond" and asset.name == "Emerging Markets Debt":
-                suitability_score = 0.55
-                rationale = "Emerging market debt offers higher yield with moderate risk."
-
-
-        elif risk_profile == RiskProfile.high:
-            if asset.asset_type == "Stock" or asset.asset_type == "ETF":
-                suitability_score = 0.8
-                rationale = "Equities form the core of a high-risk portfolio."
-            if asset.ticker_symbol == "TIF": # Tech Innovators Fund
-                 suitability_score = 0.85
-                 rationale = "Tech funds can offer high growth, suitable for high risk tolerance."
-            elif asset.asset_type == "REIT":
-                suitability_score = 0.7
-                rationale = "REITs can provide good returns."
-
-        # Rule-based logic based on market trends (very simplified)
-        if market_trends == MarketTrend.bullish:
-            if asset.asset_type == "Stock" or asset.asset_type == "ETF":
-                suitability_score = min(1.0, suitability_score + 0.1) # Increase score in bullish market
-                rationale += " Positive outlook in bullish market."
-        elif market_trends == MarketTrend.bearish:
-            if asset.asset_type == "Bond":
-                suitability_score = min(1.0, suitability_score + 0.1) # Bonds might be favored
-                rationale += " Potential safe haven in bearish market."
-            elif asset.asset_type == "Stock":
-                 suitability_score = max(0.0, suitability_score - 0.1)
-                 rationale += " Caution for stocks in bearish market."
-
-        # Only recommend if score is above a certain threshold
-        if suitability_score > 0.5:
-            recommendations.append(
-                models.RecommendedAsset(
-                    name=asset.name,
-                    ticker_symbol=asset.ticker_symbol,
-                    asset_type=asset.asset_type,
-                    current_price=asset.current_price,
-                    suitability_score=round(suitability_score, 2),
-                    rationale=rationale
-                )
+    top_assets = score_asset_arrays(
+        risk_profile,
+        market_trends,
+        [asset.asset_type for asset in assets_to_consider],
+        [asset.name for asset in assets_to_consider],
+        [asset.ticker_symbol for asset in assets_to_consider]
+    )
+
+    recommendations: List[RecommendedAsset] = []
+    for position, suitability_score, rationale in top_assets:
+        asset = assets_to_consider[position]
+        recommendations.append(
+            models.RecommendedAsset(
+                name=asset.name,
+                ticker_symbol=asset.ticker_symbol,
+                asset_type=asset.asset_type,
+                current_price=asset.current_price,
+                suitability_score=suitability_score,
+                rationale=rationale
+            )
+        )
+    return recommendations
+
+
+
+def top_k_candidates(
+    groups: Iterable[Tuple[RiskProfile, MarketTrend]],
+    asset_chunks: Iterable[Sequence[tuple]],
+    k: int = TOP_K
+) -> Tuple[Dict[Tuple[RiskProfile, MarketTrend], List[tuple]], int]:
+    # Scores the asset universe chunk by chunk (see crud.iter_asset_chunks) for every
+    # (risk_profile, market_trend) group at once, so each chunk is read once however many
+    # groups are scored and memory stays flat whatever the size of the asset table.
+    # Each chunk is a sequence of (id, name, ticker_symbol, asset_type, current_price)
+    # tuples in id order. Returns, per group, the best k candidates as
+    # (suitability_score, -asset_id, asset row, rationale) tuples, best first, and the
+    # number of assets scored. A bounded min-heap per group keeps the best k seen so far;
+    # ties go to the lower asset id, matching get_asset_recommendations on the same assets.
+    heaps = {group: [] for group in groups}
+    scanned = 0
+    for chunk in asset_chunks:
+        asset_ids, names, tickers, asset_types, _ = zip(*chunk)
+        for (risk_profile, market_trend), heap in heaps.items():
+            for position, suitability_score, rationale in score_asset_arrays(risk_profile, market_trend, asset_types, names, tickers, k):
+                # The heap root is the worst kept candidate: lowest score, then highest id
+                entry = (suitability_score, -asset_ids[position], tuple(chunk[position]), rationale)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+        scanned += len(chunk)
+    return {group: merge_top_k([heap], k) for group, heap in heaps.items()}, scanned
+
+
+def merge_top_k(candidate_lists: Iterable[List[tuple]], k: int = TOP_K) -> List[tuple]:
+    # Combines top_k_candidates results for disjoint parts of the asset universe (e.g. the
+    # shards scored by separate processes) into the top k of the whole, best first
+    return heapq.nlargest(k, (c for candidates in candidate_lists for c in candidates), key=lambda c: c[:2])
+
+
+def candidates_to_recommendations(candidates: List[tuple]) -> List[RecommendedAsset]:
+    recommendations: List[RecommendedAsset] = []
+    for suitability_score, _, row, rationale in candidates:
+        _, name, ticker_symbol, asset_type, current_price = row
+        recommendations.append(
+            models.RecommendedAsset(
+                name=name,
+                ticker_symbol=ticker_symbol,
+                asset_type=asset_type,
+                current_price=current_price,
+                suitability_score=suitability_score,
+                rationale=rationale
             )
+        )
+    return recommendations
+
+
+def get_streaming_recommendations(
+    risk_profile: RiskProfile,
+    market_trends: MarketTrend,
+    asset_chunks: Iterable[Sequence[tuple]],
+    k: int = TOP_K
+) -> List[RecommendedAsset]:
+    # Top k for one (risk_profile, market_trend) over streamed asset chunks (see top_k_candidates)
+    group = (risk_profile, market_trends)
+    candidates, scanned = top_k_candidates([group], asset_chunks, k)
+    if scanned == 0:
+        # Empty asset table: fall back to the mock pool like get_asset_recommendations
+        return get_asset_recommendations(risk_profile=risk_profile, market_trends=market_trends)
+    return candidates_to_recommendations(candidates[group])
+
 
-    # Sort by suitability score descending
-    recommendations.sort(key=lambda x: x.suitability_score, reverse=True)
-    return recommendations[:5] # Return top 5 recommendations
+class RecommendationCache:
+    # Recommendations depend only on (risk_profile, market_trend) and the asset universe,
+    # so there are just len(RiskProfile) * len(MarketTrend) distinct top-k lists.
+    # This keeps each one until the asset universe changes (see crud.create_asset).
+    # The cache is per process; every worker process keeps and invalidates its own copy.
+
+    def __init__(self):
+        self._entries: Dict[Tuple[RiskProfile, MarketTrend], List[RecommendedAsset]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0 # Bumped on every invalidation, so stale computations are not stored
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, risk_profile: RiskProfile, market_trend: MarketTrend) -> Optional[List[RecommendedAsset]]:
+        # Cached list or None; only hits are counted (misses are counted by get_or_compute)
+        key = (RiskProfile(risk_profile), MarketTrend(market_trend))
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self.hits += 1
+            return cached
+
+    def get_or_compute(
+        self,
+        risk_profile: RiskProfile,
+        market_trend: MarketTrend,
+        compute: Callable[[], List[RecommendedAsset]]
+    ) -> List[RecommendedAsset]:
+        key = (RiskProfile(risk_profile), MarketTrend(market_trend))
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            generation = self._generation
+
+        recommendations = compute() # Computed outside the lock; concurrent misses may both compute
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = recommendations
+        return recommendations
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def update_prices(self, prices: Dict[str, float]):
+        # Scores do not depend on price, so a price change only needs the cached
+        # current_price patched in place instead of a full invalidation.
+        with self._lock:
+            self._generation += 1 # Lists being computed may hold the old prices
+            for key, entry in self._entries.items():
+                if any(r.ticker_symbol in prices for r in entry):
+                    self._entries[key] = [
+                        r.model_copy(update={"current_price": prices[r.ticker_symbol]}) if r.ticker_symbol in prices else r
+                        for r in entry
+                    ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries)
+            }
+
+
+recommendation_cache = RecommendationCache()
+
+
+def get_cached_recommendations(
+    risk_profile: RiskProfile,
+    market_trends: MarketTrend,
+    load_asset_chunks: Optional[Callable[[], Iterable[Sequence[tuple]]]] = None
+) -> List[RecommendedAsset]:
+    # load_asset_chunks is only called on a cache miss; without it the mock pool is scored
+    if load_asset_chunks is None:
+        compute = lambda: get_asset_recommendations(risk_profile=risk_profile, market_trends=market_trends)
+    else:
+        compute = lambda: get_streaming_recommendations(risk_profile, market_trends, load_asset_chunks())
+    return recommendation_cache.get_or_compute(risk_profile, market_trends, compute)
@@ -0,0 +1,190 @@
+import os
+import string
+import threading
+from bisect import bisect_left, insort
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+from rapidfuzz import fuzz, process, utils
+
+# In-memory search over asset tickers and names, for search-as-you-type (GET /assets/search).
+# Candidates come from two prefix indexes (tries), one over tickers and one over the words
+# of the names (the names with a word starting with each query word), and only those
+# candidates (at most SEARCH_CANDIDATES each) are scored with RapidFuzz; scoring every
+# name instead takes over 100 ms at 50k assets. A query that prefixes no ticker or name
+# word (a typo) is retried with its words one edit away, for words of at most
+# TYPO_MAX_LENGTH characters.
+# The index is filled at startup and kept current by crud.create_asset and the bulk load
+# (see crud.update_asset_search_index); assets inserted by other processes are picked up
+# at the next bulk load or restart.
+
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "40")) # Per prefix index, before scoring
+TYPO_MIN_LENGTH = 3 # Shorter query words are not corrected
+TYPO_MAX_LENGTH = 12 # Nor longer ones: their variants grow quadratically with the length
+SEARCH_MAX_QUERY_LENGTH = 64 # Enforced by GET /assets/search
+EDIT_ALPHABET = string.ascii_lowercase + string.digits # What utils.default_process leaves in words (ASCII names)
+
+
+class PrefixIndex:
+    # A trie flattened into a sorted array of keys: the keys under a prefix form one
+    # contiguous range, found by binary search. Same lookups as a node-per-character trie
+    # at a fraction of its memory and build time in Python. values maps each key to its values.
+    def __init__(self):
+        self.keys: List[str] = []
+        self.values = {}
+
+    def add_many(self, pairs: Iterable[tuple]) -> List[str]:
+        # Adds (key, value) pairs; returns the keys that are new
+        new = []
+        for key, value in pairs:
+            key_values = self.values.get(key)
+            if key_values is None:
+                self.values[key] = [value]
+                new.append(key)
+            else:
+                key_values.append(value)
+        if len(new) * 64 < len(self.keys):
+            # A few keys: insert each in place
+            for key in new:
+                insort(self.keys, key)
+        elif new:
+            # Many keys: one sort, which merges the already sorted run with the new keys
+            self.keys = sorted(self.keys + new)
+        return new
+
+    def exact(self, key: str, limit: int) -> list:
+        return self.values.get(key, [])[:limit]
+
+    def has_prefix(self, prefix: str) -> bool:
+        i = bisect_left(self.keys, prefix)
+        return i < len(self.keys) and self.keys[i].startswith(prefix)
+
+    def with_prefix(self, prefix: str, limit: Optional[int]) -> list:
+        # Up to limit (None: all) values of the keys starting with prefix, in key order (the exact key first)
+        keys = self.keys
+        found = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            found.extend(self.values[keys[i]])
+            if limit is not None and len(found) >= limit:
+                return found[:limit]
+            i += 1
+        return found
+
+
+def one_edit_variants(word: str):
+    # The strings one edit away from word: deletions and transpositions first (few, and
+    # the commonest typos), then substitutions and insertions (about 70 per letter)
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    yield {left + right[1:] for left, right in splits if right} \
+        | {left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1}
+    yield {left + char + right[1:] for left, right in splits if right for char in EDIT_ALPHABET} \
+        | {left + char + right for left, right in splits for char in EDIT_ALPHABET}
+
+
+class IndexedAsset(NamedTuple):
+    id: int
+    name: str
+    ticker_symbol: str
+    asset_type: Optional[str]
+    search_name: str # utils.default_process(name): lowercase alphanumeric words
+
+
+class AssetSearchIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assets = {}
+        self.tickers = PrefixIndex() # Lowercase tickers
+        self.name_words = PrefixIndex() # Lowercase words of the names
+        self.last_loaded_id = 0 # add_rows reloads from here
+
+    def __len__(self):
+        return len(self.assets)
+
+    def _add_many(self, rows: Iterable[tuple]):
+        ticker_pairs = []
+        word_pairs = []
+        for asset_id, name, ticker_symbol, asset_type in rows:
+            if asset_id in self.assets:
+                continue
+            name = name or ""
+            asset = IndexedAsset(asset_id, name, ticker_symbol, asset_type, utils.default_process(name))
+            self.assets[asset_id] = asset
+            ticker_pairs.append((ticker_symbol.lower(), asset_id))
+            word_pairs.extend((word, asset_id) for word in dict.fromkeys(asset.search_name.split()))
+        self.tickers.add_many(ticker_pairs)
+        self.name_words.add_many(word_pairs)
+
+    def add(self, asset_id: int, name: Optional[str], ticker_symbol: str, asset_type: Optional[str]):
+        with self.lock:
+            self._add_many([(asset_id, name, ticker_symbol, asset_type)])
+
+    def add_rows(self, asset_chunks: Iterable[Sequence[tuple]]):
+        # Indexes (id, name, ticker_symbol, asset_type, current_price) rows in id order, as
+        # read by crud.iter_asset_chunks from last_loaded_id; already indexed ids are skipped.
+        # The lock is taken per chunk, so searches are not held up for a whole load.
+        for chunk in asset_chunks:
+            with self.lock:
+                self._add_many(row[:4] for row in chunk)
+                if chunk:
+                    self.last_loaded_id = max(self.last_loaded_id, chunk[-1][0])
+
+    def candidates(self, ticker_key: str, words: List[str]) -> dict:
+        # Asset ids whose ticker starts with ticker_key, plus those whose name has a word
+        # starting with each query word; if no name matches every word, those matching any
+        # of them. The cap applies after the intersection, so shared words (Fund, Holdings)
+        # do not crowd out the names that match the whole query.
+        ids = dict.fromkeys(self.tickers.with_prefix(ticker_key, SEARCH_CANDIDATES))
+        words = list(dict.fromkeys(words))
+        if len(words) == 1:
+            ids.update(dict.fromkeys(self.name_words.with_prefix(words[0], SEARCH_CANDIDATES)))
+            return ids
+        # Each word's matches, intersected smallest first (kept in the smallest one's key order)
+        matches = sorted((self.name_words.with_prefix(word, None) for word in words), key=len)
+        matching = dict.fromkeys(matches[0])
+        for found in matches[1:]:
+            if not matching:
+                break
+            found = set(found)
+            matching = {asset_id: None for asset_id in matching if asset_id in found}
+        if matching:
+            ids.update(dict.fromkeys(list(matching)[:SEARCH_CANDIDATES]))
+        else:
+            for word in words:
+                ids.update(dict.fromkeys(self.name_words.with_prefix(word, SEARCH_CANDIDATES)))
+        return ids
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        # Best matches first as {id, name, ticker_symbol, asset_type, score}, score being
+        # RapidFuzz's WRatio (0-100) of the query against the name, or against the ticker
+        # if that is higher
+        processed = utils.default_process(query)
+        if not processed:
+            return []
+        words = processed.split()
+        ticker_key = "".join(words)
+        with self.lock:
+            candidate_ids = self.candidates(ticker_key, words)
+            if not candidate_ids:
+                # Likely a typo: retry with the longest word's variants that prefix some name word
+                word = max(words, key=len)
+                if TYPO_MIN_LENGTH <= len(word) <= TYPO_MAX_LENGTH:
+                    for variants in one_edit_variants(word):
+                        for variant in variants:
+                            if len(candidate_ids) < SEARCH_CANDIDATES and self.name_words.has_prefix(variant):
+                                candidate_ids.update(dict.fromkeys(self.name_words.with_prefix(variant, SEARCH_CANDIDATES)))
+                        if candidate_ids:
+                            break
+            assets = [self.assets[asset_id] for asset_id in candidate_ids]
+        scores = {}
+        for _, score, i in process.extract(processed, [asset.search_name for asset in assets], scorer=fuzz.WRatio, processor=None, limit=None):
+            scores[i] = score
+        for _, score, i in process.extract(ticker_key, [asset.ticker_symbol.lower() for asset in assets], scorer=fuzz.ratio, processor=None, limit=None):
+            scores[i] = max(scores[i], score)
+        ranked = sorted(scores, key=lambda i: (-scores[i], assets[i].id))[:limit]
+        return [
+            {"id": assets[i].id, "name": assets[i].name, "ticker_symbol": assets[i].ticker_symbol, "asset_type": assets[i].asset_type, "score": round(scores[i], 1)}
+            for i in ranked
+        ]
+
+
+asset_index = AssetSearchIndex()
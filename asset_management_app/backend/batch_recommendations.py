@@ -0,0 +1,248 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import repeat
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import ai_engine, crud, database, models
+from .models import MarketTrend, RiskProfile, RecommendationRunStatus
+
+# Batch recommendation runs for the whole client book (POST /recommendations/runs and
+# manage.py recommend-batch). Every client in a (risk_profile, market_trend) group gets
+# the same recommendations, so a run scores the asset universe once per group rather
+# than once per client:
+#   1. scoring: the asset table is split into id-range shards, each scored for every group
+#      in a worker process (ai_engine.top_k_candidates), and the per-shard top k lists are
+#      merged. The results are stored per group (recommendation_run_groups).
+#   2. writing: clients are read in id order and their group recorded in client_recommendations
+#      with one executemany per chunk of BATCH_WRITE_SIZE clients. Each chunk commits together
+#      with the run's progress (processed_clients, last_client_id).
+# A run that is interrupted or fails resumes from its last committed chunk, with the
+# group results it already stored, so every client of a run gets the same asset snapshot.
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(min(4, os.cpu_count() or 1)))) # Scoring processes
+BATCH_WRITE_SIZE = int(os.getenv("BATCH_WRITE_SIZE", "5000")) # Clients per committed chunk
+# Assets per shard. Starting a worker (a fresh interpreter importing NumPy and SQLAlchemy)
+# costs about a second, about what scoring 100k assets for every group takes in-process.
+BATCH_MIN_SHARD_SIZE = int(os.getenv("BATCH_MIN_SHARD_SIZE", "200000"))
+
+Group = Tuple[RiskProfile, MarketTrend]
+
+logger = logging.getLogger(__name__)
+
+# Runs executing in this process, so the same run is never executed twice at once
+active_runs = set()
+active_runs_lock = threading.Lock()
+
+
+class RunInProgress(Exception):
+    pass
+
+
+def now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def is_active(run_id: int) -> bool:
+    with active_runs_lock:
+        return run_id in active_runs
+
+
+def create_run(db: Session, market_trends: List[MarketTrend]) -> database.DbRecommendationRun:
+    # Covers the clients that exist now; clients created later are left to the next run
+    max_client_id, total_clients = db.execute(select(func.max(database.DbClient.id), func.count(database.DbClient.id))).one()
+    db_run = database.DbRecommendationRun(
+        market_trends=[trend.value for trend in dict.fromkeys(market_trends)],
+        status=RecommendationRunStatus.pending.value,
+        total_clients=total_clients,
+        processed_clients=0,
+        max_client_id=max_client_id or 0,
+        last_client_id=0,
+        created_at=now()
+    )
+    db.add(db_run)
+    db.commit()
+    db.refresh(db_run)
+    return db_run
+
+
+def get_run(db: Session, run_id: int) -> Optional[database.DbRecommendationRun]:
+    return db.get(database.DbRecommendationRun, run_id)
+
+
+def get_client_results(db: Session, run_id: int, client_id: int) -> Optional[models.ClientBatchRecommendations]:
+    # The client's results joined to its group's recommendations, or None if the run has
+    # not reached (or does not include) the client
+    rows = db.execute(
+        select(database.DbClientRecommendation.risk_profile, database.DbRecommendationGroup.market_trend, database.DbRecommendationGroup.recommendations)
+        .join(database.DbRecommendationGroup, (database.DbRecommendationGroup.run_id == database.DbClientRecommendation.run_id)
+              & (database.DbRecommendationGroup.risk_profile == database.DbClientRecommendation.risk_profile))
+        .where(database.DbClientRecommendation.run_id == run_id, database.DbClientRecommendation.client_id == client_id)
+    ).all()
+    if not rows:
+        return None
+    return models.ClientBatchRecommendations(
+        run_id=run_id,
+        client_id=client_id,
+        risk_profile=rows[0].risk_profile,
+        recommendations={row.market_trend: row.recommendations for row in rows}
+    )
+
+
+# Scoring
+
+def score_shard(database_url: str, first_id: int, last_id: int, groups: List[Group], k: int):
+    # Runs in a worker process, which needs an engine of its own: pooled connections
+    # cannot be shared across processes
+    shard_engine = create_engine(database_url)
+    try:
+        with Session(shard_engine) as db:
+            candidates, _ = ai_engine.top_k_candidates(groups, crud.iter_asset_chunks(db, after_id=first_id - 1, last_id=last_id), k)
+    finally:
+        shard_engine.dispose()
+    return candidates
+
+
+def shard_ranges(first_id: int, last_id: int, asset_count: int, workers: int) -> List[Tuple[int, int]]:
+    # Splits [first_id, last_id] into equal id ranges, at most one per worker and none
+    # smaller than BATCH_MIN_SHARD_SIZE assets
+    shards = max(1, min(workers, asset_count // BATCH_MIN_SHARD_SIZE))
+    step = (last_id - first_id + shards) // shards
+    return [(start, min(start + step - 1, last_id)) for start in range(first_id, last_id + 1, step)]
+
+
+def score_groups(groups: List[Group], workers: int = BATCH_WORKERS, k: int = ai_engine.TOP_K) -> Dict[Group, List[models.RecommendedAsset]]:
+    with database.SessionLocal() as db:
+        first_id, last_id, asset_count = db.execute(
+            select(func.min(database.DbAsset.id), func.max(database.DbAsset.id), func.count(database.DbAsset.id))
+        ).one()
+        if asset_count == 0:
+            # Empty asset table: the mock pool, like the per-client endpoint
+            return {group: ai_engine.get_asset_recommendations(*group) for group in groups}
+        # An in-memory database cannot be opened by other processes
+        shards = [(first_id, last_id)] if database.is_in_memory(str(database.engine.url)) else shard_ranges(first_id, last_id, asset_count, workers)
+        if len(shards) == 1:
+            partials = [ai_engine.top_k_candidates(groups, crud.iter_asset_chunks(db), k)[0]]
+    if len(shards) > 1:
+        database_url = database.engine.url.render_as_string(hide_password=False)
+        # spawn, not fork: the server process runs threads and holds open connections
+        with ProcessPoolExecutor(len(shards), mp_context=multiprocessing.get_context("spawn")) as pool:
+            first_ids, last_ids = zip(*shards)
+            partials = list(pool.map(score_shard, repeat(database_url), first_ids, last_ids, repeat(groups), repeat(k)))
+    return {
+        group: ai_engine.candidates_to_recommendations(ai_engine.merge_top_k([partial[group] for partial in partials], k))
+        for group in groups
+    }
+
+
+# Execution
+
+def set_status(db: Session, db_run: database.DbRecommendationRun, status: RecommendationRunStatus, error: Optional[str] = None):
+    db_run.status = status.value
+    db_run.error = error
+    finished = status in (RecommendationRunStatus.completed, RecommendationRunStatus.failed, RecommendationRunStatus.interrupted)
+    db_run.finished_at = now() if finished else None
+    db.commit()
+
+
+def write_client_chunks(db: Session, db_run: database.DbRecommendationRun, progress: Optional[Callable] = None):
+    while True:
+        clients = db.execute(
+            select(database.DbClient.id, database.DbClient.risk_profile)
+            .where(database.DbClient.id > db_run.last_client_id, database.DbClient.id <= db_run.max_client_id)
+            .order_by(database.DbClient.id)
+            .limit(BATCH_WRITE_SIZE)
+        ).all()
+        if not clients:
+            return
+        db.execute(insert(database.DbClientRecommendation), [
+            # Clients without a profile get the column default
+            {"run_id": db_run.id, "client_id": client_id, "risk_profile": risk_profile or RiskProfile.medium}
+            for client_id, risk_profile in clients
+        ])
+        db_run.last_client_id = clients[-1].id
+        db_run.processed_clients += len(clients)
+        db.commit() # The chunk and the checkpoint commit together
+        if progress:
+            progress(db_run)
+
+
+def execute_run(run_id: int, workers: int = BATCH_WORKERS, progress: Optional[Callable] = None) -> models.RecommendationRun:
+    # Runs (or resumes) a run to completion and returns its final state. progress, if
+    # given, is called with the run after each phase change and committed chunk.
+    # Raises LookupError for an unknown run and RunInProgress if this process is already
+    # executing it. A failure or KeyboardInterrupt is recorded on the run and re-raised.
+    with active_runs_lock:
+        if run_id in active_runs:
+            raise RunInProgress(f"Recommendation run {run_id} is already running")
+        active_runs.add(run_id)
+    db = database.SessionLocal()
+    try:
+        db_run = get_run(db, run_id)
+        if db_run is None:
+            raise LookupError(f"Recommendation run {run_id} not found")
+        if db_run.status == RecommendationRunStatus.completed.value:
+            return models.RecommendationRun.model_validate(db_run)
+        try:
+            db_run.started_at = db_run.started_at or now()
+            scored = db.execute(
+                select(func.count()).select_from(database.DbRecommendationGroup).where(database.DbRecommendationGroup.run_id == run_id)
+            ).scalar()
+            if not scored:
+                set_status(db, db_run, RecommendationRunStatus.scoring)
+                if progress:
+                    progress(db_run)
+                groups = [(risk_profile, MarketTrend(trend)) for risk_profile in RiskProfile for trend in db_run.market_trends]
+                results = score_groups(groups, workers)
+                db.execute(insert(database.DbRecommendationGroup), [
+                    {
+                        "run_id": run_id, "risk_profile": risk_profile, "market_trend": market_trend,
+                        "recommendations": [r.model_dump(mode="json") for r in results[(risk_profile, market_trend)]]
+                    }
+                    for risk_profile, market_trend in groups
+                ])
+            set_status(db, db_run, RecommendationRunStatus.writing)
+            if progress:
+                progress(db_run)
+            write_client_chunks(db, db_run, progress)
+            set_status(db, db_run, RecommendationRunStatus.completed)
+        except KeyboardInterrupt:
+            db.rollback()
+            set_status(db, db_run, RecommendationRunStatus.interrupted)
+            raise
+        except Exception as e:
+            db.rollback()
+            set_status(db, db_run, RecommendationRunStatus.failed, error=str(e))
+            raise
+        if progress:
+            progress(db_run)
+        return models.RecommendationRun.model_validate(db_run)
+    finally:
+        db.close()
+        with active_runs_lock:
+            active_runs.discard(run_id)
+
+
+def execute_run_in_background(run_id: int):
+    # For BackgroundTasks: the outcome, including any error, is recorded on the run. The
+    # error is also logged, and recorded again if execute_run could not record it (e.g.
+    # on a locked database), so the run is not left in scoring or writing.
+    try:
+        execute_run(run_id)
+    except RunInProgress:
+        logger.warning("Recommendation run %s is already running in this process", run_id)
+    except Exception as e:
+        logger.exception("Recommendation run %s failed", run_id)
+        try:
+            with database.SessionLocal() as db:
+                db_run = get_run(db, run_id)
+                if db_run is not None and db_run.status in (RecommendationRunStatus.pending.value, RecommendationRunStatus.scoring.value, RecommendationRunStatus.writing.value):
+                    set_status(db, db_run, RecommendationRunStatus.failed, error=str(e))
+        except Exception:
+            logger.exception("Could not record the failure of recommendation run %s", run_id)
@@ -0,0 +1,149 @@
+# End-to-end latency benchmark of the main endpoints. Seeds a scratch database with the
+# synthetic generator (see seeding.py), or uses an existing one given by --database-url,
+# then drives the real FastAPI app in-process through httpx's ASGI transport, so the
+# numbers include routing, validation, serialization and the database but no network.
+# Prints (and optionally writes) one JSON report with p50/p95/p99 latency and throughput
+# per scenario, tagged with the git commit so runs can be compared across commits.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.api_latency --clients 10000 --assets 5000 --holdings 500000
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import func, select
+
+from .. import pagination
+from .common import git_commit, latency_summary
+
+# Each scenario returns one request as (method, path, json body or None)
+def client_detail(rng: random.Random, scale: dict):
+    return "GET", f"/clients/{rng.randint(1, scale['clients'])}", None
+
+
+def portfolio_read(rng: random.Random, scale: dict):
+    return "GET", f"/clients/{rng.randint(1, scale['clients'])}/portfolio", None
+
+
+def portfolio_write(rng: random.Random, scale: dict):
+    # Upserts one random holding and removes another (a no-op if it is not held)
+    return "PATCH", f"/clients/{rng.randint(1, scale['clients'])}/portfolio", {
+        "upsert": [{"asset_id": rng.randint(1, scale["assets"]), "quantity": round(rng.uniform(1, 1000), 2)}],
+        "remove": [rng.randint(1, scale["assets"])]
+    }
+
+
+def asset_list(rng: random.Random, scale: dict):
+    # A 100-asset page starting at a random keyset cursor
+    cursor = pagination.encode_cursor(rng.randint(0, max(scale["assets"] - 100, 0)))
+    return "GET", f"/assets/?limit=100&cursor={cursor}", None
+
+
+def recommendations(rng: random.Random, scale: dict):
+    client_id = rng.randint(1, scale["clients"])
+    return "POST", f"/clients/{client_id}/recommendations", {
+        "client_id": client_id, "market_trend": rng.choice(["bullish", "bearish", "neutral"])
+    }
+
+
+SCENARIOS = {
+    scenario.__name__: scenario
+    for scenario in (client_detail, portfolio_read, portfolio_write, asset_list, recommendations)
+}
+
+
+async def run_scenario(http: httpx.AsyncClient, make_request, scale: dict, requests: int, concurrency: int, warmup: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    planned = [make_request(rng, scale) for _ in range(warmup + requests)]
+    for method, path, body in planned[:warmup]:
+        await http.request(method, path, json=body)
+
+    pending = iter(planned[warmup:])
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for method, path, body in pending:
+            start = time.perf_counter()
+            response = await http.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latency_summary(latencies, time.perf_counter() - start, errors)
+
+
+async def run(args, scale: dict) -> dict:
+    # Imported here so DATABASE_URL points at the benchmark database first
+    from ..main import app
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+        for name in args.scenarios:
+            results[name] = await run_scenario(
+                http, SCENARIOS[name], scale, args.requests, args.concurrency, args.warmup, args.seed
+            )
+            print(f"{name}: {results[name]}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process latency and throughput of the main endpoints")
+    parser.add_argument("--database-url", help="Benchmark an existing (seeded) database instead of a fresh one; portfolio_write modifies it")
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--assets", type=int, default=5000)
+    parser.add_argument("--holdings", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=2000, help="Timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=100, help="Untimed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmp, 'benchmark.db')}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        os.environ["PRICE_HISTORY_DIR"] = os.path.join(tmp, "price_history")
+        from .. import database, seeding # Engine is created on import, from DATABASE_URL
+
+        database.create_db_and_tables()
+        seeded = None
+        if not args.database_url:
+            seeded = seeding.seed_database(database.engine, args.clients, args.assets, args.holdings, seed=args.seed)
+        with database.engine.connect() as conn:
+            scale = {
+                "clients": conn.execute(select(func.max(database.DbClient.id))).scalar() or 0,
+                "assets": conn.execute(select(func.max(database.DbAsset.id))).scalar() or 0,
+                "holdings": conn.execute(select(func.count()).select_from(database.PortfolioAssetAssociation)).scalar()
+            }
+        results = asyncio.run(run(args, scale))
+        asyncio.run(database.async_engine.dispose())
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": "existing" if args.database_url else "seeded",
+        "seed_seconds": seeded["seconds"] if seeded else None,
+        "scale": scale,
+        "concurrency": args.concurrency,
+        "scenarios": results
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
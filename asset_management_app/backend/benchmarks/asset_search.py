@@ -0,0 +1,140 @@
+# Latency of the in-memory asset search (asset_search.py) against a SQL LIKE '%x%' scan,
+# for the kinds of queries typed into a search box: ticker prefixes, name prefixes of
+# growing length, two-word queries and typos. Also reports the time and memory
+# (tracemalloc) taken to build the index at startup. Asset names are generated from random
+# syllables, so the name vocabulary grows with the catalog as real company names do.
+# Also checks that an exact full name comes back first, in a catalog whose names are all
+# made of a few shared words (as in "Tech Fund Pharma 40001"), for assets deep in the
+# table; fails (exit status 1) otherwise.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.asset_search --assets 50000 200000
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from .. import asset_search, seeding
+from .common import git_commit, latency_summary
+
+SYLLABLES = ("ka", "lo", "ve", "mi", "ra", "to", "ne", "si", "du", "pa", "ri", "zo", "ben", "cor", "tel", "max", "gen", "dor", "lin", "qua")
+SUFFIXES = ("Inc", "Corp", "Holdings", "Group", "Trust", "Mining", "Energy", "Capital", "Bond Fund", "REIT", "Technologies", "Pharma")
+
+
+def generate_assets(count: int, rng: random.Random):
+    def word():
+        return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+    return [
+        (i + 1, f"{word()} {word() + ' ' if rng.random() < 0.4 else ''}{rng.choice(SUFFIXES)}", seeding.ticker_for(i), seeding.ASSET_TYPES[i % len(seeding.ASSET_TYPES)], 1.0)
+        for i in range(count)
+    ]
+
+
+def typo(word: str, rng: random.Random) -> str:
+    # Swaps two neighbouring letters
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def generate_queries(assets, rng: random.Random, per_kind: int) -> dict:
+    # Per kind, (query, id of the asset it was made from) pairs
+    samples = [rng.choice(assets) for _ in range(per_kind)]
+    return {
+        "ticker_prefix": [(ticker[:rng.randint(1, len(ticker))], i) for i, _, ticker, _, _ in samples],
+        "name_prefix_2": [(name[:2], i) for i, name, _, _, _ in samples],
+        "name_prefix_5": [(name[:5], i) for i, name, _, _, _ in samples],
+        "two_words": [(" ".join(name.split()[:2])[:-1], i) for i, name, _, _, _ in samples],
+        "typo": [(typo(name.split()[0], rng), i) for i, name, _, _, _ in samples]
+    }
+
+
+def time_queries(search, queries) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for query, _ in queries:
+        t = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - t)
+    return latency_summary(latencies, time.perf_counter() - start)
+
+
+def found_in_top_10(index, queries) -> float:
+    # Share of queries whose source asset is among the first 10 results; short prefixes
+    # are ambiguous, so only the longer kinds are expected to score high
+    return round(sum(any(r["id"] == asset_id for r in index.search(query, 10)) for query, asset_id in queries) / len(queries), 3)
+
+
+def exact_name_failures(count: int, rng: random.Random, checks: int = 50) -> list:
+    # Names of shared words plus the row number; the last assets' full names must rank first
+    words = [w for suffix in SUFFIXES for w in suffix.split()]
+    assets = [(i, f"{rng.choice(words)} {rng.choice(words)} {rng.choice(words)} {i}", seeding.ticker_for(i - 1), None, 1.0) for i in range(1, count + 1)]
+    index = asset_search.AssetSearchIndex()
+    index.add_rows([assets])
+    failures = []
+    for asset_id, name, _, _, _ in assets[-checks:]:
+        results = index.search(name, 10)
+        if not results or results[0]["id"] != asset_id:
+            failures.append(f"{name!r}: got {[r['id'] for r in results[:3]]}, expected {asset_id} first")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory asset search vs LIKE '%x%' latency")
+    parser.add_argument("--assets", type=int, nargs="+", default=[50000, 200000], help="Catalog sizes")
+    parser.add_argument("--queries", type=int, default=500, help="Queries per kind")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    for count in args.assets:
+        rng = random.Random(args.seed)
+        assets = generate_assets(count, rng)
+        queries = generate_queries(assets, rng, args.queries)
+
+        chunks = [assets[i:i + 5000] for i in range(0, count, 5000)] # As read by crud.update_asset_search_index at startup
+        start = time.perf_counter()
+        index = asset_search.AssetSearchIndex()
+        index.add_rows(chunks)
+        build_s = time.perf_counter() - start
+        # Memory of a second build, traced separately since tracing slows the build down
+        tracemalloc.start()
+        traced = asset_search.AssetSearchIndex()
+        traced.add_rows(chunks)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del traced
+
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE assets (id INTEGER PRIMARY KEY, name TEXT, ticker_symbol TEXT, asset_type TEXT, current_price REAL)")
+        conn.executemany("INSERT INTO assets VALUES (?, ?, ?, ?, ?)", assets)
+
+        def like_search(query):
+            pattern = f"%{query}%"
+            return conn.execute(
+                "SELECT id, name, ticker_symbol FROM assets WHERE name LIKE ? OR ticker_symbol LIKE ? LIMIT 10", (pattern, pattern)
+            ).fetchall()
+
+        results[count] = {
+            "build_s": round(build_s, 2),
+            "index_memory_mb": round(memory / 2**20, 1),
+            "name_words": len(index.name_words.keys),
+            "index": {kind: time_queries(index.search, q) for kind, q in queries.items()},
+            "found_in_top_10": {kind: found_in_top_10(index, q) for kind, q in queries.items()},
+            # LIMIT stops a LIKE early when matches are common, so only typos and
+            # two-word queries show the cost of scanning the whole table
+            "sql_like": {kind: time_queries(like_search, q[:50]) for kind, q in queries.items()}
+        }
+        failures.extend(f"{count} assets: {failure}" for failure in exact_name_failures(count, rng))
+        print(count, json.dumps(results[count]), flush=True)
+
+    print(json.dumps({"commit": git_commit(), "results": results, "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# Load benchmark for the hot read endpoints (client read, portfolio read,
+# recommendations), comparing the async endpoints in main.py (AsyncSession on the
+# async engine) with the same endpoints written as sync handlers on SessionLocal,
+# which FastAPI runs in its worker threadpool. Each variant is served by uvicorn in
+# a subprocess on a freshly seeded SQLite database and driven with httpx at each
+# concurrency level; throughput and latency percentiles are printed as JSON.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.async_load --concurrency 50 100 250 500
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import httpx
+from fastapi import FastAPI, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import ai_engine, crud, database, models, seeding
+from .common import latency_summary
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- Sync baseline: the same three endpoints as sync handlers on SessionLocal ---
+# Sessions are closed inside the handler rather than through Depends(get_db): a sync
+# generator dependency's cleanup also needs a threadpool thread, so once every thread
+# is waiting on the connection pool nothing can return a connection and requests
+# stall until the pool timeout. That measures a deadlock, not throughput.
+sync_app = FastAPI(title="Sync baseline")
+
+
+@sync_app.get("/clients/{client_id}", response_model=models.Client)
+def read_single_client(client_id: int):
+    with database.SessionLocal() as db:
+        return build_client(db, client_id)
+
+
+def build_client(db: Session, client_id: int) -> models.Client:
+    db_client = crud.get_client(db, client_id=client_id)
+    if db_client is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    portfolios = [
+        models.Portfolio(
+            id=v["portfolio_id"], name=v["name"], client_id=v["client_id"], total_value=v["total_value"],
+            assets=[models.PortfolioAsset(asset_id=h["asset_id"], quantity=h["quantity"]) for h in v["holdings"]]
+        )
+        for v in crud.get_portfolio_valuations(db, client_ids=[client_id])
+    ]
+    return models.Client(
+        id=db_client.id, first_name=db_client.first_name, last_name=db_client.last_name,
+        email=db_client.email, risk_profile=db_client.risk_profile, portfolios=portfolios
+    )
+
+
+@sync_app.get("/clients/{client_id}/portfolio")
+def get_client_portfolio_details(client_id: int):
+    with database.SessionLocal() as db:
+        return build_portfolio(db, client_id)
+
+
+def build_portfolio(db: Session, client_id: int) -> dict:
+    if crud.get_client(db, client_id=client_id) is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    portfolios = crud.get_portfolios_by_client(db, client_id=client_id, limit=1)
+    if not portfolios:
+        raise HTTPException(status_code=404, detail="Portfolio not found for this client")
+    details = crud.get_portfolio_details(db, portfolio_id=portfolios[0].id)
+    return {
+        "id": details["portfolio_id"], "name": details["name"], "client_id": details["client_id"],
+        "assets_details": [ad["asset"].model_dump() for ad in details["assets_details"]],
+        "total_value": details["total_value"]
+    }
+
+
+@sync_app.post("/clients/{client_id}/recommendations", response_model=List[models.RecommendedAsset])
+def get_ai_recommendations_for_client(client_id: int, request_body: models.RecommendationRequest):
+    with database.SessionLocal() as db:
+        db_client = crud.get_client(db, client_id=client_id)
+        if db_client is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        return ai_engine.get_cached_recommendations(
+            risk_profile=db_client.risk_profile,
+            market_trends=request_body.market_trend,
+            load_asset_chunks=lambda: crud.iter_asset_chunks(db)
+        )
+
+
+# --- Benchmark driver ---
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app_path: str, port: int, cwd: str) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=APP_DIR)
+    # uvicorn's default 5s keep-alive timeout drops pooled connections mid-run
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_path, "--port", str(port), "--log-level", "warning",
+         "--timeout-keep-alive", "120"],
+        cwd=cwd, env=env
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/clients/1", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{app_path} did not start")
+
+
+async def drive(base_url: str, concurrency: int, requests_per_worker: int, clients: int) -> dict:
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(http: httpx.AsyncClient, rng: random.Random):
+        nonlocal errors
+        for i in range(requests_per_worker):
+            client_id = rng.randint(1, clients)
+            start = time.perf_counter()
+            try:
+                if i % 3 == 0:
+                    response = await http.get(f"/clients/{client_id}")
+                elif i % 3 == 1:
+                    response = await http.get(f"/clients/{client_id}/portfolio")
+                else:
+                    response = await http.post(f"/clients/{client_id}/recommendations", json={"client_id": client_id, "market_trend": "neutral"})
+                errors += response.status_code != 200
+            except httpx.TransportError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(http, random.Random(w)) for w in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {"concurrency": concurrency, **latency_summary(latencies, elapsed, errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async throughput of the hot read endpoints")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 100, 250, 500])
+    parser.add_argument("--requests-per-worker", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--assets", type=int, default=5000)
+    parser.add_argument("--holdings", type=int, default=20, help="Holdings per portfolio")
+    parser.add_argument("--seed-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed_only:
+        database.create_db_and_tables()
+        seeding.seed_database(database.engine, args.clients, args.assets, args.clients * args.holdings)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # database.DATABASE_URL is relative to the working directory at import time,
+        # so seeding and both servers run as subprocesses inside the temp directory.
+        subprocess.run(
+            [sys.executable, "-m", "backend.benchmarks.async_load", "--seed-only",
+             "--clients", str(args.clients), "--assets", str(args.assets), "--holdings", str(args.holdings)],
+            cwd=tmp, env=dict(os.environ, PYTHONPATH=APP_DIR), check=True
+        )
+        variants = {"sync": "backend.benchmarks.async_load:sync_app", "async": "backend.main:app"}
+        for name, app_path in variants.items():
+            port = free_port()
+            server = start_server(app_path, port, tmp)
+            try:
+                results[name] = [
+                    asyncio.run(drive(f"http://127.0.0.1:{port}", c, args.requests_per_worker, args.clients))
+                    for c in args.concurrency
+                ]
+            finally:
+                server.terminate()
+                server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
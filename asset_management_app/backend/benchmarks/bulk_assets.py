@@ -0,0 +1,77 @@
+# Compares the per-row asset creation path (POST /assets/: get_asset_by_ticker +
+# crud.create_asset, one commit per row) with the bulk path (POST /assets/bulk:
+# crud.insert_asset_batch + one commit) on a fresh SQLite database.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.bulk_assets --rows 50000
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import crud, database, models
+
+
+def make_records(rows: int):
+    # Unique 5-letter tickers AAAAA, AAAAB, ... matching the AssetCreate pattern
+    records = []
+    for i in range(rows):
+        ticker = ""
+        n = i
+        for _ in range(5):
+            ticker = chr(65 + n % 26) + ticker
+            n //= 26
+        records.append({"name": f"Asset {i}", "ticker_symbol": ticker, "asset_type": "Stock", "current_price": 10.0 + i % 100})
+    return records
+
+
+def make_session(path: str):
+    engine = create_engine(f"sqlite:///{path}")
+    database.Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def run_per_row(db, records):
+    for record in records:
+        asset = models.AssetCreate(**record)
+        if crud.get_asset_by_ticker(db, ticker_symbol=asset.ticker_symbol) is None:
+            crud.create_asset(db, asset)
+
+
+def run_bulk(db, records, batch_size: int):
+    results = []
+    seen_tickers = set()
+    for start in range(0, len(records), batch_size):
+        batch = [(record, None) for record in records[start:start + batch_size]]
+        results += crud.insert_asset_batch(db, batch, len(results) + 1, seen_tickers)
+    return crud.finish_asset_bulk_load(db, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-row vs bulk asset ingestion")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=crud.BULK_ASSET_BATCH_SIZE)
+    args = parser.parse_args()
+
+    records = make_records(args.rows)
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, run in (("per_row", lambda db: run_per_row(db, records)), ("bulk", lambda db: run_bulk(db, records, args.batch_size))):
+            db = make_session(os.path.join(tmp, f"{name}.db"))
+            start = time.perf_counter()
+            run(db)
+            elapsed = time.perf_counter() - start
+            assert db.query(database.DbAsset).count() == args.rows
+            db.close()
+            timings[name] = {"seconds": round(elapsed, 3), "rows_per_second": round(args.rows / elapsed, 1)}
+
+    timings["speedup"] = round(timings["per_row"]["seconds"] / timings["bulk"]["seconds"], 1)
+    print(json.dumps({"rows": args.rows, "batch_size": args.batch_size, **timings}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
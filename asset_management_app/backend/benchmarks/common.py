@@ -0,0 +1,30 @@
+# Helpers shared by the benchmarks
+import statistics
+import subprocess
+from typing import List
+
+
+def latency_summary(latencies: List[float], elapsed: float, errors: int = 0) -> dict:
+    # latencies in seconds; elapsed is the wall time of the whole run
+    if len(latencies) < 2:
+        quantiles = [latencies[0] if latencies else 0.0] * 99
+    else:
+        quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2)
+    }
+
+
+def git_commit() -> str:
+    # Commit of the tree being benchmarked, so results can be compared across commits
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
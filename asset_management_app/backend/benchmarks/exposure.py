@@ -0,0 +1,108 @@
+# Exposure analytics (exposure.py) on a seeded scratch database: time to build the
+# holdings snapshot and to check the source fingerprint, and latency of each aggregation
+# (by asset type, ticker and risk profile, unfiltered and filtered), against the same
+# aggregate as one SQL GROUP BY over the holdings joined to assets and clients, and against
+# reading every portfolio through crud.get_portfolio_details (timed on a sample and scaled
+# to the book). Checks that the snapshot and SQL answers (market value, holdings and
+# portfolios per group) match.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.exposure --clients 100000 --holdings 20
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exposure snapshot aggregations vs SQL and per-portfolio reads")
+    parser.add_argument("--clients", type=int, default=30000)
+    parser.add_argument("--assets", type=int, default=5000)
+    parser.add_argument("--holdings", type=int, default=20, help="Holdings per portfolio")
+    parser.add_argument("--repeat", type=int, default=50, help="Runs per aggregation")
+    parser.add_argument("--sample", type=int, default=500, help="Portfolios read with get_portfolio_details")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'exposure.db')}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        # Imported here so DATABASE_URL points at the scratch database first
+        from sqlalchemy import func, select
+        from .. import crud, database, exposure, seeding
+        from .common import git_commit, latency_summary
+
+        database.create_db_and_tables()
+        seeding.seed_database(database.engine, args.clients, args.assets, args.clients * args.holdings, seed=args.seed)
+        manager = exposure.SnapshotManager(refresh_seconds=0, max_age_seconds=60)
+
+        start = time.perf_counter()
+        manager.refresh()
+        results = {"build_s": round(time.perf_counter() - start, 3), "holdings": manager.snapshot.holding_count}
+        start = time.perf_counter()
+        rebuilt = manager.refresh(only_if_changed=True)
+        results["unchanged_check_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        results["rebuilt_when_unchanged"] = rebuilt
+
+        snapshot = manager.get()
+        cases = {
+            "asset_type": {"group_by": "asset_type"},
+            "ticker_top_100": {"group_by": "ticker", "limit": 100},
+            "risk_profile": {"group_by": "risk_profile"},
+            "ticker_for_high_risk_stocks": {"group_by": "ticker", "asset_type": "Stock", "risk_profile": "high", "limit": 100}
+        }
+        results["aggregations"] = {}
+        for name, params in cases.items():
+            latencies = []
+            run_start = time.perf_counter()
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                snapshot.aggregate(**params)
+                latencies.append(time.perf_counter() - start)
+            results["aggregations"][name] = latency_summary(latencies, time.perf_counter() - run_start)
+            print(name, json.dumps(results["aggregations"][name]), flush=True)
+
+        holdings = database.PortfolioAssetAssociation
+        with database.SessionLocal() as db:
+            # The same aggregates in SQL, over the OLTP tables
+            group_columns = {"asset_type": database.DbAsset.asset_type, "ticker": database.DbAsset.ticker_symbol, "risk_profile": database.DbClient.risk_profile}
+            sql = {}
+            for name, params in cases.items():
+                group_column = group_columns[params["group_by"]]
+                stmt = select(
+                    group_column, func.sum(holdings.quantity * database.DbAsset.current_price), func.count(), func.count(holdings.portfolio_id.distinct())
+                ).select_from(holdings).join(database.DbAsset, database.DbAsset.id == holdings.asset_id).join(
+                    database.DbPortfolio, database.DbPortfolio.id == holdings.portfolio_id
+                ).join(database.DbClient, database.DbClient.id == database.DbPortfolio.client_id).group_by(group_column)
+                if "asset_type" in params:
+                    stmt = stmt.where(database.DbAsset.asset_type == params["asset_type"])
+                if "risk_profile" in params:
+                    stmt = stmt.where(database.DbClient.risk_profile == params["risk_profile"])
+                start = time.perf_counter()
+                rows = db.execute(stmt).all()
+                sql[name] = {"sql_group_by_ms": round((time.perf_counter() - start) * 1000, 1)}
+                expected = {getattr(key, "value", key): row for key, *row in rows}
+                got = {g["key"]: (g["market_value"], g["holdings"], g["portfolios"]) for g in snapshot.aggregate(**{**params, "limit": None})["groups"]}
+                sql[name]["matches"] = expected.keys() == got.keys() and all(
+                    abs(expected[k][0] - got[k][0]) <= 1e-6 * max(1.0, abs(expected[k][0])) and tuple(expected[k][1:]) == got[k][1:] for k in expected
+                )
+            results["sql"] = sql
+
+            # Today's route: every portfolio's details, summed in Python
+            portfolio_ids = random.Random(args.seed).sample(range(1, args.clients + 1), min(args.sample, args.clients))
+            start = time.perf_counter()
+            for portfolio_id in portfolio_ids:
+                crud.get_portfolio_details(db, portfolio_id)
+            per_portfolio = (time.perf_counter() - start) / len(portfolio_ids)
+            results["get_portfolio_details"] = {
+                "per_portfolio_ms": round(per_portfolio * 1000, 2),
+                "whole_book_estimate_s": round(per_portfolio * manager.snapshot.portfolio_count, 1)
+            }
+
+    print(json.dumps({"commit": git_commit(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Load test for the live valuation WebSocket (WS /ws/valuations, live_valuations.py).
+# uvicorn serves backend.main:app in a subprocess on a freshly seeded SQLite database;
+# --subscribers simulated clients each open a connection and subscribe to --portfolios
+# random portfolios. Then --bursts bursts of --feeds back-to-back price feeds are posted,
+# each feed repricing --tickers random assets. Reported per burst:
+#   - messages sent, against the messages an uncoalesced push (one per feed per affected
+#     subscriber) would send
+#   - windows the burst spans and the most messages any subscriber got: coalescing keeps
+#     the latter at or below the former (one message per window)
+#   - the shortest gap between two messages to one subscriber, which should not be much
+#     below LIVE_VALUATION_WINDOW_MS
+#   - delivery latency: from the last feed of the burst returning to its values arriving
+# and at the end whether every subscriber's last total_value matches /portfolios/valuations.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.live_valuations --subscribers 2000
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import orjson
+from websockets.asyncio.client import connect
+
+from .. import database, live_valuations, seeding
+from .async_load import APP_DIR, free_port, start_server
+from .common import git_commit, latency_summary
+
+
+class SimulatedSubscriber:
+    def __init__(self, portfolio_ids):
+        self.portfolio_ids = portfolio_ids
+        self.values = {}
+        self.received = [] # (arrival time, number of updates) per valuations message
+        self.initial = asyncio.Event()
+
+    async def run(self, url: str, connected: asyncio.Event):
+        async with connect(url, max_queue=None, open_timeout=60) as ws:
+            await ws.send(json.dumps({"action": "subscribe", "portfolio_ids": self.portfolio_ids}))
+            connected.set()
+            async for raw in ws:
+                message = orjson.loads(raw)
+                if message["type"] != "valuations":
+                    continue
+                for update in message["updates"]:
+                    self.values[update["portfolio_id"]] = update["total_value"]
+                if self.initial.is_set():
+                    self.received.append((time.perf_counter(), len(message["updates"])))
+                elif len(self.values) == len(self.portfolio_ids):
+                    self.initial.set()
+
+
+async def drive(base_url: str, args) -> dict:
+    rng = random.Random(args.seed)
+    ws_url = base_url.replace("http://", "ws://") + "/ws/valuations"
+    subscribers = [SimulatedSubscriber(rng.sample(range(1, args.clients + 1), args.portfolios)) for _ in range(args.subscribers)]
+
+    start = time.perf_counter()
+    tasks = []
+    for subscriber in subscribers:
+        connected = asyncio.Event()
+        tasks.append(asyncio.create_task(subscriber.run(ws_url, connected)))
+        await connected.wait() # One handshake at a time keeps the listen backlog from overflowing
+    await asyncio.wait_for(asyncio.gather(*(s.initial.wait() for s in subscribers)), timeout=120)
+    connect_s = time.perf_counter() - start
+
+    # Which subscribers each asset's repricing reaches, for the uncoalesced count
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as http:
+        valuations = (await http.post("/portfolios/valuations", json={"portfolio_ids": list(range(1, args.clients + 1))})).json()
+        holders = {}
+        for valuation in valuations:
+            for holding in valuation["holdings"]:
+                holders.setdefault(holding["ticker_symbol"], set()).add(valuation["portfolio_id"])
+        watchers = {}
+        for i, subscriber in enumerate(subscribers):
+            for portfolio_id in subscriber.portfolio_ids:
+                watchers.setdefault(portfolio_id, set()).add(i)
+
+        bursts = []
+        for _ in range(args.bursts):
+            for subscriber in subscribers:
+                subscriber.received.clear()
+            uncoalesced = 0
+            feed_latencies = []
+            burst_start = time.perf_counter()
+            for _ in range(args.feeds):
+                tickers = rng.sample(range(args.assets), args.tickers)
+                feed = [{"ticker_symbol": seeding.ticker_for(t), "current_price": round(rng.uniform(5, 500), 2)} for t in tickers]
+                for t in tickers:
+                    uncoalesced += len({i for portfolio_id in holders.get(seeding.ticker_for(t), ()) for i in watchers.get(portfolio_id, ())})
+                t0 = time.perf_counter()
+                await http.post("/assets/prices", json=feed)
+                feed_latencies.append(time.perf_counter() - t0)
+            burst_end = time.perf_counter()
+            await asyncio.sleep(args.settle)
+            per_subscriber = [len(s.received) for s in subscribers]
+            gaps = [b[0] - a[0] for s in subscribers for a, b in zip(s.received, s.received[1:])]
+            # Each subscriber's last message carries the last feed's values (if they concern it)
+            delivery = [s.received[-1][0] - burst_end for s in subscribers if s.received and s.received[-1][0] > burst_end]
+            bursts.append({
+                "burst_s": round(burst_end - burst_start, 3),
+                "windows": math.ceil((burst_end - burst_start) * 1000 / live_valuations.LIVE_VALUATION_WINDOW_MS),
+                "messages": sum(per_subscriber),
+                "uncoalesced_messages": uncoalesced,
+                "max_messages_per_subscriber": max(per_subscriber),
+                "min_gap_ms": round(min(gaps) * 1000, 1) if gaps else None,
+                "subscribers_updated": sum(1 for n in per_subscriber if n),
+                "feed_ms_p50": round(sorted(feed_latencies)[len(feed_latencies) // 2] * 1000, 2),
+                "delivery": latency_summary(delivery, args.settle)
+            })
+            print(json.dumps(bursts[-1]), flush=True)
+
+        final = (await http.post("/portfolios/valuations", json={"portfolio_ids": list(range(1, args.clients + 1)), "include_holdings": False})).json()
+        totals = {v["portfolio_id"]: v["total_value"] for v in final}
+        consistent = all(abs(s.values[p] - totals[p]) < 1e-6 for s in subscribers for p in s.portfolio_ids)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {"connect_s": round(connect_s, 2), "bursts": bursts, "final_values_consistent": consistent}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live valuation WebSocket load test")
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--portfolios", type=int, default=5, help="Portfolios per subscriber")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--feeds", type=int, default=20, help="Price feeds per burst")
+    parser.add_argument("--tickers", type=int, default=50, help="Assets repriced per feed")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to collect messages after a burst")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--assets", type=int, default=5000)
+    parser.add_argument("--holdings", type=int, default=20, help="Holdings per portfolio")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--seed-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed_only:
+        database.create_db_and_tables()
+        seeding.seed_database(database.engine, args.clients, args.assets, args.clients * args.holdings)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # As in async_load: the database URL is relative to the working directory
+        subprocess.run(
+            [sys.executable, "-m", "backend.benchmarks.live_valuations", "--seed-only",
+             "--clients", str(args.clients), "--assets", str(args.assets), "--holdings", str(args.holdings)],
+            cwd=tmp, env=dict(os.environ, PYTHONPATH=APP_DIR), check=True
+        )
+        port = free_port()
+        server = start_server("backend.main:app", port, tmp)
+        try:
+            results = asyncio.run(drive(f"http://127.0.0.1:{port}", args))
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps({"commit": git_commit(), "subscribers": args.subscribers, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
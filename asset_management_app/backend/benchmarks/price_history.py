@@ -0,0 +1,140 @@
+# The memory-mapped price history (price_history.py) against the same ticks as rows of a
+# SQLite table (asset_id, ts, price) with a primary key on (asset_id, ts):
+#   - append: one feed of every asset per day, for --days days
+#   - size on disk
+#   - range read: one asset's ticks over a random 90 day window
+#   - portfolio history: daily values of a --holdings asset portfolio over a year
+# The store is written to a temporary directory, so page cache effects favour both sides alike.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.price_history --assets 5000 --days 730
+import argparse
+import calendar
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from .. import price_history
+from .common import git_commit, latency_summary
+
+DAY = 86400
+START = date(2024, 1, 1)
+
+
+def directory_size(path: str) -> int:
+    # Allocated bytes, since the data files are sparse until written
+    return sum(os.stat(os.path.join(path, name)).st_blocks * 512 for name in os.listdir(path))
+
+
+def sql_portfolio_history(conn, holdings, start: date, end: date):
+    # The row store equivalent: each holding's last price at or before every day's end (UTC)
+    values = []
+    day = start
+    while day <= end:
+        day_end = calendar.timegm((day + timedelta(days=1)).timetuple()) - 1
+        value = 0.0
+        for asset_id, quantity in holdings:
+            row = conn.execute(
+                "SELECT price FROM ticks WHERE asset_id = ? AND ts <= ? ORDER BY ts DESC LIMIT 1", (asset_id, day_end)
+            ).fetchone()
+            if row:
+                value += row[0] * quantity
+        values.append(value)
+        day += timedelta(days=1)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped price history vs SQLite rows")
+    parser.add_argument("--assets", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=730, help="Daily feeds of every asset")
+    parser.add_argument("--holdings", type=int, default=50, help="Assets in the valued portfolio")
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    np_rng = np.random.default_rng(args.seed)
+    asset_ids = np.arange(1, args.assets + 1)
+    first_ts = calendar.timegm(START.timetuple()) + 16 * 3600
+    feeds = [(first_ts + day * DAY, 10 + np_rng.random(args.assets) * 90) for day in range(args.days)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = price_history.PriceHistoryStore(os.path.join(directory, "mmap"))
+        start = time.perf_counter()
+        for ts, prices in feeds:
+            store.append(asset_ids, prices, ts)
+        store.flush()
+        mmap_append_s = time.perf_counter() - start
+
+        conn = sqlite3.connect(os.path.join(directory, "ticks.db"))
+        conn.execute("CREATE TABLE ticks (asset_id INTEGER, ts INTEGER, price REAL, PRIMARY KEY (asset_id, ts)) WITHOUT ROWID")
+        start = time.perf_counter()
+        for ts, prices in feeds:
+            conn.executemany("INSERT INTO ticks VALUES (?, ?, ?)", zip(asset_ids.tolist(), [ts] * args.assets, prices.tolist()))
+            conn.commit()
+        sql_append_s = time.perf_counter() - start
+        sql_size = os.path.getsize(os.path.join(directory, "ticks.db"))
+
+        windows = []
+        for _ in range(args.reads):
+            asset_id = rng.randint(1, args.assets)
+            window_start = first_ts + rng.randrange(max(args.days - 90, 1)) * DAY
+            windows.append((asset_id, window_start, window_start + 90 * DAY))
+
+        def time_reads(read):
+            latencies = []
+            begin = time.perf_counter()
+            for asset_id, lo, hi in windows:
+                t = time.perf_counter()
+                read(asset_id, lo, hi)
+                latencies.append(time.perf_counter() - t)
+            return latency_summary(latencies, time.perf_counter() - begin)
+
+        mmap_reads = time_reads(store.range)
+        sql_reads = time_reads(lambda asset_id, lo, hi: conn.execute(
+            "SELECT ts, price FROM ticks WHERE asset_id = ? AND ts BETWEEN ? AND ? ORDER BY ts", (asset_id, lo, hi)
+        ).fetchall())
+
+        holdings = [(asset_id, float(rng.randint(1, 500))) for asset_id in rng.sample(range(1, args.assets + 1), args.holdings)]
+        end = START + timedelta(days=args.days - 1)
+        year_start = end - timedelta(days=364)
+        start = time.perf_counter()
+        history = price_history.portfolio_value_history(store, holdings, year_start, end)
+        mmap_portfolio_s = time.perf_counter() - start
+        start = time.perf_counter()
+        sql_values = sql_portfolio_history(conn, holdings, year_start, end)
+        sql_portfolio_s = time.perf_counter() - start
+
+        results = {
+            "ticks": args.assets * args.days,
+            "mmap": {
+                "append_s": round(mmap_append_s, 2),
+                "ticks_per_s": round(args.assets * args.days / mmap_append_s),
+                "size_mb": round(directory_size(os.path.join(directory, "mmap")) / 2**20, 1),
+                "range_90d": mmap_reads,
+                "portfolio_history_365d_ms": round(mmap_portfolio_s * 1000, 2)
+            },
+            "sqlite": {
+                "append_s": round(sql_append_s, 2),
+                "ticks_per_s": round(args.assets * args.days / sql_append_s),
+                "size_mb": round(sql_size / 2**20, 1),
+                "range_90d": sql_reads,
+                "portfolio_history_365d_ms": round(sql_portfolio_s * 1000, 2)
+            },
+            # Both compute the same series; a mismatch is a bug, not noise
+            "portfolio_history_matches": bool(np.allclose(history["values"], sql_values))
+        }
+        conn.close()
+
+    print(json.dumps({"commit": git_commit(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Query-count regression check for the portfolio endpoints. Each endpoint is called
+# for portfolios of increasing size on a scratch SQLite database, counting the SQL
+# statements it executes. Fails (exit status 1) if an endpoint's count depends on
+# the number of holdings or exceeds its budget in QUERY_BUDGETS, so an N+1 pattern
+# or an extra reload shows up before it ships.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.query_counts
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+# Statements per request, independent of portfolio size
+QUERY_BUDGETS = {
+    "POST /clients/{id}/portfolio (create)": 5, # client + portfolio, INSERT portfolio, prices, INSERT holdings, UPDATE total_value
+    "POST /clients/{id}/portfolio (replace)": 7, # client + portfolio, holdings, prices, DELETE, UPDATE, INSERT, UPDATE portfolio
+    "PATCH /clients/{id}/portfolio": 7,
+    "GET /clients/{id}/portfolio": 2, # client + portfolio, holdings joined to assets
+    "GET /clients/{id}": 3, # client + portfolio versions, portfolios, holdings
+    "GET /clients/{id}/portfolio (304)": 1, # client + portfolio
+    "GET /clients/{id} (304)": 1, # client + portfolio versions
+    "POST /rebalance/proposals": 3, # portfolios, target assets, holdings joined to assets (per batch of portfolios)
+    "POST /rebalance/apply": 7, # portfolios, holdings, prices, DELETE, UPDATE, INSERT, UPDATE portfolios
+}
+
+
+def measure(sizes):
+    # Imported here so DATABASE_URL points at the scratch database first
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    from .. import database, main
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for counted_engine in (database.engine, database.async_engine.sync_engine):
+        event.listen(counted_engine, "before_cursor_execute", count)
+
+    client = TestClient(main.app)
+    max_size = max(sizes)
+    asset_ids = [
+        client.post("/assets/", json={
+            "name": f"Asset {i}", "ticker_symbol": "Q" + chr(65 + i // 26 % 26) + chr(65 + i % 26),
+            "asset_type": "Stock", "current_price": 1.0 + i
+        }).json()["id"]
+        for i in range(2 * max_size)
+    ]
+
+    def call(method, path, expected_status=200, **kwargs):
+        statements.clear()
+        response = client.request(method, path, **kwargs)
+        assert response.status_code == expected_status, (method, path, response.status_code, response.text)
+        return len(statements)
+
+    counts = {name: {} for name in QUERY_BUDGETS}
+    for size in sizes:
+        client_id = client.post("/clients/", json={
+            "first_name": "Query", "last_name": f"Count{size}", "email": f"query.count{size}@example.com", "risk_profile": "medium"
+        }).json()["id"]
+        holdings = [{"asset_id": a, "quantity": 1.0} for a in asset_ids[:size]]
+        counts["POST /clients/{id}/portfolio (create)"][size] = call(
+            "POST", f"/clients/{client_id}/portfolio", json={"name": "Main", "assets": holdings}
+        )
+        # Half the holdings change quantity, half are replaced by other assets
+        replacement = [{"asset_id": a, "quantity": 2.0} for a in asset_ids[:size // 2]] + \
+            [{"asset_id": a, "quantity": 1.0} for a in asset_ids[max_size:max_size + size // 2]]
+        counts["POST /clients/{id}/portfolio (replace)"][size] = call(
+            "POST", f"/clients/{client_id}/portfolio", json={"name": "Main", "assets": replacement}
+        )
+        counts["PATCH /clients/{id}/portfolio"][size] = call(
+            "PATCH", f"/clients/{client_id}/portfolio", json={
+                "upsert": [{"asset_id": h["asset_id"], "quantity": 3.0} for h in replacement[:size // 2]],
+                "remove": [h["asset_id"] for h in replacement[size // 2:]]
+            }
+        )
+        counts["GET /clients/{id}/portfolio"][size] = call("GET", f"/clients/{client_id}/portfolio")
+        counts["GET /clients/{id}"][size] = call("GET", f"/clients/{client_id}")
+        # Revalidation with the ETags just received
+        for name, path in (("GET /clients/{id}/portfolio (304)", f"/clients/{client_id}/portfolio"), ("GET /clients/{id} (304)", f"/clients/{client_id}")):
+            etag = client.get(path).headers["ETag"]
+            counts[name][size] = call("GET", path, expected_status=304, headers={"If-None-Match": etag})
+        # Rebalance into one held and one new asset, selling the rest: every kind of holding write
+        client.post(f"/clients/{client_id}/portfolio", json={"name": "Main", "assets": holdings})
+        portfolio_id = client.get(f"/clients/{client_id}").json()["portfolios"][0]["id"]
+        statements.clear()
+        proposal = client.post("/rebalance/proposals", json={
+            "portfolio_ids": [portfolio_id], "asset_weights": {str(asset_ids[0]): 1.0, str(asset_ids[-1]): 1.0}
+        })
+        assert proposal.status_code == 200, proposal.text
+        counts["POST /rebalance/proposals"][size] = len(statements)
+        counts["POST /rebalance/apply"][size] = call("POST", "/rebalance/apply", json={"portfolios": proposal.json()["portfolios"]})
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that portfolio endpoints cost a constant number of queries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 20, 200], help="Holdings per portfolio")
+    args = parser.parse_args()
+    if min(args.sizes) < 2:
+        parser.error("sizes must be at least 2, so every write touches inserted, updated and removed holdings")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'query_counts.db')}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        os.environ["PRICE_HISTORY_DIR"] = os.path.join(tmp, "price_history")
+        counts = measure(args.sizes)
+
+    failures = []
+    for name, by_size in counts.items():
+        if len(set(by_size.values())) > 1:
+            failures.append(f"{name}: query count grows with portfolio size {by_size}")
+        elif max(by_size.values()) > QUERY_BUDGETS[name]:
+            failures.append(f"{name}: {max(by_size.values())} queries, budget is {QUERY_BUDGETS[name]}")
+
+    print(json.dumps({"budgets": QUERY_BUDGETS, "counts": counts, "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
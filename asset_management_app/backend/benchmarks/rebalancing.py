@@ -0,0 +1,109 @@
+# Rebalancing (rebalancing.py) on a seeded scratch database: time to propose trades for a
+# whole risk-profile cohort with each kind of target, against the same computation as a
+# per-portfolio Python loop and the array math alone (both without loading and shaping),
+# then time to apply the proposal in one transaction.
+# Checks that the loop and the array version propose the same trades and that no
+# portfolio's materialized total_value drifted after the apply (crud.check_portfolio_values).
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.rebalancing --clients 30000 --holdings 20
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+def loop_targets_by_asset(rows, weights: dict, prices: dict):
+    # Reference implementation: one portfolio at a time, with dicts
+    by_portfolio = defaultdict(dict)
+    for row in rows:
+        by_portfolio[row.portfolio_id][row.asset_id] = row.quantity
+    total_weight = sum(weights.values())
+    trades = {}
+    for portfolio_id, held in by_portfolio.items():
+        total = sum(quantity * prices[asset_id] for asset_id, quantity in held.items())
+        for asset_id in sorted(set(held) | set(weights)):
+            current = held.get(asset_id, 0.0)
+            target = round(total * weights.get(asset_id, 0.0) / total_weight / prices[asset_id], 6)
+            if abs(target - current) >= 1e-6:
+                trades[(portfolio_id, asset_id)] = target
+    return trades
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized cohort rebalancing vs a per-portfolio loop")
+    parser.add_argument("--clients", type=int, default=30000)
+    parser.add_argument("--assets", type=int, default=5000)
+    parser.add_argument("--holdings", type=int, default=20, help="Holdings per portfolio")
+    parser.add_argument("--targets", type=int, default=20, help="Assets in the asset_weights target")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'rebalancing.db')}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        # Imported here so DATABASE_URL points at the scratch database first
+        from .. import crud, database, models, rebalancing, seeding
+        from .common import git_commit
+
+        database.create_db_and_tables()
+        seeding.seed_database(database.engine, args.clients, args.assets, args.clients * args.holdings, seed=args.seed)
+        rng = random.Random(args.seed)
+        asset_weights = {asset_id: rng.uniform(0.5, 2.0) for asset_id in rng.sample(range(1, args.assets + 1), args.targets)}
+        requests = {
+            "asset_weights": models.RebalanceRequest(risk_profile="medium", asset_weights=asset_weights),
+            "asset_type_weights": models.RebalanceRequest(risk_profile="medium", asset_type_weights={"Stock": 0.5, "Bond": 0.3, "ETF": 0.2}),
+            "recommendations": models.RebalanceRequest(risk_profile="medium", recommendation_trend="neutral")
+        }
+
+        results = {}
+        with database.SessionLocal() as db:
+            for name, request in requests.items():
+                start = time.perf_counter()
+                proposal = rebalancing.propose_rebalance(db, request)
+                results[name] = {
+                    "propose_s": round(time.perf_counter() - start, 3),
+                    "portfolios": proposal["portfolios_considered"],
+                    "trades": proposal["trades"]
+                }
+                print(name, json.dumps(results[name]), flush=True)
+
+            # The loop on the same rows (loading excluded), for the asset_weights targets
+            proposal = rebalancing.propose_rebalance(db, requests["asset_weights"])
+            portfolio_ids = [p.id for p in crud.get_rebalance_portfolios(db, risk_profile="medium", limit=rebalancing.REBALANCE_MAX_PORTFOLIOS)]
+            rows = crud.get_rebalance_holdings(db, portfolio_ids)
+            prices = {asset_id: price for asset_id, (_, price, _) in crud.get_rebalance_assets(db, range(1, args.assets + 1)).items()}
+            start = time.perf_counter()
+            loop_trades = loop_targets_by_asset(rows, asset_weights, prices)
+            results["asset_weights"]["python_loop_compute_s"] = round(time.perf_counter() - start, 3)
+            # The array math alone on the same rows, as one batch
+            asset_ids = np.arange(1, args.assets + 1)
+            price_array = np.array([prices[a] for a in asset_ids.tolist()])
+            weight_array = np.zeros(args.assets)
+            weight_array[np.array(list(asset_weights)) - 1] = list(asset_weights.values())
+            portfolio_column, asset_column, quantity_column = (np.array(c) for c in list(zip(*rows))[:3])
+            start = time.perf_counter()
+            holdings = rebalancing.Holdings(np.searchsorted(np.array(portfolio_ids), portfolio_column), asset_column - 1, quantity_column)
+            _, asset, current, target, _ = rebalancing.targets_by_asset(holdings, len(portfolio_ids), price_array, weight_array / weight_array.sum())
+            rebalancing.trade_mask(current, target, price_array[asset], 0.0)
+            results["asset_weights"]["array_compute_s"] = round(time.perf_counter() - start, 3)
+            array_trades = {(p["portfolio_id"], t["asset_id"]): t["target_quantity"] for p in proposal["portfolios"] for t in p["trades"]}
+            results["asset_weights"]["loop_matches"] = loop_trades.keys() == array_trades.keys() and all(
+                abs(loop_trades[k] - array_trades[k]) <= 1e-6 for k in loop_trades
+            )
+
+            start = time.perf_counter()
+            applied = rebalancing.apply_rebalance(db, models.RebalanceApplyRequest(portfolios=proposal["portfolios"]))
+            results["apply"] = {"apply_s": round(time.perf_counter() - start, 3), **applied}
+            results["apply"]["drifted_portfolios"] = len(crud.check_portfolio_values(db))
+
+    print(json.dumps({"commit": git_commit(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Compares the list endpoints' serialization paths on large pages: the previous path
+# (ORM objects validated through response_model, encoded with the json module) against
+# the current one in main.py (plain rows shaped into dicts, no validation, orjson).
+# Both apps run in-process on the same seeded scratch database; the responses are
+# checked to be identical before timing.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.serialization --rows 10000
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import List
+
+from .common import git_commit, latency_summary
+
+
+def make_orm_app():
+    # The list endpoints as they were: ORM rows, response_model validation, JSONResponse
+    from fastapi import Depends, FastAPI
+    from fastapi.responses import JSONResponse
+    from sqlalchemy.orm import Session
+
+    from .. import crud, database, models
+
+    orm_app = FastAPI(default_response_class=JSONResponse)
+
+    @orm_app.get("/clients/", response_model=List[models.Client])
+    def read_all_clients(limit: int = 100, db: Session = Depends(database.get_db)):
+        return crud.get_clients_page(db, after_id=None, limit=limit)
+
+    @orm_app.get("/assets/", response_model=List[models.Asset])
+    def read_all_assets(limit: int = 100, db: Session = Depends(database.get_db)):
+        return crud.get_assets_page(db, after_id=None, limit=limit)
+
+    return orm_app
+
+
+def time_requests(client, path: str, repeat: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        request_start = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - request_start)
+        assert response.status_code == 200, response.text
+    return latency_summary(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ORM + validation + json vs rows + orjson on the list endpoints")
+    parser.add_argument("--rows", type=int, default=10000, help="Page size (limit), and clients / assets seeded")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'serialization.db')}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        os.environ["PRICE_HISTORY_DIR"] = os.path.join(tmp, "price_history")
+        from fastapi.testclient import TestClient
+
+        from .. import database, main as api, seeding # Engine is created on import, from DATABASE_URL
+
+        seeding.seed_database(database.engine, clients=args.rows, assets=args.rows, holdings=args.rows * 5)
+        fast = TestClient(api.app)
+        orm = TestClient(make_orm_app())
+
+        results = {}
+        for path in (f"/clients/?limit={args.rows}", f"/assets/?limit={args.rows}"):
+            if json.loads(fast.get(path).content) != json.loads(orm.get(path).content):
+                raise SystemExit(f"{path}: fast and ORM responses differ")
+            before = time_requests(orm, path, args.repeat)
+            after = time_requests(fast, path, args.repeat)
+            results[path] = {
+                "orm_validated_json": before,
+                "rows_orjson": after,
+                "p50_speedup": round(before["p50_ms"] / after["p50_ms"], 2)
+            }
+
+    print(json.dumps({"commit": git_commit(), "rows": args.rows, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
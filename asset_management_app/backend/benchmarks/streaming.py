@@ -0,0 +1,104 @@
+# Compares the buffered and streamed (?stream=true) list responses, uncompressed and
+# compressed with gzip and zstd. Reports the time to first byte, total time, bytes on the wire
+# and peak Python memory allocated while serving one request (tracemalloc). The app is
+# called directly as an ASGI application, so the time at which each body chunk leaves
+# the app is observed exactly, without a network or client-side buffering.
+#
+# Run from the asset_management_app directory:
+#     python -m backend.benchmarks.streaming --rows 50000 100000 200000
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from .. import pagination
+from .common import git_commit
+
+ENCODINGS = ("identity", "gzip", "zstd")
+
+
+async def serve(app, path: str, accept_encoding: str) -> dict:
+    # One GET through the ASGI app; records when the first body bytes were sent
+    query = ""
+    if "?" in path:
+        path, query = path.split("?", 1)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"benchmark"), (b"accept-encoding", accept_encoding.encode())],
+        "client": ("127.0.0.1", 1), "server": ("benchmark", 80)
+    }
+    result = {"status": None, "first_byte": None, "bytes": 0}
+    request_sent = False
+
+    async def receive():
+        # The (empty) request body, then nothing: the client never disconnects
+        nonlocal request_sent
+        if request_sent:
+            await asyncio.Event().wait()
+        request_sent = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            if body and result["first_byte"] is None:
+                result["first_byte"] = time.perf_counter()
+            result["bytes"] += len(body)
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    result["total"] = time.perf_counter() - start
+    result["first_byte"] = (result["first_byte"] or time.perf_counter()) - start
+    return result
+
+
+def measure(app, path: str, accept_encoding: str, repeat: int) -> dict:
+    timings = [asyncio.run(serve(app, path, accept_encoding)) for _ in range(repeat)]
+    tracemalloc.start()
+    asyncio.run(serve(app, path, accept_encoding))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert all(t["status"] == 200 for t in timings), timings
+    return {
+        "ttfb_ms": round(min(t["first_byte"] for t in timings) * 1000, 1),
+        "total_ms": round(min(t["total"] for t in timings) * 1000, 1),
+        "bytes": timings[0]["bytes"],
+        "peak_memory_mb": round(peak / 2**20, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Buffered vs streamed list responses, with and without compression")
+    parser.add_argument("--rows", type=int, nargs="+", default=[50000, 100000, 200000], help="Result sizes (assets listed)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (the best is reported)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'streaming.db')}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        os.environ["PRICE_HISTORY_DIR"] = os.path.join(tmp, "price_history")
+        from .. import database, main as api, seeding # Engine is created on import, from DATABASE_URL
+
+        total = max(args.rows)
+        seeding.seed_database(database.engine, clients=1, assets=total, holdings=0)
+        for rows in args.rows:
+            # The last `rows` assets: stream=true returns everything after the cursor
+            cursor = pagination.encode_cursor(total - rows)
+            results[rows] = {}
+            for mode, path in (("buffered", f"/assets/?limit={rows}&cursor={cursor}"), ("streamed", f"/assets/?stream=true&cursor={cursor}")):
+                for encoding in ENCODINGS:
+                    results[rows][f"{mode}_{encoding}"] = measure(api.app, path, encoding, args.repeat)
+                    print(rows, mode, encoding, results[rows][f"{mode}_{encoding}"], flush=True)
+
+    print(json.dumps({"commit": git_commit(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
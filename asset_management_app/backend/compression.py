@@ -0,0 +1,147 @@
+import os
+import zlib
+from typing import Optional
+
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Response compression. Bodies of at least COMPRESSION_MINIMUM_SIZE bytes are compressed
+# with zstd or gzip, whichever the client accepts (zstd preferred: it compresses JSON
+# better than gzip at a fraction of the CPU). Smaller bodies, 304s and responses that
+# already have a Content-Encoding are sent as they are.
+# Every response reaches this middleware as a stream (the metrics middleware in main.py
+# re-streams bodies), so the start of the body is buffered until either the threshold is
+# reached or the body ends. From then on each chunk is compressed and flushed as it
+# arrives, so streamed responses still stream.
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024")) # Bytes
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5")) # 1-9; higher levels cost far more CPU for little gain on JSON
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3")) # 1-22
+
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+
+class GzipEncoder:
+    content_encoding = "gzip"
+
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits 31: gzip container
+
+    def encode(self, data: bytes, more_body: bool) -> bytes:
+        # Sync-flushes after each chunk of a stream, so it reaches the client now
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+
+class ZstdEncoder:
+    content_encoding = "zstd"
+
+    def __init__(self, level: int):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def encode(self, data: bytes, more_body: bool) -> bytes:
+        compressed = self.compressor.compress(data)
+        if more_body:
+            return compressed + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return compressed + self.compressor.flush()
+
+
+def preferred_encoding(accept_encoding: str) -> Optional[str]:
+    # "zstd" or "gzip" from an Accept-Encoding header (codings with q=0 are refused), or None
+    accepted = set()
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    for encoding in ("zstd", "gzip"):
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, send: Send, minimum_size: int, encoder):
+        self.app = app
+        self.send = send
+        self.minimum_size = minimum_size
+        self.encoder = encoder
+        self.start_message: Optional[Message] = None
+        self.buffer = b""
+        self.mode = None # None while buffering, then "identity" or "compress"
+
+    async def __call__(self, scope: Scope, receive: Receive):
+        await self.app(scope, receive, self.send_with_compression)
+
+    async def send_with_compression(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            if (
+                message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or headers.get("content-type", "").startswith(EXCLUDED_CONTENT_TYPES)
+            ):
+                self.mode = "identity"
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.mode == "identity":
+            await self.send(message)
+        elif self.mode == "compress":
+            await self.send({"type": "http.response.body", "body": self.encoder.encode(body, more_body), "more_body": more_body})
+        else:
+            self.buffer += body
+            if more_body and len(self.buffer) < self.minimum_size:
+                return # Keep buffering until the threshold or the end of the body
+            body, self.buffer = self.buffer, b""
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if len(body) < self.minimum_size:
+                # The whole body, below the threshold
+                self.mode = "identity"
+            else:
+                self.mode = "compress"
+                body = self.encoder.encode(body, more_body)
+                headers["Content-Encoding"] = self.encoder.content_encoding
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        gzip_level: int = GZIP_LEVEL,
+        zstd_level: int = ZSTD_LEVEL
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = preferred_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        encoder = ZstdEncoder(self.zstd_level) if encoding == "zstd" else GzipEncoder(self.gzip_level)
+        await CompressionResponder(self.app, send, self.minimum_size, encoder)(scope, receive)
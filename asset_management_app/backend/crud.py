@@ -1,5 +1,40 @@
-from sqlalchemy.orm import Session
-from . import models, database # database.py contains DbClient, DbAsset, DbPortfolio, PortfolioAssetAssociation
+import time
+from typing import List, Optional
+from pydantic import ValidationError
+from sqlalchemy import and_, bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
+from . import models, database, ai_engine, asset_search, live_valuations, price_history # database.py contains DbClient, DbAsset, DbPortfolio, PortfolioAssetAssociation
+
+def prefix_filter(column, prefix: str):
+    # column LIKE 'prefix%' written as a range, so that an index on column can be used
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper_bound)
+
+# Change tracking for the ETags in main.py: rows carry a version column bumped by every
+# write below, and whole-table reads (the asset list) use a per-table counter in
+# table_versions. Both are bumped in the same transaction as the write.
+def bump_row_version(db_obj):
+    # Incremented in SQL at flush, so concurrent writers cannot both produce the same version
+    db_obj.version = type(db_obj).version + 1
+
+def bump_table_version(db, table_name: str):
+    # db is a Session or a Connection
+    db.execute(update(database.DbTableVersion).where(
+        database.DbTableVersion.table_name == table_name
+    ).values(version=database.DbTableVersion.version + 1))
+
+def get_table_version(db: Session, table_name: str) -> int:
+    return db.scalar(select(database.DbTableVersion.version).where(
+        database.DbTableVersion.table_name == table_name
+    )) or 0
+
+def client_versions_stmt(client_id: int):
+    # The client row plus (id, version) of each of its portfolios, in one outer join:
+    # everything the client detail ETag depends on
+    return select(database.DbClient, database.DbPortfolio.id, database.DbPortfolio.version).outerjoin(
+        database.DbPortfolio, database.DbPortfolio.client_id == database.DbClient.id
+    ).where(database.DbClient.id == client_id).order_by(database.DbPortfolio.id)
 
 # Client CRUD Operations
 def get_client(db: Session, client_id: int):
@@ -8,8 +43,73 @@ def get_client(db: Session, client_id: int):
 def get_client_by_email(db: Session, email: str):
     return db.query(database.DbClient).filter(database.DbClient.email == email).first()
 
-def get_clients(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(database.DbClient).offset(skip).limit(limit).all()
+def filter_clients(query, name_prefix: Optional[str] = None):
+    if name_prefix:
+        query = query.filter(prefix_filter(database.DbClient.last_name, name_prefix))
+    return query
+
+def get_clients(db: Session, skip: int = 0, limit: int = 100, name_prefix: Optional[str] = None):
+    return filter_clients(db.query(database.DbClient), name_prefix).offset(skip).limit(limit).all()
+
+def get_clients_page(db: Session, after_id: Optional[int] = None, limit: int = 100, name_prefix: Optional[str] = None):
+    # Keyset pagination: seeks past after_id on the primary key instead of OFFSET
+    query = filter_clients(db.query(database.DbClient), name_prefix)
+    if after_id is not None:
+        query = query.filter(database.DbClient.id > after_id)
+    return query.order_by(database.DbClient.id).limit(limit).all()
+
+def client_rows_stmt(after_id: Optional[int] = None, name_prefix: Optional[str] = None):
+    # Clients as plain (id, first_name, last_name, email, risk_profile) rows, for the list
+    # and export endpoints, which serialize them without building ORM objects or models
+    stmt = select(
+        database.DbClient.id,
+        database.DbClient.first_name,
+        database.DbClient.last_name,
+        database.DbClient.email,
+        database.DbClient.risk_profile
+    )
+    if name_prefix:
+        stmt = stmt.where(prefix_filter(database.DbClient.last_name, name_prefix))
+    if after_id is not None:
+        stmt = stmt.where(database.DbClient.id > after_id)
+    return stmt
+
+def get_client_rows(db: Session, skip: int = 0, limit: int = 100, name_prefix: Optional[str] = None):
+    return db.execute(client_rows_stmt(name_prefix=name_prefix).offset(skip).limit(limit)).all()
+
+def get_client_rows_page(db: Session, after_id: Optional[int] = None, limit: int = 100, name_prefix: Optional[str] = None):
+    return db.execute(client_rows_stmt(after_id, name_prefix).order_by(database.DbClient.id).limit(limit)).all()
+
+def get_portfolio_rows_for_clients(db: Session, client_ids: List[int]):
+    # (id, name, client_id, total_value) rows of all the given clients' portfolios in one
+    # IN query, instead of lazy-loading each client's portfolios
+    if not client_ids:
+        return []
+    return db.execute(
+        select(
+            database.DbPortfolio.id,
+            database.DbPortfolio.name,
+            database.DbPortfolio.client_id,
+            database.DbPortfolio.total_value
+        ).where(database.DbPortfolio.client_id.in_(client_ids)).order_by(database.DbPortfolio.id)
+    ).all()
+
+def iter_client_chunks(db: Session, chunk_size: int = 1000, after_id: Optional[int] = None, name_prefix: Optional[str] = None):
+    # Streams the (filtered) client rows in id order from a server-side cursor, chunk_size
+    # at a time, each chunk paired with its clients' portfolio rows (one IN query per chunk)
+    stmt = client_rows_stmt(after_id, name_prefix).order_by(database.DbClient.id).execution_options(yield_per=chunk_size)
+    for partition in db.execute(stmt).partitions():
+        yield partition, get_portfolio_rows_for_clients(db, [row.id for row in partition])
+
+def iter_client_rows(db: Session, page_size: int = 1000, name_prefix: Optional[str] = None):
+    # Every client row, fetched page by page with the same keyset seek, for full-table exports
+    after_id = None
+    while True:
+        rows = get_client_rows_page(db, after_id=after_id, limit=page_size, name_prefix=name_prefix)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1].id
 
 def create_client(db: Session, client: models.ClientCreate):
     db_client = database.DbClient(
@@ -30,6 +130,7 @@ def update_client(db: Session, client_id: int, client_update: models.ClientCreat
         db_client.last_name = client_update.last_name
         db_client.email = client_update.email
         db_client.risk_profile = client_update.risk_profile
+        bump_row_version(db_client)
         db.commit()
         db.refresh(db_client)
     return db_client
@@ -48,16 +149,287 @@ def get_asset(db: Session, asset_id: int):
 def get_asset_by_ticker(db: Session, ticker_symbol: str):
     return db.query(database.DbAsset).filter(database.DbAsset.ticker_symbol == ticker_symbol).first()
 
-def get_assets(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(database.DbAsset).offset(skip).limit(limit).all()
+def filter_assets(query, asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    if asset_type:
+        query = query.filter(database.DbAsset.asset_type == asset_type)
+    if name_prefix:
+        query = query.filter(prefix_filter(database.DbAsset.name, name_prefix))
+    return query
+
+def get_assets(db: Session, skip: int = 0, limit: int = 100, asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    return filter_assets(db.query(database.DbAsset), asset_type, name_prefix).offset(skip).limit(limit).all()
+
+def get_assets_page(db: Session, after_id: Optional[int] = None, limit: int = 100, asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    # Keyset pagination: seeks past after_id on the primary key (or the (asset_type, id)
+    # index when filtering by type) instead of OFFSET
+    query = filter_assets(db.query(database.DbAsset), asset_type, name_prefix)
+    if after_id is not None:
+        query = query.filter(database.DbAsset.id > after_id)
+    return query.order_by(database.DbAsset.id).limit(limit).all()
+
+def asset_rows_stmt(after_id: Optional[int] = None, asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    # Assets as plain (id, name, ticker_symbol, asset_type, current_price) rows, for the
+    # list and export endpoints
+    stmt = select(
+        database.DbAsset.id,
+        database.DbAsset.name,
+        database.DbAsset.ticker_symbol,
+        database.DbAsset.asset_type,
+        database.DbAsset.current_price
+    )
+    if asset_type:
+        stmt = stmt.where(database.DbAsset.asset_type == asset_type)
+    if name_prefix:
+        stmt = stmt.where(prefix_filter(database.DbAsset.name, name_prefix))
+    if after_id is not None:
+        stmt = stmt.where(database.DbAsset.id > after_id)
+    return stmt
+
+def get_asset_rows(db: Session, skip: int = 0, limit: int = 100, asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    return db.execute(asset_rows_stmt(asset_type=asset_type, name_prefix=name_prefix).offset(skip).limit(limit)).all()
+
+def get_asset_rows_page(db: Session, after_id: Optional[int] = None, limit: int = 100, asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    return db.execute(asset_rows_stmt(after_id, asset_type, name_prefix).order_by(database.DbAsset.id).limit(limit)).all()
+
+def iter_asset_rows(db: Session, page_size: int = 1000, asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    # Every asset row, fetched page by page with the same keyset seek, for full-table exports
+    after_id = None
+    while True:
+        rows = get_asset_rows_page(db, after_id=after_id, limit=page_size, asset_type=asset_type, name_prefix=name_prefix)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1].id
+
+def iter_asset_chunks(db: Session, chunk_size: int = 5000, after_id: Optional[int] = None, asset_type: Optional[str] = None, name_prefix: Optional[str] = None, last_id: Optional[int] = None):
+    # Streams the (filtered) asset table in id order as lists of lightweight
+    # (id, name, ticker_symbol, asset_type, current_price) rows, chunk_size rows at a time,
+    # optionally stopping at last_id (inclusive).
+    # yield_per reads from a server-side cursor and keeps only one chunk in memory; no ORM
+    # objects or Pydantic models are built.
+    stmt = asset_rows_stmt(after_id, asset_type, name_prefix)
+    if last_id is not None:
+        stmt = stmt.where(database.DbAsset.id <= last_id)
+    stmt = stmt.order_by(database.DbAsset.id).execution_options(yield_per=chunk_size)
+    for partition in db.execute(stmt).partitions():
+        yield partition
 
 def create_asset(db: Session, asset: models.AssetCreate):
-    db_asset = database.DbAsset(**asset.dict())
+    db_asset = database.DbAsset(**asset.model_dump())
     db.add(db_asset)
+    bump_table_version(db, "assets")
     db.commit()
     db.refresh(db_asset)
+    ai_engine.recommendation_cache.invalidate() # The asset universe changed
+    asset_search.asset_index.add(db_asset.id, db_asset.name, db_asset.ticker_symbol, db_asset.asset_type)
     return db_asset
 
+def record_initial_prices(db: Session, after_id: int = 0):
+    # Appends a tick at the current price of each asset after after_id that has none in
+    # the price history yet, so an asset's price is recorded before its first price feed.
+    # Called with committed assets only (the files are not rolled back): by the asset
+    # creation routes, and at startup for seeded assets or those predating the history.
+    store = price_history.get_store()
+    now = int(time.time())
+    for chunk in iter_asset_chunks(db, after_id=after_id):
+        priced = [(row[0], row[4]) for row in chunk if row[4] is not None]
+        recorded = store.recorded([asset_id for asset_id, _ in priced])
+        missing = [pair for pair, has_ticks in zip(priced, recorded) if not has_ticks]
+        store.append([asset_id for asset_id, _ in missing], [price for _, price in missing], now)
+
+def update_asset_search_index(db: Session):
+    # Adds the assets inserted since the index last loaded (all of them at startup).
+    # Small chunks keep each hold of the index lock short.
+    asset_search.asset_index.add_rows(iter_asset_chunks(db, chunk_size=500, after_id=asset_search.asset_index.last_loaded_id))
+
+# Bulk asset ingestion (see POST /assets/bulk)
+BULK_ASSET_BATCH_SIZE = 1000
+
+def insert_asset_batch(db: Session, records, first_row: int, seen_tickers: set):
+    # Validates one batch of (record, error) pairs, skips tickers that already exist
+    # (in the table, checked with one IN query for the whole batch, or earlier in the
+    # same upload via seen_tickers) and inserts the rest with a single executemany.
+    # Does not commit: the caller commits once after the last batch (finish_asset_bulk_load),
+    # so the whole upload is one transaction. Returns one result dict per record.
+    results = []
+    valid = []
+    for row, (record, error) in enumerate(records, start=first_row):
+        if record is None:
+            results.append({"row": row, "status": "invalid", "detail": error})
+            continue
+        try:
+            asset = models.AssetCreate(**record)
+        except (ValidationError, TypeError) as e:
+            results.append({"row": row, "ticker_symbol": record.get("ticker_symbol"), "status": "invalid", "detail": str(e)})
+            continue
+        result = {"row": row, "ticker_symbol": asset.ticker_symbol, "status": "created"}
+        results.append(result)
+        valid.append((result, asset))
+
+    existing = set()
+    if valid:
+        existing = set(db.scalars(select(database.DbAsset.ticker_symbol).where(
+            database.DbAsset.ticker_symbol.in_([asset.ticker_symbol for _, asset in valid])
+        )))
+
+    to_insert = []
+    for result, asset in valid:
+        if asset.ticker_symbol in existing or asset.ticker_symbol in seen_tickers:
+            result["status"] = "duplicate"
+            result["detail"] = "Asset ticker symbol already exists"
+            continue
+        seen_tickers.add(asset.ticker_symbol)
+        to_insert.append((result, asset))
+
+    if to_insert:
+        new_ids = db.scalars(
+            insert(database.DbAsset).returning(database.DbAsset.id, sort_by_parameter_order=True),
+            [asset.model_dump() for _, asset in to_insert]
+        ).all()
+        for (result, _), new_id in zip(to_insert, new_ids):
+            result["id"] = new_id
+    return results
+
+def finish_asset_bulk_load(db: Session, results):
+    # Commits every batch inserted by insert_asset_batch and summarises the per-row results
+    summary = {"created": 0, "duplicate": 0, "invalid": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    if summary["created"]:
+        bump_table_version(db, "assets")
+    db.commit()
+    if summary["created"]:
+        ai_engine.recommendation_cache.invalidate() # The asset universe changed
+        update_asset_search_index(db)
+    return {
+        "created": summary["created"],
+        "duplicates": summary["duplicate"],
+        "invalid": summary["invalid"],
+        "results": results
+    }
+
+# Bulk price updates (see POST /assets/prices)
+PRICE_UPDATE_BATCH_SIZE = 1000
+
+def start_price_update():
+    # Running state for one price feed, passed to apply_price_batch and finish_price_update
+    return {
+        "received": 0,
+        "updated": 0,
+        "unknown": 0,
+        "invalid": 0,
+        "affected_portfolio_ids": set(),
+        "ticker_prices": {}, # ticker -> new price, patched into the recommendation cache once committed
+        "history_prices": {} # asset_id -> price, appended to the price history once committed (publish_price_update)
+    }
+
+def apply_price_batch(db: Session, records, state: dict):
+    # Applies one batch of (record, error) pairs, each record holding ticker_symbol and
+    # current_price. Tickers are resolved with one IN query and the prices written with
+    # a single executemany UPDATE by primary key; portfolios holding any updated asset
+    # are collected for the summary. Later ticks for the same ticker win.
+    # Does not commit: the caller commits once after the last batch (finish_price_update).
+    prices = {}
+    for record, error in records:
+        state["received"] += 1
+        try:
+            if record is None:
+                raise ValueError(error)
+            ticker_symbol = str(record["ticker_symbol"])
+            current_price = float(record["current_price"])
+            if not current_price > 0:
+                raise ValueError("current_price must be greater than 0")
+        except (KeyError, TypeError, ValueError):
+            state["invalid"] += 1
+            continue
+        prices[ticker_symbol] = current_price
+    if not prices:
+        return
+
+    known_assets = db.execute(select(database.DbAsset.ticker_symbol, database.DbAsset.id, database.DbAsset.current_price).where(
+        database.DbAsset.ticker_symbol.in_(list(prices))
+    )).all()
+    asset_ids = {ticker_symbol: asset_id for ticker_symbol, asset_id, _ in known_assets}
+    state["unknown"] += len(prices) - len(asset_ids)
+    if not asset_ids:
+        return
+
+    assets = database.DbAsset.__table__
+    db.execute(update(assets).where(assets.c.id == bindparam("b_id")).values(
+        current_price=bindparam("b_price"), version=assets.c.version + 1
+    ), [{"b_id": asset_id, "b_price": prices[ticker_symbol]} for ticker_symbol, asset_id in asset_ids.items()])
+    state["updated"] += len(asset_ids)
+    apply_price_deltas_to_portfolios(db, {
+        asset_id: prices[ticker_symbol] - (old_price or 0.0)
+        for ticker_symbol, asset_id, old_price in known_assets
+        if prices[ticker_symbol] != old_price
+    })
+    state["affected_portfolio_ids"].update(db.scalars(
+        select(database.PortfolioAssetAssociation.portfolio_id).where(
+            database.PortfolioAssetAssociation.asset_id.in_(list(asset_ids.values()))
+        ).distinct()
+    ))
+    state["ticker_prices"].update({t: prices[t] for t in asset_ids})
+    state["history_prices"].update({asset_id: prices[t] for t, asset_id in asset_ids.items()})
+
+def apply_price_deltas_to_portfolios(db: Session, price_deltas: dict):
+    # Adds quantity * price delta to the materialized total_value of every portfolio holding
+    # each changed asset. The portfolios are found through the asset_id index on the
+    # holdings table (the asset -> portfolios reverse index); one executemany for all assets.
+    if not price_deltas:
+        return
+    holdings = database.PortfolioAssetAssociation.__table__
+    portfolios = database.DbPortfolio.__table__
+    held_quantity = select(holdings.c.quantity).where(
+        holdings.c.portfolio_id == portfolios.c.id,
+        holdings.c.asset_id == bindparam("b_asset_id")
+    ).scalar_subquery()
+    stmt = update(portfolios).where(
+        portfolios.c.id.in_(select(holdings.c.portfolio_id).where(holdings.c.asset_id == bindparam("b_asset_id")))
+    ).values(
+        total_value=portfolios.c.total_value + bindparam("b_delta") * held_quantity,
+        version=portfolios.c.version + 1
+    )
+    db.execute(stmt, [{"b_asset_id": asset_id, "b_delta": delta} for asset_id, delta in price_deltas.items()])
+
+def finish_price_update(db: Session, state: dict):
+    if state["updated"]:
+        bump_table_version(db, "assets")
+    db.commit()
+    if state["ticker_prices"]:
+        # Against the lists cached now, including any computed while the feed ran; the
+        # generation bump also drops lists still being computed from the old prices
+        ai_engine.recommendation_cache.update_prices(state["ticker_prices"])
+    return {
+        "received": state["received"],
+        "updated": state["updated"],
+        "unknown_tickers": state["unknown"],
+        "invalid": state["invalid"],
+        "affected_portfolios": len(state["affected_portfolio_ids"])
+    }
+
+def publish_price_update(db: Session, state: dict):
+    # Effects outside the database, for a committed feed only (the caller runs this after
+    # finish_price_update): the ticks are appended to the price history files, which a
+    # rollback could not undo, and the new values pushed to live valuation subscribers
+    if state["history_prices"]:
+        # Every tick of the feed is stamped with the time it was committed
+        price_history.get_store().append(list(state["history_prices"]), list(state["history_prices"].values()), int(time.time()))
+    publish_live_valuations(db, state["affected_portfolio_ids"])
+
+def portfolio_total_values_stmt(portfolio_ids: List[int]):
+    return select(database.DbPortfolio.id, database.DbPortfolio.total_value).where(database.DbPortfolio.id.in_(portfolio_ids))
+
+def get_portfolio_total_values(db: Session, portfolio_ids: List[int]) -> dict:
+    return dict(db.execute(portfolio_total_values_stmt(portfolio_ids)).all())
+
+def publish_live_valuations(db: Session, portfolio_ids):
+    # Pushes the committed total_value of the given portfolios to their WebSocket
+    # subscribers (see live_valuations.py); portfolios nobody watches are not read
+    subscribed = live_valuations.hub.subscribed_ids(portfolio_ids)
+    if subscribed:
+        live_valuations.hub.publish(get_portfolio_total_values(db, subscribed))
+
 # Portfolio CRUD Operations
 def get_portfolio(db: Session, portfolio_id: int):
     return db.query(database.DbPortfolio).filter(database.DbPortfolio.id == portfolio_id).first()
@@ -65,100 +437,439 @@ def get_portfolio(db: Session, portfolio_id: int):
 def get_portfolios_by_client(db: Session, client_id: int, skip: int = 0, limit: int = 10):
     return db.query(database.DbPortfolio).filter(database.DbPortfolio.client_id == client_id).offset(skip).limit(limit).all()
 
-def create_client_portfolio(db: Session, portfolio: models.PortfolioCreate, client_id: int):
-    db_portfolio = database.DbPortfolio(name=portfolio.name, client_id=client_id)
-    db.add(db_portfolio)
-    db.commit()
-    # Now handle assets
-    for p_asset in portfolio.assets:
-        # Check if asset exists
-        db_asset_check = get_asset(db, p_asset.asset_id)
-        if not db_asset_check:
-            # Or raise an error, for now skipping if asset not found
-            print(f"Asset with id {p_asset.asset_id} not found. Skipping.")
+def client_portfolio_stmt(client_id: int):
+    return select(database.DbClient.id, database.DbPortfolio).outerjoin(
+        database.DbPortfolio, database.DbPortfolio.client_id == database.DbClient.id
+    ).where(database.DbClient.id == client_id).limit(1)
+
+def get_client_portfolio(db: Session, client_id: int):
+    # Client existence check and first portfolio lookup for the portfolio endpoints in
+    # one query. Returns (client_exists, DbPortfolio or None).
+    row = db.execute(client_portfolio_stmt(client_id)).first()
+    if row is None:
+        return False, None
+    return True, row[1]
+
+def apply_holding_changes(db: Session, db_portfolio, upserts: dict, remove_asset_ids=(), replace_all: bool = False, current: Optional[dict] = None):
+    # Diffs the requested holdings against the stored ones and writes only the changes:
+    # one executemany each for inserts and quantity updates, and one DELETE ... IN.
+    # upserts maps asset_id -> quantity. With replace_all, every stored holding not in
+    # upserts is removed; otherwise only remove_asset_ids are.
+    # Asset ids are validated (and priced) with a single IN query; unknown ones are skipped.
+    # The materialized total_value is adjusted by the value delta of the changes.
+    # current is the stored holdings (asset_id -> quantity) if already known, e.g. {} for
+    # a new portfolio; otherwise they are read in one query.
+    # The portfolio's version is bumped if any holding changed.
+    # Returns the resulting holdings as asset_id -> quantity. Does not commit.
+    holdings = database.PortfolioAssetAssociation
+    if current is None:
+        current = dict(db.execute(
+            select(holdings.asset_id, holdings.quantity).where(holdings.portfolio_id == db_portfolio.id)
+        ).all())
+
+    if replace_all:
+        removals = set(current) - set(upserts)
+    else:
+        removals = set(remove_asset_ids) & set(current)
+    removals -= set(upserts)
+
+    prices = dict(db.execute(select(database.DbAsset.id, database.DbAsset.current_price).where(
+        database.DbAsset.id.in_(set(upserts) | removals)
+    )).all()) if upserts or removals else {}
+
+    result = dict(current)
+    inserts, updates = [], []
+    delta = 0.0
+    for asset_id, quantity in upserts.items():
+        if asset_id not in prices:
+            continue # Unknown asset: skipped, so absent from the returned holdings
+        old_quantity = current.get(asset_id)
+        result[asset_id] = quantity
+        if old_quantity is None:
+            inserts.append({"portfolio_id": db_portfolio.id, "asset_id": asset_id, "quantity": quantity})
+        elif old_quantity != quantity:
+            updates.append({"portfolio_id": db_portfolio.id, "asset_id": asset_id, "quantity": quantity})
+        else:
             continue
+        delta += (quantity - (old_quantity or 0.0)) * prices[asset_id]
+    for asset_id in removals:
+        delta -= current[asset_id] * prices.get(asset_id, 0.0)
+        del result[asset_id]
 
-        association = database.PortfolioAssetAssociation(
-            portfolio_id=db_portfolio.id,
-            asset_id=p_asset.asset_id,
-            quantity=p_asset.quantity
-        )
-        db.add(association)
+    if removals:
+        db.execute(delete(holdings).where(holdings.portfolio_id == db_portfolio.id, holdings.asset_id.in_(removals)))
+    if updates:
+        db.execute(update(holdings), updates)
+    if inserts:
+        db.execute(insert(holdings), inserts)
+    if removals or updates or inserts:
+        bump_row_version(db_portfolio)
+    db_portfolio.total_value = (db_portfolio.total_value or 0.0) + delta
+    return result
+
+def build_portfolio(db_portfolio, holdings: dict) -> models.Portfolio:
+    # Shapes a portfolio and its asset_id -> quantity holdings into the write endpoints'
+    # response from data already in memory, ordered by asset id
+    return models.Portfolio(
+        id=db_portfolio.id,
+        name=db_portfolio.name,
+        client_id=db_portfolio.client_id,
+        assets=[models.PortfolioAsset(asset_id=asset_id, quantity=quantity) for asset_id, quantity in sorted(holdings.items())],
+        total_value=db_portfolio.total_value
+    )
 
+# The portfolio writes below return the models.Portfolio response built before the
+# commit, so the committed (and expired) portfolio is never reloaded: a write costs a
+# constant number of queries however many holdings the portfolio has.
+def create_client_portfolio(db: Session, portfolio: models.PortfolioCreate, client_id: int) -> models.Portfolio:
+    db_portfolio = database.DbPortfolio(name=portfolio.name, client_id=client_id, total_value=0.0)
+    db.add(db_portfolio)
+    db.flush() # Assigns db_portfolio.id; everything is committed together below
+    # Now handle assets (a new portfolio has no holdings, so this only inserts)
+    holdings = apply_holding_changes(db, db_portfolio, {p_asset.asset_id: p_asset.quantity for p_asset in portfolio.assets}, current={})
+    response = build_portfolio(db_portfolio, holdings)
     db.commit()
-    db.refresh(db_portfolio)
-    return db_portfolio
+    return response
 
-def update_portfolio_assets(db: Session, portfolio_id: int, portfolio_update: models.PortfolioCreate):
-    db_portfolio = get_portfolio(db, portfolio_id)
-    if not db_portfolio:
-        return None
+def update_portfolio_assets(db: Session, db_portfolio, portfolio_update: models.PortfolioCreate) -> models.Portfolio:
+    # Replace the holdings with portfolio_update.assets, writing only what changed
+    holdings = apply_holding_changes(
+        db,
+        db_portfolio,
+        {p_asset.asset_id: p_asset.quantity for p_asset in portfolio_update.assets},
+        replace_all=True
+    )
+    if db_portfolio.name != portfolio_update.name:
+        db_portfolio.name = portfolio_update.name # Update name as well
+        bump_row_version(db_portfolio)
+    response = build_portfolio(db_portfolio, holdings)
+    db.commit()
+    return response
 
-    # Clear existing asset associations for this portfolio
-    db.query(database.PortfolioAssetAssociation).filter(
+def patch_portfolio_assets(db: Session, db_portfolio, portfolio_patch: models.PortfolioPatch) -> models.Portfolio:
+    # Partial holding changes: upsert the given holdings, remove the given asset ids,
+    # leave every other holding untouched
+    holdings = apply_holding_changes(
+        db,
+        db_portfolio,
+        {p_asset.asset_id: p_asset.quantity for p_asset in portfolio_patch.upsert},
+        remove_asset_ids=portfolio_patch.remove
+    )
+    if portfolio_patch.name is not None and db_portfolio.name != portfolio_patch.name:
+        db_portfolio.name = portfolio_patch.name
+        bump_row_version(db_portfolio)
+    response = build_portfolio(db_portfolio, holdings)
+    db.commit()
+    return response
+
+def portfolio_holdings_stmt(portfolio_id: int):
+    # Holdings joined to their assets in one query, instead of one get_asset call per row.
+    # Selects (quantity, DbAsset) rows. Shared with crud_async.
+    return select(database.PortfolioAssetAssociation.quantity, database.DbAsset).join(
+        database.DbAsset, database.DbAsset.id == database.PortfolioAssetAssociation.asset_id
+    ).where(
         database.PortfolioAssetAssociation.portfolio_id == portfolio_id
-    ).delete()
+    )
 
-    # Add new asset associations
-    for p_asset in portfolio_update.assets:
-        db_asset_check = get_asset(db, p_asset.asset_id)
-        if not db_asset_check:
-            print(f"Asset with id {p_asset.asset_id} not found. Skipping.")
-            continue
-        association = database.PortfolioAssetAssociation(
-            portfolio_id=portfolio_id,
-            asset_id=p_asset.asset_id,
-            quantity=p_asset.quantity
-        )
-        db.add(association)
+def get_portfolio_holdings(db: Session, portfolio_id: int):
+    return db.execute(portfolio_holdings_stmt(portfolio_id)).all()
 
-    db_portfolio.name = portfolio_update.name # Update name as well
-    db.commit()
-    db.refresh(db_portfolio)
-    return db_portfolio
+def get_portfolio_quantities(db: Session, portfolio_id: int):
+    # (asset_id, quantity) rows, for valuations that take prices from elsewhere (the price history)
+    return db.execute(select(database.PortfolioAssetAssociation.asset_id, database.PortfolioAssetAssociation.quantity).where(
+        database.PortfolioAssetAssociation.portfolio_id == portfolio_id
+    )).all()
+
+def get_portfolio_total_value(db: Session, portfolio_id: int) -> float:
+    # SUM(quantity * current_price) computed from scratch by the database in a single aggregate.
+    # Reads normally use the materialized DbPortfolio.total_value instead.
+    total_value = db.query(
+        func.sum(database.PortfolioAssetAssociation.quantity * database.DbAsset.current_price)
+    ).join(
+        database.DbAsset, database.DbAsset.id == database.PortfolioAssetAssociation.asset_id
+    ).filter(
+        database.PortfolioAssetAssociation.portfolio_id == portfolio_id
+    ).scalar()
+    return total_value or 0.0
 
 def get_portfolio_details(db: Session, portfolio_id: int):
-    # This function would ideally return the portfolio with its assets and calculated total value.
-    # For now, it returns the basic portfolio. Calculation can be added in the schema or service layer.
+    # Returns the portfolio with its assets and total value.
+    # Costs a constant two queries regardless of the number of holdings: the portfolio
+    # row (which carries the materialized total_value) and the holdings joined to assets.
     db_portfolio = get_portfolio(db, portfolio_id)
     if not db_portfolio:
         return None
 
-    # Fetch associated assets and their quantities
-    associations = db.query(database.PortfolioAssetAssociation).filter(
-        database.PortfolioAssetAssociation.portfolio_id == portfolio_id
-    ).all()
+    return build_portfolio_details(db_portfolio, get_portfolio_holdings(db, portfolio_id))
 
+def build_portfolio_details(db_portfolio, holdings):
+    # Shapes a portfolio and its (quantity, DbAsset) holdings into the details dict
     assets_with_quantity = []
-    total_value = 0.0
-    for assoc in associations:
-        asset_details = get_asset(db, assoc.asset_id)
-        if asset_details:
-            value = asset_details.current_price * assoc.quantity
-            assets_with_quantity.append({
-                "asset": models.Asset.from_orm(asset_details),
-                "quantity": assoc.quantity,
-                "value": value
-            })
-            total_value += value
-
-    # We need to construct a Pydantic model for the response here.
-    # Let's augment the existing models.Portfolio object or create a new one.
-    # For now, returning a dict, will refine with Pydantic models in main.py or models.py
-
-    # Create a models.Portfolio object and populate its 'assets' field
-    # This requires models.Portfolio.assets to be List[models.Asset] or similar.
-    # Current models.Portfolio.assets is List[models.PortfolioAsset] (id and quantity)
-    # This means the response shaping will largely happen in the API endpoint.
-
-    # For now, the CRUD returns the DB object, and the endpoint will shape it.
-    # Or, we can attach this info to the db_portfolio object if the Pydantic model supports it.
-    # Let's assume the endpoint will handle the shaping using this data.
+    for quantity, asset_details in holdings:
+        assets_with_quantity.append({
+            "asset": models.Asset.model_validate(asset_details),
+            "quantity": quantity,
+            "value": asset_details.current_price * quantity
+        })
 
+    # The response shaping happens in the API endpoints (see main.py), which
+    # build models.Portfolio / PortfolioDetailsResponse from this dict.
     return {
         "portfolio_id": db_portfolio.id,
         "name": db_portfolio.name,
         "client_id": db_portfolio.client_id,
         "assets_details": assets_with_quantity,
-        "total_value": total_value
+        "total_value": db_portfolio.total_value
     }
+
+def portfolio_valuations_stmt(
+    client_ids: Optional[List[int]] = None,
+    portfolio_ids: Optional[List[int]] = None,
+    include_holdings: bool = True
+):
+    # Portfolios selected by owning client and/or by id, or None if neither is given.
+    # With include_holdings their holdings + assets are eagerly loaded through the
+    # DbPortfolio.asset_associations relationship. Shared with crud_async.
+    filters = []
+    if client_ids:
+        filters.append(database.DbPortfolio.client_id.in_(client_ids))
+    if portfolio_ids:
+        filters.append(database.DbPortfolio.id.in_(portfolio_ids))
+    if not filters:
+        return None
+
+    stmt = select(database.DbPortfolio).where(or_(*filters)).order_by(database.DbPortfolio.id)
+    if include_holdings:
+        stmt = stmt.options(
+            selectinload(database.DbPortfolio.asset_associations).joinedload(database.PortfolioAssetAssociation.asset)
+        )
+    return stmt
+
+def get_portfolio_valuations(
+    db: Session,
+    client_ids: Optional[List[int]] = None,
+    portfolio_ids: Optional[List[int]] = None,
+    include_holdings: bool = True
+):
+    # Values many portfolios at once with a constant number of queries: the portfolios
+    # (whose materialized total_value is the total) and, if include_holdings, their
+    # holdings + assets in one eager load.
+    stmt = portfolio_valuations_stmt(client_ids, portfolio_ids, include_holdings)
+    if stmt is None:
+        return []
+    return build_portfolio_valuations(db.scalars(stmt).all(), include_holdings)
+
+def build_portfolio_valuations(db_portfolios, include_holdings: bool = True):
+    valuations = []
+    for db_portfolio in db_portfolios:
+        holdings = []
+        for assoc in (db_portfolio.asset_associations if include_holdings else []):
+            if assoc.asset is None:
+                continue
+            holdings.append({
+                "asset_id": assoc.asset_id,
+                "ticker_symbol": assoc.asset.ticker_symbol,
+                "quantity": assoc.quantity,
+                "current_price": assoc.asset.current_price,
+                "value": assoc.asset.current_price * assoc.quantity
+            })
+        valuations.append({
+            "portfolio_id": db_portfolio.id,
+            "client_id": db_portfolio.client_id,
+            "name": db_portfolio.name,
+            "total_value": db_portfolio.total_value,
+            "holdings": holdings
+        })
+    return valuations
+
+# Rebalancing (see rebalancing.py)
+def get_rebalance_portfolios(db: Session, portfolio_ids: Optional[List[int]] = None, risk_profile: Optional[models.RiskProfile] = None, after_portfolio_id: int = 0, limit: Optional[int] = None):
+    # (id, client_id, risk_profile) rows of the given portfolios, or of the portfolios of
+    # clients with risk_profile after after_portfolio_id, in id order
+    stmt = select(database.DbPortfolio.id, database.DbPortfolio.client_id, database.DbClient.risk_profile).join(
+        database.DbClient, database.DbClient.id == database.DbPortfolio.client_id
+    )
+    if portfolio_ids:
+        stmt = stmt.where(database.DbPortfolio.id.in_(set(portfolio_ids)))
+    else:
+        stmt = stmt.where(database.DbClient.risk_profile == risk_profile, database.DbPortfolio.id > after_portfolio_id)
+    return db.execute(stmt.order_by(database.DbPortfolio.id).limit(limit)).all()
+
+def get_rebalance_holdings(db: Session, portfolio_ids: List[int]):
+    # (portfolio_id, asset_id, quantity, ticker_symbol, current_price, asset_type) rows of
+    # the portfolios' holdings in one query, ordered by portfolio then asset. Run on the
+    # session's connection: plain tuples, without the ORM result layer (a third of the time
+    # for a batch of thousands of portfolios).
+    holdings = database.PortfolioAssetAssociation
+    return db.connection().execute(select(
+        holdings.portfolio_id, holdings.asset_id, holdings.quantity,
+        database.DbAsset.ticker_symbol, database.DbAsset.current_price, database.DbAsset.asset_type
+    ).join(database.DbAsset, database.DbAsset.id == holdings.asset_id).where(
+        holdings.portfolio_id.in_(portfolio_ids)
+    ).order_by(holdings.portfolio_id, holdings.asset_id)).all()
+
+def get_rebalance_assets(db: Session, asset_ids) -> dict:
+    # asset_id -> (ticker_symbol, current_price, asset_type)
+    if not asset_ids:
+        return {}
+    return {row.id: (row.ticker_symbol, row.current_price, row.asset_type) for row in db.execute(
+        select(database.DbAsset.id, database.DbAsset.ticker_symbol, database.DbAsset.current_price, database.DbAsset.asset_type).where(
+            database.DbAsset.id.in_(set(asset_ids))
+        )
+    )}
+
+def get_asset_ids_by_ticker(db: Session, ticker_symbols: List[str]) -> dict:
+    if not ticker_symbols:
+        return {}
+    return dict(db.execute(select(database.DbAsset.ticker_symbol, database.DbAsset.id).where(
+        database.DbAsset.ticker_symbol.in_(ticker_symbols)
+    )).all())
+
+def execute_guarded(db: Session, stmt, rows: List[dict]) -> bool:
+    # Runs an executemany whose WHERE clause is a guard; returns whether every row matched.
+    # Row by row where the driver does not report the total rowcount of an executemany.
+    if not rows:
+        return True
+    if db.get_bind().dialect.supports_sane_multi_rowcount:
+        return db.execute(stmt, rows).rowcount == len(rows)
+    return all(db.execute(stmt, row).rowcount == 1 for row in rows)
+
+def apply_rebalance_trades(db: Session, trades: List[tuple]) -> dict:
+    # Applies (portfolio_id, asset_id, current_quantity, target_quantity) trades in one
+    # transaction: one read of the assets' prices, then one executemany each for deleted,
+    # updated and inserted holdings and for the portfolios' total_value deltas (which bump
+    # their versions). The check that every traded holding still has current_quantity (0
+    # if not held) is part of the writes: deletes and updates only match that quantity,
+    # and an insert fails if the holding exists, so nothing can change a holding between
+    # the check and the write. The deltas are computed from current_quantity, which the
+    # writes confirmed.
+    # Returns (conflicting portfolio ids, summary); with conflicts everything is rolled back.
+    holdings = database.PortfolioAssetAssociation.__table__
+    portfolios = database.DbPortfolio.__table__
+    prices = dict(db.execute(select(database.DbAsset.id, database.DbAsset.current_price).where(
+        database.DbAsset.id.in_({asset_id for _, asset_id, _, _ in trades})
+    )).all())
+    unknown_assets = sorted({asset_id for _, asset_id, _, _ in trades} - set(prices))
+    if unknown_assets:
+        raise ValueError(f"Unknown asset ids: {unknown_assets[:20]}")
+
+    deletes, updates, inserts = [], [], []
+    value_deltas = {}
+    summary = {"trades": 0, "buy_value": 0.0, "sell_value": 0.0}
+    for portfolio_id, asset_id, current_quantity, target_quantity in trades:
+        if target_quantity == current_quantity:
+            continue
+        params = {"b_portfolio_id": portfolio_id, "b_asset_id": asset_id, "b_current": current_quantity, "b_quantity": target_quantity}
+        if current_quantity == 0:
+            inserts.append({"portfolio_id": portfolio_id, "asset_id": asset_id, "quantity": target_quantity})
+        elif target_quantity == 0:
+            deletes.append(params)
+        else:
+            updates.append(params)
+        trade_value = (target_quantity - current_quantity) * (prices[asset_id] or 0.0)
+        value_deltas[portfolio_id] = value_deltas.get(portfolio_id, 0.0) + trade_value
+        summary["trades"] += 1
+        summary["buy_value" if trade_value > 0 else "sell_value"] += abs(trade_value)
+
+    guard = (
+        holdings.c.portfolio_id == bindparam("b_portfolio_id"), holdings.c.asset_id == bindparam("b_asset_id"),
+        func.abs(holdings.c.quantity - bindparam("b_current")) <= 1e-9
+    )
+    try:
+        applied = (
+            # The portfolios first: their row locks (on SQLite, the write lock) are held from here
+            execute_guarded(db, update(portfolios).where(portfolios.c.id == bindparam("b_id")).values(
+                total_value=portfolios.c.total_value + bindparam("b_delta"), version=portfolios.c.version + 1
+            ), [{"b_id": portfolio_id, "b_delta": delta} for portfolio_id, delta in value_deltas.items()])
+            and execute_guarded(db, delete(holdings).where(*guard), deletes)
+            and execute_guarded(db, update(holdings).where(*guard).values(quantity=bindparam("b_quantity")), updates)
+        )
+        if applied and inserts:
+            db.execute(insert(holdings), inserts)
+    except IntegrityError: # An inserted holding exists (or its portfolio is gone)
+        applied = False
+    if not applied:
+        db.rollback()
+        return rebalance_conflicts(db, trades), None
+    db.commit()
+    publish_live_valuations(db, list(value_deltas))
+    return [], {"portfolios": len(value_deltas), **summary}
+
+def rebalance_conflicts(db: Session, trades: List[tuple]) -> List[int]:
+    # The portfolios that are gone or whose traded holdings no longer have current_quantity,
+    # for the conflict report (all the traded portfolios if the conflict has gone since)
+    holdings = database.PortfolioAssetAssociation.__table__
+    portfolio_ids = {portfolio_id for portfolio_id, _, _, _ in trades}
+    existing = set(db.scalars(select(database.DbPortfolio.id).where(database.DbPortfolio.id.in_(portfolio_ids))))
+    stored = {(portfolio_id, asset_id): quantity for portfolio_id, asset_id, quantity in db.connection().execute(
+        select(holdings.c.portfolio_id, holdings.c.asset_id, holdings.c.quantity).where(holdings.c.portfolio_id.in_(existing))
+    )} if existing else {}
+    conflicts = sorted(portfolio_ids - existing) + sorted({
+        portfolio_id for portfolio_id, asset_id, current_quantity, target_quantity in trades
+        if portfolio_id in existing and target_quantity != current_quantity
+        and abs(stored.get((portfolio_id, asset_id), 0.0) - current_quantity) > 1e-9
+    })
+    return conflicts or sorted(portfolio_ids)
+
+# Exposure snapshot (see exposure.py). Plain tuples from the session's connection, as for
+# the rebalancing reads.
+def get_exposure_source_version(db: Session) -> tuple:
+    # Changes whenever a write could change the snapshot: the assets table version (asset
+    # inserts and price feeds) and the row count, version sum and highest id of portfolios
+    # (every holding change bumps its portfolio's version) and clients (risk profiles).
+    # One scan each of the portfolios and clients tables, no read of the holdings.
+    portfolios = database.DbPortfolio.__table__
+    clients = database.DbClient.__table__
+    return (
+        get_table_version(db, "assets"),
+        *db.connection().execute(select(func.count(), func.coalesce(func.sum(portfolios.c.version), 0), func.max(portfolios.c.id))).one(),
+        *db.connection().execute(select(func.count(), func.coalesce(func.sum(clients.c.version), 0), func.max(clients.c.id))).one()
+    )
+
+def get_exposure_assets(db: Session):
+    # (id, ticker_symbol, asset_type, current_price) of every asset, in id order
+    assets = database.DbAsset.__table__
+    return db.connection().execute(select(
+        assets.c.id, assets.c.ticker_symbol, assets.c.asset_type, assets.c.current_price
+    ).order_by(assets.c.id)).all()
+
+def get_exposure_portfolios(db: Session):
+    # (id, client_id, risk_profile) of every portfolio, in id order
+    portfolios = database.DbPortfolio.__table__
+    clients = database.DbClient.__table__
+    return db.connection().execute(select(
+        portfolios.c.id, portfolios.c.client_id, clients.c.risk_profile
+    ).join(clients, clients.c.id == portfolios.c.client_id).order_by(portfolios.c.id)).all()
+
+def iter_exposure_holdings(db: Session, chunk_size: int = 100000):
+    # Every (portfolio_id, asset_id, quantity) holding, chunk_size rows at a time from a
+    # server-side cursor, in no particular order (a plain scan of the table)
+    holdings = database.PortfolioAssetAssociation.__table__
+    stmt = select(holdings.c.portfolio_id, holdings.c.asset_id, holdings.c.quantity).execution_options(yield_per=chunk_size)
+    yield from db.connection().execute(stmt).partitions()
+
+def check_portfolio_values(db: Session, tolerance: float = 1e-6, fix: bool = False):
+    # Consistency check for the materialized DbPortfolio.total_value: recomputes every
+    # portfolio's value from scratch with one grouped aggregate and reports each portfolio
+    # whose stored value drifted by more than tolerance (relative, for values above 1).
+    # With fix=True the drifted values are overwritten with the recomputed ones.
+    recomputed = dict(db.query(
+        database.PortfolioAssetAssociation.portfolio_id,
+        func.sum(database.PortfolioAssetAssociation.quantity * database.DbAsset.current_price)
+    ).join(
+        database.DbAsset, database.DbAsset.id == database.PortfolioAssetAssociation.asset_id
+    ).group_by(database.PortfolioAssetAssociation.portfolio_id).all())
+
+    drift = []
+    for portfolio_id, stored_value in db.query(database.DbPortfolio.id, database.DbPortfolio.total_value):
+        expected_value = recomputed.get(portfolio_id) or 0.0
+        if abs(stored_value - expected_value) > tolerance * max(1.0, abs(expected_value)):
+            drift.append({"portfolio_id": portfolio_id, "stored": stored_value, "expected": expected_value})
+
+    if fix and drift:
+        portfolios = database.DbPortfolio.__table__
+        db.execute(update(portfolios).where(portfolios.c.id == bindparam("b_id")).values(
+            total_value=bindparam("b_total_value"), version=portfolios.c.version + 1
+        ), [{"b_id": d["portfolio_id"], "b_total_value": d["expected"]} for d in drift])
+        db.commit()
+    return drift
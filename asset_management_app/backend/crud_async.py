@@ -0,0 +1,46 @@
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, database
+
+# Async versions of the read paths used by the hot endpoints (client read, portfolio
+# read, recommendations). They reuse the statements and result shaping from crud.py,
+# so both paths return the same data.
+
+async def get_client(db: AsyncSession, client_id: int):
+    return await db.scalar(select(database.DbClient).where(database.DbClient.id == client_id))
+
+async def get_client_with_portfolio_versions(db: AsyncSession, client_id: int):
+    # Returns (DbClient or None, [(portfolio_id, version), ...]) in one query: enough to
+    # build the client detail ETag, and the client row for the full response on a miss
+    rows = (await db.execute(crud.client_versions_stmt(client_id))).all()
+    if not rows:
+        return None, []
+    return rows[0][0], [(portfolio_id, version) for _, portfolio_id, version in rows if portfolio_id is not None]
+
+async def get_client_portfolio(db: AsyncSession, client_id: int):
+    # Returns (client_exists, DbPortfolio or None), as crud.get_client_portfolio
+    row = (await db.execute(crud.client_portfolio_stmt(client_id))).first()
+    if row is None:
+        return False, None
+    return True, row[1]
+
+async def get_portfolio_details(db: AsyncSession, db_portfolio):
+    holdings = (await db.execute(crud.portfolio_holdings_stmt(db_portfolio.id))).all()
+    return crud.build_portfolio_details(db_portfolio, holdings)
+
+async def get_portfolio_valuations(
+    db: AsyncSession,
+    client_ids: Optional[List[int]] = None,
+    portfolio_ids: Optional[List[int]] = None,
+    include_holdings: bool = True
+):
+    stmt = crud.portfolio_valuations_stmt(client_ids, portfolio_ids, include_holdings)
+    if stmt is None:
+        return []
+    return crud.build_portfolio_valuations((await db.scalars(stmt)).all(), include_holdings)
+
+async def get_portfolio_total_values(db: AsyncSession, portfolio_ids: List[int]) -> dict:
+    return dict((await db.execute(crud.portfolio_total_values_stmt(portfolio_ids))).all())
@@ -1,15 +1,112 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Enum as SQLAlchemyEnum
+import os
+from typing import List
+
+from sqlalchemy import create_engine, event, insert, inspect, select, text, Column, DateTime, Integer, JSON, String, Float, ForeignKey, Index, Enum as SQLAlchemyEnum
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, relationship
-from .models import RiskProfile # Importing our Pydantic enum
+from .models import MarketTrend, RiskProfile # Importing our Pydantic enums
+
+# Engine settings, overridable from the environment
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./asset_management.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5")) # Connections kept open per engine
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10")) # Extra connections opened under load, closed when returned
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30")) # Seconds to wait for a connection before failing
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes") # Test connections on checkout
+
+# SQLite tuning, applied to every new connection (see set_sqlite_pragmas).
+# WAL lets readers run while a writer (e.g. a bulk price load) holds the write lock;
+# synchronous=NORMAL is durable across application crashes in WAL mode and only
+# risks the last commits on power loss.
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "15")) # Seconds a writer waits for the lock instead of "database is locked"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))) # Bytes of the file read through mmap
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536")) # Page cache; negative values are KiB (64 MiB)
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def is_in_memory(url: str) -> bool:
+    return is_sqlite(url) and (":memory:" in url or url.split("://", 1)[1] in ("", "/"))
 
-DATABASE_URL = "sqlite:///./asset_management.db"
+def engine_options(url: str) -> dict:
+    if is_in_memory(url):
+        return {} # In-memory SQLite uses a single shared connection, not a sized pool
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if is_sqlite(url):
+        # check_same_thread is needed only for SQLite
+        options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT}
+    return options
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False} # check_same_thread is needed only for SQLite
-)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine on the same database for the async endpoints (see crud_async.py),
+# so their database I/O does not hold one of the server's threadpool slots.
+# Swap the driver here to use another async DBAPI (e.g. postgresql+psycopg).
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL") # Persistent in the file; a no-op for in-memory databases
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+# Pool activity counters per engine, reported by get_pool_stats
+pool_counters = {}
+
+def track_pool(name: str, pool_engine: Engine):
+    counters = pool_counters[name] = {"connections_opened": 0, "checkouts": 0, "max_checked_out": 0}
+
+    def on_connect(dbapi_connection, connection_record):
+        counters["connections_opened"] += 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters["checkouts"] += 1
+        counters["max_checked_out"] = max(counters["max_checked_out"], pool_engine.pool.checkedout())
+
+    event.listen(pool_engine, "connect", on_connect)
+    event.listen(pool_engine, "checkout", on_checkout)
+
+for name, sync_engine in (("sync", engine), ("async", async_engine.sync_engine)):
+    if is_sqlite(str(sync_engine.url)):
+        event.listen(sync_engine, "connect", set_sqlite_pragmas)
+    track_pool(name, sync_engine)
+
+def get_pool_stats() -> List[dict]:
+    stats = []
+    for name, sync_engine in (("sync", engine), ("async", async_engine.sync_engine)):
+        pool = sync_engine.pool
+        sized = hasattr(pool, "checkedout") # QueuePool and its async variant; other pools have no sizes
+        stats.append({
+            "engine": name,
+            "url": sync_engine.url.render_as_string(hide_password=True),
+            "pool_class": type(pool).__name__,
+            "pool_size": pool.size() if sized else None,
+            "max_overflow": getattr(pool, "_max_overflow", None) if sized else None,
+            "checked_in": pool.checkedin() if sized else None,
+            "checked_out": pool.checkedout() if sized else None,
+            "overflow": max(pool.overflow(), 0) if sized else None, # Negative while the base pool is not yet full
+            **pool_counters[name],
+        })
+    return stats
+
 Base = declarative_base()
 
 # Association table for Portfolio and Asset (Many-to-Many)
@@ -21,6 +118,12 @@ class PortfolioAssetAssociation(Base):
 
     asset = relationship("DbAsset") # Relationship to DbAsset
 
+    __table_args__ = (
+        # Reverse index asset_id -> portfolios holding it, used to fan price changes
+        # out to the affected portfolios' materialized total_value
+        Index("ix_portfolio_asset_association_asset_id", "asset_id"),
+    )
+
 class DbClient(Base):
     __tablename__ = "clients"
 
@@ -29,6 +132,8 @@ class DbClient(Base):
     last_name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     risk_profile = Column(SQLAlchemyEnum(RiskProfile), default=RiskProfile.medium)
+    # Incremented by every write to the row (see crud.bump_row_version); part of the ETags in main.py
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     portfolios = relationship("DbPortfolio", back_populates="owner")
 
@@ -40,6 +145,13 @@ class DbAsset(Base):
     ticker_symbol = Column(String, unique=True, index=True)
     asset_type = Column(String)
     current_price = Column(Float)
+    # Incremented by price updates (see crud.apply_price_batch)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        # Lets asset_type-filtered keyset pages seek straight to (asset_type, id > cursor)
+        Index("ix_assets_asset_type_id", "asset_type", "id"),
+    )
 
     # portfolios attribute for the many-to-many relationship will be defined via PortfolioAssetAssociation
     # This allows accessing portfolios this asset is part of, if needed.
@@ -51,7 +163,13 @@ class DbPortfolio(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, default="Default Portfolio")
-    client_id = Column(Integer, ForeignKey("clients.id"))
+    client_id = Column(Integer, ForeignKey("clients.id"), index=True) # Every client read looks up portfolios by owner
+    # Materialized SUM(quantity * current_price) over the holdings, maintained by delta in crud.py
+    # whenever holdings or asset prices change, so reading a portfolio's value is O(1)
+    total_value = Column(Float, nullable=False, default=0.0, server_default="0")
+    # Incremented whenever the portfolio's name, holdings or total_value change,
+    # including by price updates of held assets
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     owner = relationship("DbClient", back_populates="portfolios")
     # assets_in_portfolio is a list of DbAsset objects linked via PortfolioAssetAssociation
@@ -60,8 +178,105 @@ class DbPortfolio(Base):
     asset_associations = relationship("PortfolioAssetAssociation")
 
 
+# Change counters for tables whose reads are cached as a whole (e.g. the asset list),
+# where per-row versions would not catch inserts. Bumped in the same transaction as
+# the write (see crud.bump_table_version).
+class DbTableVersion(Base):
+    __tablename__ = "table_versions"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+VERSIONED_TABLES = ("assets",)
+
+
+# Batch recommendation runs over the whole client book (see batch_recommendations.py).
+# A run scores each (risk_profile, market_trend) group once into recommendation_run_groups,
+# then records every client's group in client_recommendations, in committed chunks;
+# last_client_id is the checkpoint a resumed run continues from.
+class DbRecommendationRun(Base):
+    __tablename__ = "recommendation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    market_trends = Column(JSON, nullable=False) # List of MarketTrend values
+    status = Column(String, nullable=False, default="pending") # models.RecommendationRunStatus
+    total_clients = Column(Integer, nullable=False, default=0)
+    processed_clients = Column(Integer, nullable=False, default=0)
+    max_client_id = Column(Integer, nullable=False, default=0) # Clients created after the run was started are not part of it
+    last_client_id = Column(Integer, nullable=False, default=0)
+    error = Column(String)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+class DbRecommendationGroup(Base):
+    __tablename__ = "recommendation_run_groups"
+
+    run_id = Column(Integer, ForeignKey("recommendation_runs.id"), primary_key=True)
+    risk_profile = Column(SQLAlchemyEnum(RiskProfile), primary_key=True)
+    market_trend = Column(SQLAlchemyEnum(MarketTrend), primary_key=True)
+    recommendations = Column(JSON, nullable=False) # List of models.RecommendedAsset dicts
+
+class DbClientRecommendation(Base):
+    __tablename__ = "client_recommendations"
+
+    run_id = Column(Integer, ForeignKey("recommendation_runs.id"), primary_key=True)
+    # No foreign key to clients: the results of past runs must not block deleting a client
+    client_id = Column(Integer, primary_key=True)
+    risk_profile = Column(SQLAlchemyEnum(RiskProfile), nullable=False) # The client's profile when the run reached it
+
+
+# Recomputes every materialized portfolio total_value from the holdings
+RECOMPUTE_PORTFOLIO_VALUES_SQL = """
+UPDATE portfolios SET version = version + 1, total_value = COALESCE((
+    SELECT SUM(portfolio_asset_association.quantity * assets.current_price)
+    FROM portfolio_asset_association JOIN assets ON assets.id = portfolio_asset_association.asset_id
+    WHERE portfolio_asset_association.portfolio_id = portfolios.id
+), 0)
+"""
+
+def upgrade_existing_tables():
+    # create_all only creates missing tables. For databases created by an older version,
+    # add the columns and indexes introduced since, and backfill derived columns.
+    # Returns the added columns as (table, column) pairs and the created index names.
+    inspector = inspect(engine)
+    added_columns = []
+    added_indexes = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                added_columns.append((table.name, column.name))
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    added_indexes.append(index.name)
+        if ("portfolios", "total_value") in added_columns:
+            conn.execute(text(RECOMPUTE_PORTFOLIO_VALUES_SQL))
+        if added_indexes and is_sqlite(DATABASE_URL):
+            # Lets SQLite gather planner statistics for the new indexes where it judges it worthwhile
+            conn.execute(text("PRAGMA optimize"))
+    return {"columns": added_columns, "indexes": added_indexes}
+
 def create_db_and_tables():
+    # Returns the schema changes applied to an existing database (see upgrade_existing_tables)
     Base.metadata.create_all(bind=engine)
+    changes = upgrade_existing_tables()
+    with engine.begin() as conn:
+        existing = set(conn.execute(select(DbTableVersion.table_name)).scalars())
+        missing = [{"table_name": name, "version": 1} for name in VERSIONED_TABLES if name not in existing]
+        if missing:
+            conn.execute(insert(DbTableVersion), missing)
+    return changes
 
 def get_db():
     db = SessionLocal()
@@ -69,3 +284,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
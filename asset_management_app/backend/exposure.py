@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import crud, database
+
+# Book-wide exposure analytics (GET /analytics/exposure) from a columnar snapshot of every
+# holding, instead of reading each portfolio through crud.get_portfolio_details. A build
+# reads the holdings as NumPy columns (portfolio, asset, quantity), joins them to prices,
+# asset types and client risk profiles by array position, and groups them with bincount
+# into two dense arrays of market value, quantity and holding counts: per (asset type,
+# portfolio) and per (risk profile, asset). Every query filters by asset type and risk
+# profile and groups by one of them or by ticker, so it only slices and sums these arrays.
+# That takes well under a millisecond for millions of holdings and never reads the database.
+# A scheduler thread refreshes the snapshot every EXPOSURE_REFRESH_SECONDS. It first reads
+# a fingerprint of the source tables (crud.get_exposure_source_version) and rebuilds only
+# when that changed. A rebuild reads the tables in one read transaction, which is
+# consistent under WAL, and then swaps the new snapshot in. Queries keep answering from
+# the previous snapshot meanwhile.
+# Every answer reports the snapshot's staleness. as_of is the last time the snapshot was
+# known to match the database: its build, or the last check that found nothing changed.
+# stale is set once as_of is more than EXPOSURE_MAX_AGE_SECONDS old.
+# The snapshot is built on first use, per process; until then the scheduler does nothing.
+
+EXPOSURE_REFRESH_SECONDS = int(os.getenv("EXPOSURE_REFRESH_SECONDS", "60")) # 0 disables the scheduler
+EXPOSURE_MAX_AGE_SECONDS = int(os.getenv("EXPOSURE_MAX_AGE_SECONDS", str(2 * EXPOSURE_REFRESH_SECONDS or 300)))
+EXPOSURE_READ_CHUNK_SIZE = 100000 # Holdings per fetch while building
+
+
+class HoldingsSnapshot:
+    def __init__(self, db: Session):
+        start = time.perf_counter()
+        self.source_version = crud.get_exposure_source_version(db)
+
+        asset_rows = crud.get_exposure_assets(db)
+        asset_ids, tickers, asset_types, prices = columns(asset_rows, 4)
+        self.tickers = np.array(tickers, dtype=object)
+        self.asset_types, self.asset_type_of_asset = np.unique(np.array(asset_types, dtype=str), return_inverse=True)
+        prices = np.array(prices, dtype=np.float64)
+        np.nan_to_num(prices, copy=False) # Assets without a price count for 0
+
+        portfolio_rows = crud.get_exposure_portfolios(db)
+        portfolio_ids, _, risk_profiles = columns(portfolio_rows, 3)
+        self.risk_profiles, self.risk_profile_of_portfolio = np.unique(
+            np.array([getattr(r, "value", r) for r in risk_profiles], dtype=str), return_inverse=True
+        )
+
+        # The holdings as columns, read in chunks
+        portfolio_parts, asset_parts, quantity_parts = [np.zeros(0, np.int64)], [np.zeros(0, np.int64)], [np.zeros(0)]
+        for rows in crud.iter_exposure_holdings(db, EXPOSURE_READ_CHUNK_SIZE):
+            portfolio_column, asset_column, quantity_column = columns(rows, 3)
+            portfolio_parts.append(np.array(portfolio_column, dtype=np.int64))
+            asset_parts.append(np.array(asset_column, dtype=np.int64))
+            quantity_parts.append(np.array(quantity_column, dtype=np.float64))
+        # Row positions of the holdings' assets and portfolios (both id lists are sorted)
+        asset = np.searchsorted(np.array(asset_ids, dtype=np.int64), np.concatenate(asset_parts))
+        portfolio = np.searchsorted(np.array(portfolio_ids, dtype=np.int64), np.concatenate(portfolio_parts))
+        quantity = np.concatenate(quantity_parts)
+        market_value = quantity * prices[asset]
+
+        # Grouped once here, so that a query only slices and sums small arrays:
+        # per (asset type, portfolio) cell, and per (risk profile, asset) cell
+        self.portfolio_count, self.asset_count, self.holding_count = len(portfolio_ids), len(asset_ids), len(quantity)
+        types, profiles = len(self.asset_types), len(self.risk_profiles)
+        # (type-major: a type's portfolios are contiguous, which makes sums per type fast)
+        shape = (types, self.portfolio_count)
+        cell = self.asset_type_of_asset[asset] * self.portfolio_count + portfolio
+        self.type_portfolio_value = np.bincount(cell, weights=market_value, minlength=shape[0] * shape[1]).reshape(shape)
+        self.type_portfolio_holdings = np.bincount(cell, minlength=shape[0] * shape[1]).reshape(shape)
+        shape = (profiles, self.asset_count)
+        cell = self.risk_profile_of_portfolio[portfolio] * self.asset_count + asset
+        self.profile_asset_value = np.bincount(cell, weights=market_value, minlength=shape[0] * shape[1]).reshape(shape)
+        self.profile_asset_quantity = np.bincount(cell, weights=quantity, minlength=shape[0] * shape[1]).reshape(shape)
+        self.profile_asset_holdings = np.bincount(cell, minlength=shape[0] * shape[1]).reshape(shape)
+        self.built_at = time.time()
+        self.build_seconds = time.perf_counter() - start
+
+    def aggregate(self, group_by: str, asset_type: Optional[str] = None, risk_profile: Optional[str] = None, limit: Optional[int] = None) -> dict:
+        # Market value, share, holdings and portfolios per group_by key ("asset_type",
+        # "ticker" or "risk_profile") over the holdings matching the filters, largest first
+        type_code = code_of(self.asset_types, asset_type)
+        profile_code = code_of(self.risk_profiles, risk_profile)
+        if type_code == -1 or profile_code == -1:
+            return {"total_market_value": 0.0, "holdings": 0, "groups": []}
+        quantities = None
+        if group_by == "ticker":
+            # A portfolio holds an asset at most once, so portfolios = holdings
+            profiles = slice(None) if profile_code is None else [profile_code]
+            labels = self.tickers
+            values = self.profile_asset_value[profiles].sum(axis=0)
+            quantities = self.profile_asset_quantity[profiles].sum(axis=0)
+            holdings = self.profile_asset_holdings[profiles].sum(axis=0)
+            if type_code is not None:
+                holdings = np.where(self.asset_type_of_asset == type_code, holdings, 0)
+                values = np.where(holdings > 0, values, 0.0)
+            portfolios = holdings
+        else:
+            rows = slice(None) if profile_code is None else self.risk_profile_of_portfolio == profile_code
+            types = slice(None) if type_code is None else [type_code]
+            if group_by == "asset_type":
+                labels = self.asset_types
+                values = np.zeros(len(labels))
+                holdings = np.zeros(len(labels), dtype=np.int64)
+                values[types] = self.type_portfolio_value[types][:, rows].sum(axis=1)
+                cell_holdings = self.type_portfolio_holdings[types][:, rows]
+                holdings[types] = cell_holdings.sum(axis=1)
+                portfolios = np.zeros(len(labels), dtype=np.int64)
+                portfolios[types] = np.count_nonzero(cell_holdings, axis=1)
+            else:
+                # Per portfolio over the asset types, then per the portfolio's risk profile
+                labels = self.risk_profiles
+                profile = self.risk_profile_of_portfolio[rows]
+                portfolio_holdings = self.type_portfolio_holdings[types][:, rows].sum(axis=0)
+                values = np.bincount(profile, weights=self.type_portfolio_value[types][:, rows].sum(axis=0), minlength=len(labels))
+                holdings = np.bincount(profile, weights=portfolio_holdings, minlength=len(labels)).astype(np.int64)
+                portfolios = np.bincount(profile, weights=portfolio_holdings > 0, minlength=len(labels)).astype(np.int64)
+
+        present = np.flatnonzero(holdings)
+        if limit is not None and len(present) > limit:
+            present = present[np.argpartition(-values[present], limit - 1)[:limit]]
+        present = present[np.argsort(-values[present], kind="stable")]
+        total = float(values.sum())
+        return {
+            "total_market_value": total,
+            "holdings": int(holdings.sum()),
+            "groups": [{
+                "key": str(labels[i]),
+                "market_value": float(values[i]),
+                "share": float(values[i] / total) if total else 0.0,
+                "holdings": int(holdings[i]),
+                "portfolios": int(portfolios[i]),
+                "quantity": None if quantities is None else float(quantities[i])
+            } for i in present.tolist()]
+        }
+
+
+def code_of(labels: np.ndarray, value: Optional[str]) -> Optional[int]:
+    # Position of value in the sorted labels; -1 (matching nothing) if absent, None without a value
+    if value is None:
+        return None
+    position = int(np.searchsorted(labels, value))
+    return position if position < len(labels) and labels[position] == value else -1
+
+
+def columns(rows, count: int):
+    # Row tuples to count column tuples (empty ones for no rows)
+    return tuple(zip(*rows)) if rows else ((),) * count
+
+
+class SnapshotManager:
+    def __init__(self, refresh_seconds: int, max_age_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock() # One refresh at a time
+        self.snapshot: Optional[HoldingsSnapshot] = None
+        self.as_of: Optional[float] = None
+        self.refreshing = False
+        self.last_error: Optional[str] = None
+        self.scheduler: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def get(self) -> HoldingsSnapshot:
+        # The current snapshot, built first if there is none yet
+        snapshot = self.snapshot
+        if snapshot is None:
+            self.refresh(only_if_changed=True)
+            snapshot = self.snapshot
+        return snapshot
+
+    def refresh(self, only_if_changed: bool = False) -> bool:
+        # Rebuilds the snapshot (with only_if_changed, only if there is none or the source
+        # fingerprint moved); returns whether it did
+        with self.lock:
+            self.refreshing = True
+            try:
+                checked_at = time.time()
+                with database.SessionLocal() as db:
+                    if only_if_changed and self.snapshot is not None and crud.get_exposure_source_version(db) == self.snapshot.source_version:
+                        self.as_of, self.last_error = checked_at, None
+                        return False
+                    snapshot = HoldingsSnapshot(db)
+                # Swapped in whole: a query holding the previous snapshot finishes on it
+                self.snapshot, self.as_of, self.last_error = snapshot, checked_at, None
+                return True
+            finally:
+                self.refreshing = False
+
+    def status(self) -> dict:
+        snapshot, as_of = self.snapshot, self.as_of
+        status = {
+            "built": snapshot is not None,
+            "stale": True,
+            "refreshing": self.refreshing,
+            "refresh_seconds": self.refresh_seconds,
+            "last_error": self.last_error
+        }
+        if snapshot is not None:
+            age = max(0.0, time.time() - as_of)
+            status.update({
+                "built_at": datetime.fromtimestamp(snapshot.built_at, timezone.utc),
+                "build_seconds": round(snapshot.build_seconds, 3),
+                "as_of": datetime.fromtimestamp(as_of, timezone.utc),
+                "age_seconds": round(age, 3),
+                "stale": age > self.max_age_seconds,
+                "holdings": snapshot.holding_count,
+                "portfolios": snapshot.portfolio_count,
+                "assets": snapshot.asset_count
+            })
+        return status
+
+    def start_scheduler(self):
+        if self.refresh_seconds <= 0 or self.scheduler is not None:
+            return
+        self.scheduler = threading.Thread(target=self.run_scheduler, name="exposure-refresh", daemon=True)
+        self.scheduler.start()
+
+    def run_scheduler(self):
+        while not self.stopped.wait(self.refresh_seconds):
+            if self.snapshot is None:
+                continue
+            try:
+                self.refresh(only_if_changed=True)
+            except Exception as exc: # Keep serving the previous snapshot; it turns stale
+                self.last_error = f"{type(exc).__name__}: {exc}"
+
+
+snapshots = SnapshotManager(EXPOSURE_REFRESH_SECONDS, EXPOSURE_MAX_AGE_SECONDS)
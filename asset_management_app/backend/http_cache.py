@@ -0,0 +1,47 @@
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Conditional GET support. ETags are built from the version counters maintained by the
+# writes in crud.py (row versions on clients / portfolios / assets, and the per-table
+# counter for the asset list), which are far cheaper to read than the resources
+# themselves: a request whose If-None-Match still matches is answered with an empty 304
+# without running the valuation or listing queries.
+# ETags are weak (W/"..."): they identify the data, not the exact bytes, so they stay
+# valid when a proxy re-encodes (e.g. compresses) the body.
+
+# Assets change only through price feeds and new listings, so shared caches may serve
+# them for a few seconds without revalidating; client data is per-user and always revalidated.
+ASSET_CACHE_MAX_AGE = int(os.getenv("ASSET_CACHE_MAX_AGE", "5")) # Seconds
+PUBLIC_CACHE_CONTROL = f"public, max-age={ASSET_CACHE_MAX_AGE}"
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    # Weak ETag from the version parts of a resource (ids, version counters)
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/ prefixes are ignored, and it may be a
+    # comma-separated list or *
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+
+def cache_headers(etag: str, cache_control: str) -> dict:
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def not_modified(request: Request, etag: str, cache_control: str) -> Optional[Response]:
+    # The 304 response if the request's If-None-Match matches etag, otherwise None
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers(etag, cache_control))
+    return None
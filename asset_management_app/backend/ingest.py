@@ -0,0 +1,90 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+from starlette.requests import Request
+
+# Incremental parsing of bulk upload bodies (see POST /assets/bulk and POST /assets/prices).
+# CSV and NDJSON bodies are parsed line by line as they arrive, so an upload is
+# never fully buffered in memory. A plain JSON array is also accepted for small loads.
+
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+# Each parsed record is (record, error): record is a dict of fields, or None if the
+# line could not be parsed, in which case error says why.
+Record = Tuple[Optional[dict], Optional[str]]
+
+
+def get_content_type(request: Request) -> str:
+    return request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+
+
+async def iter_body_lines(request: Request) -> AsyncIterator[str]:
+    # Yields complete lines from the request body stream, without line endings.
+    decoder = codecs.getincrementaldecoder("utf-8")() # Chunks may split multi-byte characters
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_csv_records(request: Request) -> AsyncIterator[Record]:
+    # The first line is the header, e.g. name,ticker_symbol,asset_type,current_price
+    header = None
+    async for line in iter_body_lines(request):
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        if len(values) != len(header):
+            yield None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield dict(zip(header, values)), None
+
+
+async def iter_ndjson_records(request: Request) -> AsyncIterator[Record]:
+    async for line in iter_body_lines(request):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield None, "Expected a JSON object"
+            continue
+        yield record, None
+
+
+async def iter_json_array_records(request: Request) -> AsyncIterator[Record]:
+    try:
+        records = json.loads(await request.body())
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON body: {e}")
+    if not isinstance(records, list):
+        raise ValueError("Expected a JSON array of assets")
+    for record in records:
+        if isinstance(record, dict):
+            yield record, None
+        else:
+            yield None, "Expected a JSON object"
+
+
+def iter_upload_records(request: Request) -> AsyncIterator[Record]:
+    content_type = get_content_type(request)
+    if content_type in CSV_CONTENT_TYPES:
+        return iter_csv_records(request)
+    if content_type in NDJSON_CONTENT_TYPES:
+        return iter_ndjson_records(request)
+    return iter_json_array_records(request)
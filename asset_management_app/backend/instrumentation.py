@@ -0,0 +1,133 @@
+import bisect
+import contextvars
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request database instrumentation. SQLAlchemy cursor events add every statement's
+# duration to the stats of the request being served (found through a context variable,
+# which follows the request into the threadpool and into the async engine). The HTTP
+# middleware in main.py starts the stats, reports them in a Server-Timing header and
+# records them in per-route histograms, served in Prometheus text format at /metrics.
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0 # Seconds
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+
+    def record(self, statement: str, duration: float):
+        self.queries += 1
+        self.db_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+
+current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request_stats", default=None)
+
+
+# The start time is kept on the statement's execution context, not on the connection, so
+# nothing is left behind when a statement fails: failures are recorded by handle_error.
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_start_time = time.perf_counter()
+
+
+def record_statement(context, statement: str):
+    start = getattr(context, "query_start_time", None)
+    stats = current_request_stats.get()
+    if start is not None and stats is not None:
+        stats.record(statement, time.perf_counter() - start)
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_statement(context, statement)
+
+
+def handle_error(exception_context):
+    # Also called for errors raised before the cursor ran, which have no start time
+    record_statement(exception_context.execution_context, exception_context.statement)
+
+
+def instrument_engine(engine: Engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def server_timing_header(stats: RequestStats, handler_time: float) -> str:
+    # e.g. db;dur=3.1;desc="4 queries", db-slowest;dur=1.2;desc="SELECT ...", app;dur=9.8
+    parts = [f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries"']
+    if stats.slowest_statement is not None:
+        statement = " ".join(stats.slowest_statement.split())[:80].replace('"', "'").replace("\\", "/")
+        parts.append(f'db-slowest;dur={stats.slowest_time * 1000:.2f};desc="{statement}"')
+    parts.append(f"app;dur={handler_time * 1000:.2f}")
+    return ", ".join(parts)
+
+
+# --- Per-route histograms ---
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+class Histogram:
+    # Cumulative Prometheus histogram with one series per label set
+    def __init__(self, name: str, help_text: str, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {} # labels tuple -> [bucket counts..., count, sum]
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * len(self.buckets) + [0, 0.0]
+        index = bisect.bisect_left(self.buckets, value) # First bucket with value <= le
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self, label_names) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            label_text = ",".join(f'{n}="{v}"' for n, v in zip(label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]}")
+        return "\n".join(lines)
+
+
+class RequestMetrics:
+    LABEL_NAMES = ("method", "route", "status")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.duration = Histogram("http_request_duration_seconds", "Time spent handling the request.", SECONDS_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds", "Time spent executing SQL statements per request.", SECONDS_BUCKETS)
+        self.slowest_query = Histogram("http_request_slowest_query_seconds", "Duration of the slowest SQL statement per request.", SECONDS_BUCKETS)
+        self.queries = Histogram("http_request_db_queries", "SQL statements executed per request.", QUERY_COUNT_BUCKETS)
+
+    def observe(self, method: str, route: str, status: int, stats: RequestStats, handler_time: float):
+        labels = (method, route, str(status))
+        with self.lock:
+            self.duration.observe(labels, handler_time)
+            self.db_time.observe(labels, stats.db_time)
+            self.slowest_query.observe(labels, stats.slowest_time)
+            self.queries.observe(labels, stats.queries)
+
+    def render(self) -> str:
+        with self.lock:
+            histograms = (self.duration, self.db_time, self.slowest_query, self.queries)
+            return "\n".join(h.render(self.LABEL_NAMES) for h in histograms) + "\n"
+
+
+request_metrics = RequestMetrics()
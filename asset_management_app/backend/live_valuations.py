@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+from typing import Dict, Iterable, List, Set
+
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Live portfolio valuations pushed over WebSockets (WS /ws/valuations), instead of
+# re-polling GET /clients/{id}/portfolio. A connection subscribes to portfolio ids. After
+# each committed price feed, crud reads the materialized total_value of only the affected
+# portfolios that have subscribers (one IN query) and publishes them here, as do the
+# holding writes.
+# Updates are coalesced: values published within LIVE_VALUATION_WINDOW_MS are handed to
+# the subscribers in one pass at the end of the window, and each connection sends what has
+# accumulated for it as one message. A burst of ticks thus produces at most one message per
+# connection per window, fewer if the client reads slowly; what a connection holds is
+# bounded by its subscriptions, not by the tick rate.
+# A message lists {portfolio_id, total_value, change}, change being the difference to the
+# value last sent on that connection (null for the first one); unchanged values are not sent.
+# Subscriptions are per process: a price feed posted to another worker is not seen here.
+
+LIVE_VALUATION_WINDOW_MS = int(os.getenv("LIVE_VALUATION_WINDOW_MS", "250"))
+LIVE_MAX_SUBSCRIPTIONS = int(os.getenv("LIVE_MAX_SUBSCRIPTIONS", "1000")) # Portfolios per connection
+
+
+class Subscriber:
+    # One connection's state; used on the event loop only
+    def __init__(self):
+        self.portfolio_ids: Set[int] = set()
+        self.sent: Dict[int, float] = {} # Last total_value sent per portfolio
+        self.pending: Dict[int, float] = {} # Newer values not sent yet
+        self.notices: List[dict] = [] # Other messages (errors), sent before the values
+        self.ready = asyncio.Event()
+
+    def set_initial(self, values: Dict[int, float]):
+        # Current values read at subscription; a value already published or sent is newer
+        for portfolio_id, value in values.items():
+            if portfolio_id in self.portfolio_ids and portfolio_id not in self.sent:
+                self.pending.setdefault(portfolio_id, value)
+        self.ready.set()
+
+    def notify(self, message: dict):
+        self.notices.append(message)
+        self.ready.set()
+
+    def take_messages(self) -> List[dict]:
+        messages, self.notices = self.notices, []
+        pending, self.pending = self.pending, {}
+        updates = []
+        for portfolio_id, value in pending.items():
+            if portfolio_id not in self.portfolio_ids:
+                continue
+            previous = self.sent.get(portfolio_id)
+            if value == previous:
+                continue
+            self.sent[portfolio_id] = value
+            updates.append({"portfolio_id": portfolio_id, "total_value": value, "change": None if previous is None else value - previous})
+        if updates:
+            messages.append({"type": "valuations", "updates": updates})
+        return messages
+
+
+class ValuationHub:
+    def __init__(self, window_seconds: float):
+        self.window = window_seconds
+        self.lock = threading.Lock() # publish() is called from threadpool threads
+        self.subscribers: Dict[int, Set[Subscriber]] = {}
+        self.published: Dict[int, float] = {}
+        self.flush_scheduled = False
+        self.loop = None # The event loop serving the connections
+
+    def subscribed_ids(self, portfolio_ids: Iterable[int]) -> List[int]:
+        with self.lock:
+            return [portfolio_id for portfolio_id in portfolio_ids if portfolio_id in self.subscribers]
+
+    def subscribe(self, subscriber: Subscriber, portfolio_ids: Iterable[int]):
+        self.loop = asyncio.get_running_loop()
+        with self.lock:
+            for portfolio_id in portfolio_ids:
+                subscriber.portfolio_ids.add(portfolio_id)
+                self.subscribers.setdefault(portfolio_id, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, portfolio_ids: Iterable[int]):
+        with self.lock:
+            for portfolio_id in list(portfolio_ids):
+                subscriber.portfolio_ids.discard(portfolio_id)
+                subscriber.sent.pop(portfolio_id, None)
+                subscriber.pending.pop(portfolio_id, None)
+                subscribers = self.subscribers.get(portfolio_id)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.subscribers[portfolio_id]
+
+    def publish(self, values: Dict[int, float]):
+        # New total_values by portfolio id, from any thread; delivered at the end of the window
+        with self.lock:
+            values = {portfolio_id: value for portfolio_id, value in values.items() if portfolio_id in self.subscribers}
+            if not values or self.loop is None:
+                return
+            self.published.update(values)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+            loop = self.loop
+        try:
+            loop.call_soon_threadsafe(loop.call_later, self.window, self.flush)
+        except RuntimeError: # The loop has been closed
+            with self.lock:
+                self.flush_scheduled = False
+
+    def flush(self):
+        with self.lock:
+            published, self.published = self.published, {}
+            self.flush_scheduled = False
+            for portfolio_id, value in published.items():
+                for subscriber in self.subscribers.get(portfolio_id, ()):
+                    subscriber.pending[portfolio_id] = value
+                    subscriber.ready.set()
+
+
+async def send_messages(websocket: WebSocket, subscriber: Subscriber):
+    # The connection's only writer: waits for the subscriber to have something, then sends it
+    try:
+        while True:
+            await subscriber.ready.wait()
+            subscriber.ready.clear()
+            for message in subscriber.take_messages():
+                await websocket.send_text(orjson.dumps(message).decode())
+    except (WebSocketDisconnect, RuntimeError): # Closed by the client; the receive loop cleans up
+        pass
+
+
+hub = ValuationHub(LIVE_VALUATION_WINDOW_MS / 1000)
@@ -1,18 +1,68 @@
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import orjson
+
+from fastapi import BackgroundTasks, FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from . import crud, models, database, ai_engine # ai_engine will be used later
+from . import crud, crud_async, models, database, ai_engine, asset_search, batch_recommendations, compression, exposure, http_cache, ingest, instrumentation, live_valuations, pagination, price_history, rebalancing, serialization
 
 # Create database tables
 database.create_db_and_tables()
 
+# Fill the in-memory asset search index (see asset_search.py), and give the price history
+# a first tick for assets that have none (see price_history.py)
+with database.SessionLocal() as startup_db:
+    crud.update_asset_search_index(startup_db)
+    crud.record_initial_prices(startup_db)
+
+# Periodic refresh of the exposure snapshot, once it has been built (see exposure.py)
+exposure.snapshots.start_scheduler()
+
 app = FastAPI(
     title="AI Asset Management API",
     description="API for managing financial advisor assets and providing AI-powered recommendations.",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse # orjson encodes responses several times faster than the json module
 )
 
+# Per-request query count / DB time, reported in the Server-Timing header and at /metrics
+instrumentation.instrument_engine(database.engine)
+instrumentation.instrument_engine(database.async_engine.sync_engine)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    stats = instrumentation.RequestStats()
+    token = instrumentation.current_request_stats.set(stats)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        instrumentation.current_request_stats.reset(token)
+    # For streamed responses (the exports) this covers the handler, not the body
+    handler_time = time.perf_counter() - start
+    response.headers["Server-Timing"] = instrumentation.server_timing_header(stats, handler_time)
+    route = request.scope.get("route") # Path template, so /clients/{client_id} is one series
+    instrumentation.request_metrics.observe(
+        request.method, route.path if route else "unmatched", response.status_code, stats, handler_time
+    )
+    return response
+
+# zstd / gzip compression of responses above COMPRESSION_MINIMUM_SIZE bytes (see compression.py).
+# Added last, so it is the outermost middleware and compresses the final body.
+app.add_middleware(compression.CompressionMiddleware)
+
+# Rows per chunk of the streamed list responses (?stream=true)
+STREAM_CHUNK_SIZE = 1000
+
 # Dependency to get DB session
 def get_db_session():
     db = database.SessionLocal()
@@ -21,6 +71,14 @@ def get_db_session():
     finally:
         db.close()
 
+def decode_cursor_or_400(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return pagination.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # API Endpoints
 
 # Clients
@@ -31,36 +89,100 @@ def create_new_client(client: models.ClientCreate, db: Session = Depends(get_db_
         raise HTTPException(status_code=400, detail="Email already registered")
     return crud.create_client(db=db, client=client)
 
+# Paging: pass the X-Next-Cursor response header back as ?cursor= to get the next page.
+# skip (OFFSET paging) is still accepted but scans every skipped row; prefer cursor.
+# List endpoints serialize plain rows directly (see serialization.py); response_model
+# only documents the shape, since a returned Response skips its validation.
+# With stream=true, every matching client after cursor is returned (skip and limit do
+# not apply) as the same JSON array, encoded and sent chunk by chunk as the rows come off
+# a server-side cursor, so memory stays flat and the first bytes go out immediately.
 @app.get("/clients/", response_model=List[models.Client], tags=["Clients"])
-def read_all_clients(skip: int = 0, limit: int = 100, db: Session = Depends(get_db_session)):
-    clients = crud.get_clients(db, skip=skip, limit=limit)
-    return clients
-
+def read_all_clients(
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    name_prefix: Optional[str] = None, # Prefix of last_name
+    stream: bool = False,
+    db: Session = Depends(get_db_session)
+):
+    if stream:
+        after_id = decode_cursor_or_400(cursor)
+
+        def generate():
+            stream_db = database.SessionLocal() # Own session: the response outlives the request dependencies
+            try:
+                yield from serialization.json_array_chunks(
+                    serialization.client_rows_to_dicts(rows, portfolio_rows)
+                    for rows, portfolio_rows in crud.iter_client_chunks(stream_db, STREAM_CHUNK_SIZE, after_id, name_prefix)
+                )
+            finally:
+                stream_db.close()
+        return StreamingResponse(generate(), media_type="application/json")
+
+    headers = {}
+    if skip and cursor is None:
+        rows = crud.get_client_rows(db, skip=skip, limit=limit, name_prefix=name_prefix)
+    else:
+        rows = crud.get_client_rows_page(db, after_id=decode_cursor_or_400(cursor), limit=limit, name_prefix=name_prefix)
+        if rows and len(rows) == limit:
+            headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(rows[-1].id)
+    portfolio_rows = crud.get_portfolio_rows_for_clients(db, [row.id for row in rows])
+    return ORJSONResponse(serialization.client_rows_to_dicts(rows, portfolio_rows), headers=headers)
+
+# Full-table dump as NDJSON (one client per line), streamed page by page on the keyset cursor
+@app.get("/clients/export", tags=["Clients"])
+def export_clients(name_prefix: Optional[str] = None):
+    def generate():
+        db = database.SessionLocal() # Own session: the response outlives the request dependencies
+        try:
+            for row in crud.iter_client_rows(db, name_prefix=name_prefix):
+                client_id, first_name, last_name, email, risk_profile = row
+                yield orjson.dumps({
+                    "id": client_id,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "email": email,
+                    "risk_profile": risk_profile.value if risk_profile is not None else None
+                }) + b"\n"
+        finally:
+            db.close()
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+# Hot read endpoints are async and use the async engine (crud_async), so they do not
+# occupy a threadpool slot while waiting on the database.
+# Conditional GET: the ETag covers the client row and the versions of all its portfolios
+# (bumped by holding changes and by price updates of held assets); a matching
+# If-None-Match gets a 304 after that single query, without valuing the portfolios.
 @app.get("/clients/{client_id}", response_model=models.Client, tags=["Clients"])
-def read_single_client(client_id: int, db: Session = Depends(get_db_session)):
-    db_client = crud.get_client(db, client_id=client_id)
+async def read_single_client(client_id: int, request: Request, response: Response, db: AsyncSession = Depends(database.get_async_db)):
+    db_client, portfolio_versions = await crud_async.get_client_with_portfolio_versions(db, client_id=client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
-    # Manually construct portfolio responses to include details
+    etag = http_cache.make_etag("client", client_id, db_client.version, portfolio_versions)
+    not_modified = http_cache.not_modified(request, etag, http_cache.PRIVATE_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    response.headers.update(http_cache.cache_headers(etag, http_cache.PRIVATE_CACHE_CONTROL))
+    # Value all of the client's portfolios in one batch instead of one get_portfolio_details call each
     portfolios_with_details = []
-    for p_db in db_client.portfolios:
-        p_details_dict = crud.get_portfolio_details(db, p_db.id) # This returns a dict
-        if p_details_dict:
-             # We need a Pydantic model that matches structure of p_details_dict for response_model
-             # For now, let's create a temporary structure or adjust models.Portfolio
-             # This highlights a need to refine Portfolio response model
-            assets_in_p = [models.PortfolioAsset(asset_id=ad['asset'].id, quantity=ad['quantity']) for ad in p_details_dict.get('assets_details', [])]
-
-            portfolios_with_details.append(models.Portfolio(
-                id=p_details_dict['portfolio_id'],
-                name=p_details_dict['name'],
-                client_id=p_details_dict['client_id'],
-                assets=assets_in_p, # This now matches List[PortfolioAsset]
-                total_value=p_details_dict['total_value']
-            ))
-    client_data = models.Client.from_orm(db_client)
-    client_data.portfolios = portfolios_with_details
-    return client_data
+    for valuation in await crud_async.get_portfolio_valuations(db, client_ids=[client_id]):
+        assets_in_p = [models.PortfolioAsset(asset_id=h['asset_id'], quantity=h['quantity']) for h in valuation['holdings']]
+        portfolios_with_details.append(models.Portfolio(
+            id=valuation['portfolio_id'],
+            name=valuation['name'],
+            client_id=valuation['client_id'],
+            assets=assets_in_p,
+            total_value=valuation['total_value']
+        ))
+    # Built field by field so that model_validate does not lazy-load db_client.portfolios again
+    return models.Client(
+        id=db_client.id,
+        first_name=db_client.first_name,
+        last_name=db_client.last_name,
+        email=db_client.email,
+        risk_profile=db_client.risk_profile,
+        portfolios=portfolios_with_details
+    )
 
 
 @app.put("/clients/{client_id}", response_model=models.Client, tags=["Clients"])
@@ -83,20 +205,145 @@ def create_new_asset(asset: models.AssetCreate, db: Session = Depends(get_db_ses
     db_asset = crud.get_asset_by_ticker(db, ticker_symbol=asset.ticker_symbol)
     if db_asset:
         raise HTTPException(status_code=400, detail="Asset ticker symbol already exists")
-    return crud.create_asset(db=db, asset=asset)
+    db_asset = crud.create_asset(db=db, asset=asset)
+    crud.record_initial_prices(db, after_id=db_asset.id - 1) # Its first price history tick
+    return db_asset
 
+# Bulk ingestion: accepts a JSON array, or a streamed CSV (text/csv) or NDJSON
+# (application/x-ndjson) body. Records are validated and inserted in batches with
+# one duplicate check and one executemany per batch, and committed in one transaction.
+@app.post("/assets/bulk", response_model=models.BulkAssetResult, tags=["Assets"])
+async def create_assets_in_bulk(request: Request, db: Session = Depends(get_db_session)):
+    results = []
+    seen_tickers = set()
+    batch = []
+    try:
+        async for record in ingest.iter_upload_records(request):
+            batch.append(record)
+            if len(batch) >= crud.BULK_ASSET_BATCH_SIZE:
+                results += await run_in_threadpool(crud.insert_asset_batch, db, batch, len(results) + 1, seen_tickers)
+                batch = []
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if batch:
+        results += await run_in_threadpool(crud.insert_asset_batch, db, batch, len(results) + 1, seen_tickers)
+    summary = await run_in_threadpool(crud.finish_asset_bulk_load, db, results)
+    created_ids = [result["id"] for result in results if "id" in result]
+    if created_ids:
+        await run_in_threadpool(crud.record_initial_prices, db, min(created_ids) - 1)
+    return summary
+
+# Price feed: a JSON array, or a streamed CSV (ticker_symbol,current_price) or NDJSON body.
+# Ticks are applied in batches with one executemany UPDATE each, in one transaction.
+@app.post("/assets/prices", response_model=models.PriceUpdateResult, tags=["Assets"])
+async def update_asset_prices(request: Request, db: Session = Depends(get_db_session)):
+    state = crud.start_price_update()
+    batch = []
+    try:
+        async for record in ingest.iter_upload_records(request):
+            batch.append(record)
+            if len(batch) >= crud.PRICE_UPDATE_BATCH_SIZE:
+                await run_in_threadpool(crud.apply_price_batch, db, batch, state)
+                batch = []
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if batch:
+        await run_in_threadpool(crud.apply_price_batch, db, batch, state)
+    result = await run_in_threadpool(crud.finish_price_update, db, state)
+    await run_in_threadpool(crud.publish_price_update, db, state)
+    return result
+
+# Paging: pass the X-Next-Cursor response header back as ?cursor= to get the next page.
+# skip (OFFSET paging) is still accepted but scans every skipped row; prefer cursor.
+# Conditional GET: the ETag is the assets table's change counter (bumped by new assets
+# and price feeds) plus the query parameters, so an unchanged page is a 304 after one
+# primary key lookup. Publicly cacheable for ASSET_CACHE_MAX_AGE seconds.
+# stream=true returns every matching asset after cursor, streamed as for /clients/.
 @app.get("/assets/", response_model=List[models.Asset], tags=["Assets"])
-def read_all_assets(skip: int = 0, limit: int = 100, db: Session = Depends(get_db_session)):
-    assets = crud.get_assets(db, skip=skip, limit=limit)
-    return assets
+def read_all_assets(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    asset_type: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    stream: bool = False,
+    db: Session = Depends(get_db_session)
+):
+    etag = http_cache.make_etag("assets", crud.get_table_version(db, "assets"), skip, limit, cursor, asset_type, name_prefix, stream)
+    not_modified = http_cache.not_modified(request, etag, http_cache.PUBLIC_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    headers = http_cache.cache_headers(etag, http_cache.PUBLIC_CACHE_CONTROL)
+    if stream:
+        after_id = decode_cursor_or_400(cursor)
+
+        def generate():
+            stream_db = database.SessionLocal() # Own session: the response outlives the request dependencies
+            try:
+                yield from serialization.json_array_chunks(
+                    serialization.asset_rows_to_dicts(rows)
+                    for rows in crud.iter_asset_chunks(stream_db, STREAM_CHUNK_SIZE, after_id, asset_type, name_prefix)
+                )
+            finally:
+                stream_db.close()
+        return StreamingResponse(generate(), media_type="application/json", headers=headers)
+
+    if skip and cursor is None:
+        rows = crud.get_asset_rows(db, skip=skip, limit=limit, asset_type=asset_type, name_prefix=name_prefix)
+    else:
+        rows = crud.get_asset_rows_page(db, after_id=decode_cursor_or_400(cursor), limit=limit, asset_type=asset_type, name_prefix=name_prefix)
+        if rows and len(rows) == limit:
+            headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(rows[-1].id)
+    return ORJSONResponse(serialization.asset_rows_to_dicts(rows), headers=headers)
+
+# Search as you type: tickers by prefix and names by word prefix, ranked with RapidFuzz,
+# from the in-memory index (no database query). Runs on the event loop: a search takes
+# well under a millisecond, less than handing it to the threadpool. q is bounded in length
+# (and typo correction in word length) so that no query can hold the event loop for long.
+@app.get("/assets/search", response_model=List[models.AssetSearchResult], tags=["Assets"])
+async def search_assets(q: str = Query(..., max_length=asset_search.SEARCH_MAX_QUERY_LENGTH), limit: int = 10):
+    if not 1 <= limit <= 50:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 50")
+    return ORJSONResponse(asset_search.asset_index.search(q, limit))
+
+# Full-table dump as NDJSON (one asset per line), streamed page by page on the keyset cursor
+@app.get("/assets/export", tags=["Assets"])
+def export_assets(asset_type: Optional[str] = None, name_prefix: Optional[str] = None):
+    def generate():
+        db = database.SessionLocal() # Own session: the response outlives the request dependencies
+        try:
+            for asset_id, name, ticker_symbol, asset_type_, current_price in crud.iter_asset_rows(db, asset_type=asset_type, name_prefix=name_prefix):
+                yield orjson.dumps({
+                    "id": asset_id,
+                    "name": name,
+                    "ticker_symbol": ticker_symbol,
+                    "asset_type": asset_type_,
+                    "current_price": current_price
+                }) + b"\n"
+        finally:
+            db.close()
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @app.get("/assets/{asset_id}", response_model=models.Asset, tags=["Assets"])
-def read_single_asset(asset_id: int, db: Session = Depends(get_db_session)):
+def read_single_asset(asset_id: int, request: Request, response: Response, db: Session = Depends(get_db_session)):
     db_asset = crud.get_asset(db, asset_id=asset_id)
     if db_asset is None:
         raise HTTPException(status_code=404, detail="Asset not found")
+    etag = http_cache.make_etag("asset", asset_id, db_asset.version)
+    not_modified = http_cache.not_modified(request, etag, http_cache.PUBLIC_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    response.headers.update(http_cache.cache_headers(etag, http_cache.PUBLIC_CACHE_CONTROL))
     return db_asset
 
+# An asset's recorded ticks with start <= timestamp <= end (Unix seconds), columnar.
+# The arrays are read as views of the mapped files and encoded by orjson directly.
+@app.get("/assets/{asset_id}/history", response_model=models.AssetPriceHistory, tags=["Assets"])
+def read_asset_price_history(asset_id: int, start: Optional[int] = None, end: Optional[int] = None):
+    timestamps, prices = price_history.get_store().range(asset_id, start, end)
+    return ORJSONResponse({"asset_id": asset_id, "timestamps": np.asarray(timestamps), "prices": np.asarray(prices)})
+
 # Portfolio class for response model that includes details
 class PortfolioDetailsResponse(models.PortfolioBase):
     id: int
@@ -111,57 +358,53 @@ class PortfolioDetailsResponse(models.PortfolioBase):
 # and PUT /portfolios/{portfolio_id}
 @app.post("/clients/{client_id}/portfolio", response_model=models.Portfolio, tags=["Portfolios"])
 def create_or_update_client_portfolio(client_id: int, portfolio: models.PortfolioCreate, db: Session = Depends(get_db_session)):
-    db_client = crud.get_client(db, client_id=client_id)
-    if not db_client:
+    # One lookup for the client and its portfolio; the crud write returns the response
+    # built in the same unit of work, so nothing is re-fetched after the commit
+    client_exists, db_portfolio = crud.get_client_portfolio(db, client_id=client_id)
+    if not client_exists:
         raise HTTPException(status_code=404, detail="Client not found")
 
     # Check if client already has portfolios. If so, update the first one found? Or allow multiple?
     # Current plan implies one portfolio endpoint. Let's assume we update the first one or create new.
-    existing_portfolios = crud.get_portfolios_by_client(db, client_id=client_id, limit=1)
-    if existing_portfolios:
+    if db_portfolio:
         # Update existing portfolio's assets
-        updated_portfolio = crud.update_portfolio_assets(db, portfolio_id=existing_portfolios[0].id, portfolio_update=portfolio)
-        if not updated_portfolio:
-             raise HTTPException(status_code=500, detail="Could not update portfolio") # Should not happen if portfolio exists
-        # We need to shape this response to models.Portfolio
-        # crud.update_portfolio_assets returns DbPortfolio, so from_orm should work if fields match
-        # Let's re-fetch details for consistent response structure
-        p_details_dict = crud.get_portfolio_details(db, updated_portfolio.id)
-        assets_in_p = [models.PortfolioAsset(asset_id=ad['asset'].id, quantity=ad['quantity']) for ad in p_details_dict.get('assets_details', [])]
-        return models.Portfolio(
-            id=p_details_dict['portfolio_id'],
-            name=p_details_dict['name'],
-            client_id=p_details_dict['client_id'],
-            assets=assets_in_p,
-            total_value=p_details_dict['total_value']
-        )
+        updated_portfolio = crud.update_portfolio_assets(db, db_portfolio=db_portfolio, portfolio_update=portfolio)
+        live_valuations.hub.publish({updated_portfolio.id: updated_portfolio.total_value})
+        return updated_portfolio
+    # Create new portfolio
+    return crud.create_client_portfolio(db=db, portfolio=portfolio, client_id=client_id)
+
+# Partial holding changes: only the listed holdings are upserted / removed
+@app.patch("/clients/{client_id}/portfolio", response_model=models.Portfolio, tags=["Portfolios"])
+def patch_client_portfolio(client_id: int, portfolio_patch: models.PortfolioPatch, db: Session = Depends(get_db_session)):
+    client_exists, db_portfolio = crud.get_client_portfolio(db, client_id=client_id)
+    if not client_exists:
+        raise HTTPException(status_code=404, detail="Client not found")
+    if not db_portfolio:
+        raise HTTPException(status_code=404, detail="Portfolio not found for this client")
 
-    else:
-        # Create new portfolio
-        new_portfolio = crud.create_client_portfolio(db=db, portfolio=portfolio, client_id=client_id)
-        # crud.create_client_portfolio returns DbPortfolio. We need to shape this.
-        p_details_dict = crud.get_portfolio_details(db, new_portfolio.id) # Re-fetch to get details
-        assets_in_p = [models.PortfolioAsset(asset_id=ad['asset'].id, quantity=ad['quantity']) for ad in p_details_dict.get('assets_details', [])]
-        return models.Portfolio(
-            id=p_details_dict['portfolio_id'],
-            name=p_details_dict['name'],
-            client_id=p_details_dict['client_id'],
-            assets=assets_in_p,
-            total_value=p_details_dict['total_value']
-        )
+    patched_portfolio = crud.patch_portfolio_assets(db, db_portfolio=db_portfolio, portfolio_patch=portfolio_patch)
+    live_valuations.hub.publish({patched_portfolio.id: patched_portfolio.total_value})
+    return patched_portfolio
 
+# Conditional GET: the ETag is the portfolio's version (bumped by holding changes and by
+# price updates of held assets); a match is a 304 without reading the holdings
 @app.get("/clients/{client_id}/portfolio", response_model=PortfolioDetailsResponse, tags=["Portfolios"])
-def get_client_portfolio_details(client_id: int, db: Session = Depends(get_db_session)):
-    db_client = crud.get_client(db, client_id=client_id)
-    if not db_client:
-        raise HTTPException(status_code=404, detail="Client not found")
-
+async def get_client_portfolio_details(client_id: int, request: Request, response: Response, db: AsyncSession = Depends(database.get_async_db)):
     # Assuming client has one main portfolio for this endpoint, or we fetch the first one.
-    portfolios = crud.get_portfolios_by_client(db, client_id=client_id, limit=1)
-    if not portfolios:
+    client_exists, db_portfolio = await crud_async.get_client_portfolio(db, client_id=client_id)
+    if not client_exists:
+        raise HTTPException(status_code=404, detail="Client not found")
+    if not db_portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found for this client")
 
-    portfolio_details_dict = crud.get_portfolio_details(db, portfolio_id=portfolios[0].id)
+    etag = http_cache.make_etag("portfolio", db_portfolio.id, db_portfolio.version)
+    not_modified = http_cache.not_modified(request, etag, http_cache.PRIVATE_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    response.headers.update(http_cache.cache_headers(etag, http_cache.PRIVATE_CACHE_CONTROL))
+
+    portfolio_details_dict = await crud_async.get_portfolio_details(db, db_portfolio)
     if not portfolio_details_dict:
         raise HTTPException(status_code=404, detail="Portfolio details not found")
 
@@ -190,37 +433,177 @@ def get_client_portfolio_details(client_id: int, db: Session = Depends(get_db_se
         total_value=portfolio_details_dict['total_value']
     )
 
+# Daily values of the client's portfolio from start to end (UTC dates, inclusive; by default
+# the last HISTORY_DEFAULT_DAYS), at each day's closing prices in the price history and
+# today's holdings. Computed from the memory-mapped history, one dot product per date.
+HISTORY_DEFAULT_DAYS = 30
+HISTORY_MAX_DAYS = 3660
+
+@app.get("/clients/{client_id}/portfolio/history", response_model=models.PortfolioHistory, tags=["Portfolios"])
+def read_client_portfolio_history(client_id: int, start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_db_session)):
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=HISTORY_DEFAULT_DAYS - 1)
+    if start > end or (end - start).days >= HISTORY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"start must be on or before end, at most {HISTORY_MAX_DAYS} days apart")
+    client_exists, db_portfolio = crud.get_client_portfolio(db, client_id=client_id)
+    if not client_exists:
+        raise HTTPException(status_code=404, detail="Client not found")
+    if not db_portfolio:
+        raise HTTPException(status_code=404, detail="Portfolio not found for this client")
+
+    holdings = crud.get_portfolio_quantities(db, portfolio_id=db_portfolio.id)
+    history = price_history.portfolio_value_history(price_history.get_store(), holdings, start, end)
+    return models.PortfolioHistory(
+        portfolio_id=db_portfolio.id,
+        client_id=client_id,
+        start=start,
+        end=end,
+        holdings=len(holdings),
+        points=[
+            models.PortfolioHistoryPoint(date=day, value=value, priced_holdings=priced)
+            for day, value, priced in zip(history["dates"].tolist(), history["values"].tolist(), history["priced_holdings"].tolist())
+        ]
+    )
+
+# Live valuations: send {"action": "subscribe" | "unsubscribe", "portfolio_ids": [...]}.
+# Receives {"type": "valuations", "updates": [{portfolio_id, total_value, change}, ...]}:
+# first each subscribed portfolio's current value (change null), then, after price feeds and
+# holding changes, the values that changed, coalesced per LIVE_VALUATION_WINDOW_MS (see
+# live_valuations.py). Invalid requests and unknown ids get {"type": "error", "detail": ...}.
+@app.websocket("/ws/valuations")
+async def live_valuations_socket(websocket: WebSocket):
+    await websocket.accept()
+    subscriber = live_valuations.Subscriber()
+    sender = asyncio.create_task(live_valuations.send_messages(websocket, subscriber))
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+            if message.get("text") is None:
+                subscriber.notify({"type": "error", "detail": "Send subscriptions as JSON text frames"})
+                continue
+            try:
+                request = models.ValuationSubscription.model_validate_json(message["text"])
+            except ValidationError as e:
+                subscriber.notify({"type": "error", "detail": e.errors(include_url=False, include_context=False)})
+                continue
+            portfolio_ids = list(dict.fromkeys(request.portfolio_ids))
+            if request.action == models.SubscriptionAction.unsubscribe:
+                live_valuations.hub.unsubscribe(subscriber, portfolio_ids)
+                continue
+            if len(subscriber.portfolio_ids | set(portfolio_ids)) > live_valuations.LIVE_MAX_SUBSCRIPTIONS:
+                subscriber.notify({"type": "error", "detail": f"At most {live_valuations.LIVE_MAX_SUBSCRIPTIONS} portfolios per connection"})
+                continue
+            # Subscribed before reading, so no update committed in between is missed
+            live_valuations.hub.subscribe(subscriber, portfolio_ids)
+            async with database.AsyncSessionLocal() as db:
+                values = await crud_async.get_portfolio_total_values(db, portfolio_ids)
+            unknown_ids = [portfolio_id for portfolio_id in portfolio_ids if portfolio_id not in values]
+            if unknown_ids:
+                live_valuations.hub.unsubscribe(subscriber, unknown_ids)
+                subscriber.notify({"type": "error", "detail": "Portfolios not found", "portfolio_ids": unknown_ids})
+            subscriber.set_initial(values)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_valuations.hub.unsubscribe(subscriber, list(subscriber.portfolio_ids))
+        sender.cancel()
+
+# Bulk valuations for dashboards: many clients/portfolios in a constant number of queries
+@app.post("/portfolios/valuations", response_model=List[models.PortfolioValuation], tags=["Portfolios"])
+def read_portfolio_valuations(request_body: models.ValuationRequest, db: Session = Depends(get_db_session)):
+    return crud.get_portfolio_valuations(
+        db,
+        client_ids=request_body.client_ids,
+        portfolio_ids=request_body.portfolio_ids,
+        include_holdings=request_body.include_holdings
+    )
+
+# Rebalancing (see rebalancing.py): a proposal is computed without writing anything; its
+# portfolios (all, or an edited subset of them and their trades) are then posted to
+# /rebalance/apply, which writes them in one transaction. Apply returns 409 with the
+# portfolio ids if any traded holding changed since the proposal; nothing is written then.
+# A cohort's proposal can hold hundreds of thousands of trades, so it is encoded as built
+# rather than validated against RebalanceProposal first (which takes twice as long as computing it).
+@app.post("/rebalance/proposals", response_model=models.RebalanceProposal, tags=["Rebalancing"])
+def propose_rebalance(request_body: models.RebalanceRequest, db: Session = Depends(get_db_session)):
+    try:
+        return ORJSONResponse(rebalancing.propose_rebalance(db, request_body))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/rebalance/apply", response_model=models.RebalanceApplyResult, tags=["Rebalancing"])
+def apply_rebalance(request_body: models.RebalanceApplyRequest, db: Session = Depends(get_db_session)):
+    try:
+        return rebalancing.apply_rebalance(db, request_body)
+    except rebalancing.RebalanceConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "portfolio_ids": e.portfolio_ids})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Book-wide exposure from the in-memory holdings snapshot (see exposure.py): no database
+# query once the snapshot is built (on the first request), refreshed in the background.
+# Each answer carries the snapshot's status, whose as_of / stale tell how current it is.
+@app.get("/analytics/exposure", response_model=models.ExposureReport, tags=["Analytics"])
+def read_exposure(
+    group_by: models.ExposureGroupBy = models.ExposureGroupBy.asset_type,
+    asset_type: Optional[str] = None,
+    risk_profile: Optional[models.RiskProfile] = None,
+    limit: int = 100
+):
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+    report = exposure.snapshots.get().aggregate(group_by.value, asset_type, risk_profile.value if risk_profile else None, limit)
+    return {"group_by": group_by, "asset_type": asset_type, "risk_profile": risk_profile, **report, "snapshot": exposure.snapshots.status()}
+
+@app.get("/analytics/exposure/status", response_model=models.ExposureSnapshotStatus, tags=["Analytics"])
+def read_exposure_status():
+    return exposure.snapshots.status()
+
+# Rebuilds the snapshot now, e.g. after a bulk load, without waiting for the scheduler
+@app.post("/analytics/exposure/refresh", response_model=models.ExposureSnapshotStatus, tags=["Analytics"])
+def refresh_exposure():
+    exposure.snapshots.refresh()
+    return exposure.snapshots.status()
+
 # AI Recommendations Endpoint
+def compute_recommendations(risk_profile: models.RiskProfile, market_trend: models.MarketTrend):
+    # Cache-miss path, run in the threadpool: streams the asset table through a sync
+    # session and scores it (CPU-bound work that should not run on the event loop).
+    db = database.SessionLocal()
+    try:
+        return ai_engine.get_cached_recommendations(
+            risk_profile=risk_profile,
+            market_trends=market_trend,
+            load_asset_chunks=lambda: crud.iter_asset_chunks(db)
+        )
+    finally:
+        db.close()
+
 @app.post("/clients/{client_id}/recommendations", response_model=List[models.RecommendedAsset], tags=["AI Engine"])
-def get_ai_recommendations_for_client(
+async def get_ai_recommendations_for_client(
     client_id: int,
     request_body: models.RecommendationRequest, # Contains market_trend (client_id from path is already used by RecommendationRequest model)
-    db: Session = Depends(get_db_session)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     # client_id from path is authoritative. request_body.client_id is ignored if present.
-    db_client = crud.get_client(db, client_id=client_id)
+    db_client = await crud_async.get_client(db, client_id=client_id)
     if not db_client:
         raise HTTPException(status_code=404, detail="Client not found")
 
     # The RecommendationRequest model has client_id, but we use the path client_id.
     # We also need to ensure the market_trend from the body is used.
 
-    # Option 1: Use all_db_assets (requires them to be created first)
-    # all_db_assets_orm = crud.get_assets(db, limit=1000) # Fetch all assets
-    # all_db_assets_pydantic = [models.Asset.from_orm(asset) for asset in all_db_assets_orm]
-    # recommendations = ai_engine.get_asset_recommendations(
-    #     risk_profile=db_client.risk_profile, # Taken from the fetched client
-    #     market_trends=request_body.market_trend, # Taken from the request body
-    #     all_available_assets=all_db_assets_pydantic
-    # )
-
-    # Option 2: Using the mock pool within ai_engine for simplicity as per current ai_engine.py design
-    # This is simpler for now as we haven't necessarily populated the DB with many assets.
-    recommendations = ai_engine.get_asset_recommendations(
-        risk_profile=db_client.risk_profile, # Taken from the fetched client
-        market_trends=request_body.market_trend # Taken from the request body
-        # all_available_assets parameter is omitted to allow ai_engine to use its MOCK_ASSETS_POOL
-    )
+    # The asset universe is the asset table, streamed in chunks and scored into a bounded
+    # top-k heap (the mock pool is used while the table is empty). Results are served
+    # from the per-(risk_profile, market_trend) recommendation cache, so the table is
+    # only read on a cache miss.
+    recommendations = ai_engine.recommendation_cache.get(db_client.risk_profile, request_body.market_trend)
+    if recommendations is None:
+        recommendations = await run_in_threadpool(compute_recommendations, db_client.risk_profile, request_body.market_trend)
 
     if not recommendations:
         # Return an empty list if no recommendations, or could be a 404.
@@ -229,6 +612,61 @@ def get_ai_recommendations_for_client(
 
     return recommendations
 
+@app.get("/recommendations/cache", response_model=models.RecommendationCacheStats, tags=["AI Engine"])
+def read_recommendation_cache_stats():
+    return ai_engine.recommendation_cache.stats()
+
+# Batch runs over the whole client book (see batch_recommendations.py). Starting or
+# resuming a run returns at once; the run executes in the background and reports its
+# progress at GET /recommendations/runs/{run_id}.
+@app.post("/recommendations/runs", response_model=models.RecommendationRun, status_code=202, tags=["AI Engine"])
+def start_recommendation_run(
+    run: models.RecommendationRunCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db_session)
+):
+    db_run = batch_recommendations.create_run(db, run.market_trends)
+    background_tasks.add_task(batch_recommendations.execute_run_in_background, db_run.id)
+    return db_run
+
+@app.post("/recommendations/runs/{run_id}/resume", response_model=models.RecommendationRun, status_code=202, tags=["AI Engine"])
+def resume_recommendation_run(run_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db_session)):
+    db_run = batch_recommendations.get_run(db, run_id)
+    if db_run is None:
+        raise HTTPException(status_code=404, detail="Recommendation run not found")
+    if db_run.status == models.RecommendationRunStatus.completed.value or batch_recommendations.is_active(run_id):
+        raise HTTPException(status_code=409, detail=f"Recommendation run is {db_run.status}")
+    background_tasks.add_task(batch_recommendations.execute_run_in_background, run_id)
+    return db_run
+
+@app.get("/recommendations/runs/{run_id}", response_model=models.RecommendationRun, tags=["AI Engine"])
+def read_recommendation_run(run_id: int, db: Session = Depends(get_db_session)):
+    db_run = batch_recommendations.get_run(db, run_id)
+    if db_run is None:
+        raise HTTPException(status_code=404, detail="Recommendation run not found")
+    return db_run
+
+@app.get("/recommendations/runs/{run_id}/clients/{client_id}", response_model=models.ClientBatchRecommendations, tags=["AI Engine"])
+def read_client_batch_recommendations(run_id: int, client_id: int, db: Session = Depends(get_db_session)):
+    results = batch_recommendations.get_client_results(db, run_id, client_id)
+    if results is None:
+        raise HTTPException(status_code=404, detail="No results for this client in the recommendation run")
+    return results
+
+# --- Monitoring Endpoints ---
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Monitoring"])
+def read_metrics():
+    # Per-route histograms of request duration, DB time, slowest statement and
+    # query count, in the Prometheus text exposition format
+    return PlainTextResponse(instrumentation.request_metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- Database Endpoints ---
+@app.get("/database/pool", response_model=List[models.PoolStats], tags=["Database"])
+def read_pool_stats():
+    # Connection pool usage of the sync and async engines; sustained overflow or
+    # max_checked_out at pool_size + max_overflow means DB_POOL_SIZE is too small
+    return database.get_pool_stats()
+
 # Placeholder for Uvicorn runner if main.py is executed directly
 if __name__ == "__main__":
     import uvicorn
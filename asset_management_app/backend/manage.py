@@ -0,0 +1,148 @@
+# Maintenance commands. Run from the asset_management_app directory:
+#     python -m backend.manage check-portfolio-values [--fix]
+#     python -m backend.manage seed --clients 100000 --assets 50000 --holdings 5000000
+#     python -m backend.manage migrate
+#     python -m backend.manage explain-queries [--min-rows 1000] [--all]
+#     python -m backend.manage recommend-batch [--market-trend bullish ...] [--resume RUN_ID] [--workers 4]
+import argparse
+import json
+import sys
+
+from . import batch_recommendations, crud, database, models, query_plans, seeding
+
+
+def check_portfolio_values(args) -> int:
+    db = database.SessionLocal()
+    try:
+        drift = crud.check_portfolio_values(db, tolerance=args.tolerance, fix=args.fix)
+    finally:
+        db.close()
+    print(json.dumps({"drifted_portfolios": len(drift), "fixed": args.fix and bool(drift), "drift": drift}, indent=2))
+    return 1 if drift and not args.fix else 0
+
+
+def seed(args) -> int:
+    def progress(table, rows):
+        print(f"{table}: {rows} rows", file=sys.stderr)
+
+    try:
+        result = seeding.seed_database(
+            database.engine, clients=args.clients, assets=args.assets, holdings=args.holdings,
+            seed=args.seed, batch_size=args.batch_size, progress=progress
+        )
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+def migrate(args) -> int:
+    # The upgrade itself runs in main() before every command; this reports what it changed
+    print(json.dumps({
+        "added_columns": [f"{table}.{column}" for table, column in args.schema_changes["columns"]],
+        "created_indexes": args.schema_changes["indexes"]
+    }, indent=2))
+    return 0
+
+
+def explain_queries(args) -> int:
+    try:
+        results = query_plans.explain_crud_queries(database.engine, min_rows=args.min_rows)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    flagged = [r for r in results if r["flagged_scans"]]
+    print(json.dumps({
+        "statements": len(results),
+        "full_scans": sum(1 for r in results if r["full_scans"]),
+        "flagged": len(flagged),
+        "temp_btree_sorts": sum(1 for r in results if r["temp_btree"]),
+        "results": results if args.all else flagged
+    }, indent=2))
+    return 1 if flagged else 0
+
+
+def recommend_batch(args) -> int:
+    def progress(db_run):
+        print(f"run {db_run.id} {db_run.status}: {db_run.processed_clients}/{db_run.total_clients} clients", file=sys.stderr)
+
+    if args.resume is None:
+        db = database.SessionLocal()
+        try:
+            run_id = batch_recommendations.create_run(db, args.market_trend or [models.MarketTrend.neutral]).id
+        finally:
+            db.close()
+    else:
+        run_id = args.resume
+    try:
+        result = batch_recommendations.execute_run(run_id, workers=args.workers, progress=progress)
+    except LookupError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print(f"Interrupted; continue with --resume {run_id}", file=sys.stderr)
+        return 130
+    except Exception as e:
+        print(f"Run {run_id} failed: {e}; continue with --resume {run_id}", file=sys.stderr)
+        return 1
+    print(result.model_dump_json(indent=2))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.manage", description="Asset management maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check = subparsers.add_parser(
+        "check-portfolio-values",
+        help="Recompute every portfolio's total_value from scratch and report drift from the materialized value"
+    )
+    check.add_argument("--tolerance", type=float, default=1e-6, help="Relative tolerance (absolute below 1.0)")
+    check.add_argument("--fix", action="store_true", help="Overwrite drifted values with the recomputed ones")
+    check.set_defaults(func=check_portfolio_values)
+
+    seed_parser = subparsers.add_parser(
+        "seed",
+        help="Fill an empty database with synthetic clients, assets, portfolios and holdings (set DATABASE_URL to choose it)"
+    )
+    seed_parser.add_argument("--clients", type=int, default=1000, help="Clients, each with one portfolio")
+    seed_parser.add_argument("--assets", type=int, default=500)
+    seed_parser.add_argument("--holdings", type=int, default=20000, help="Total holdings, spread evenly over the portfolios")
+    seed_parser.add_argument("--seed", type=int, default=42, help="Random seed; the same seed gives the same data")
+    seed_parser.add_argument("--batch-size", type=int, default=seeding.SEED_BATCH_SIZE, help="Rows per executemany")
+    seed_parser.set_defaults(func=seed)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate",
+        help="Bring an existing database up to date (new columns and indexes) and report the changes"
+    )
+    migrate_parser.set_defaults(func=migrate)
+
+    explain = subparsers.add_parser(
+        "explain-queries",
+        help="Run EXPLAIN QUERY PLAN on the statements issued by crud.py (writes are rolled back) and flag full table scans"
+    )
+    explain.add_argument("--min-rows", type=int, default=1000, help="Only flag scans of tables with at least this many rows")
+    explain.add_argument("--all", action="store_true", help="List every statement and its plan, not only flagged ones")
+    explain.set_defaults(func=explain_queries)
+
+    batch = subparsers.add_parser(
+        "recommend-batch",
+        help="Compute recommendations for every client, scoring each (risk_profile, market_trend) group once"
+    )
+    batch.add_argument(
+        "--market-trend", type=models.MarketTrend, action="append", choices=list(models.MarketTrend),
+        help="Market trend to score (repeatable; default neutral)"
+    )
+    batch.add_argument("--resume", type=int, metavar="RUN_ID", help="Continue an interrupted or failed run from its last checkpoint")
+    batch.add_argument("--workers", type=int, default=batch_recommendations.BATCH_WORKERS, help="Processes scoring the asset universe")
+    batch.set_defaults(func=recommend_batch)
+
+    args = parser.parse_args(argv)
+    args.schema_changes = database.create_db_and_tables()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, model_validator
+from typing import Dict, List, Optional
+from datetime import date, datetime
 from enum import Enum
 
 class RiskProfile(str, Enum):
@@ -24,8 +25,34 @@ class AssetCreate(AssetBase):
 class Asset(AssetBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True) # Allows model_validate(orm_object)
+
+class AssetSearchResult(BaseModel):
+    id: int
+    name: str
+    ticker_symbol: str
+    asset_type: Optional[str] = None
+    score: float # RapidFuzz similarity to the query, 0-100
+
+class BulkAssetRowResult(BaseModel):
+    row: int # 1-based position of the record in the upload
+    ticker_symbol: Optional[str] = None
+    status: str # "created", "duplicate" or "invalid"
+    id: Optional[int] = None # Set for created assets
+    detail: Optional[str] = None
+
+class BulkAssetResult(BaseModel):
+    created: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    results: List[BulkAssetRowResult] = []
+
+class PriceUpdateResult(BaseModel):
+    received: int = 0 # Ticks in the feed
+    updated: int = 0 # Distinct assets whose price was written
+    unknown_tickers: int = 0
+    invalid: int = 0
+    affected_portfolios: int = 0 # Portfolios holding at least one updated asset
 
 class PortfolioAsset(BaseModel): # Asset within a portfolio, including quantity
     asset_id: int
@@ -38,13 +65,17 @@ class PortfolioBase(BaseModel):
 class PortfolioCreate(PortfolioBase):
     pass
 
+class PortfolioPatch(BaseModel): # Partial holding changes
+    name: Optional[str] = None
+    upsert: List[PortfolioAsset] = [] # Added, or quantity replaced if already held
+    remove: List[int] = [] # Asset ids to remove
+
 class Portfolio(PortfolioBase):
     id: int
     client_id: int
     total_value: Optional[float] = 0.0 # Will be calculated
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ClientBase(BaseModel):
     first_name: str
@@ -59,8 +90,161 @@ class Client(ClientBase):
     id: int
     portfolios: List[Portfolio] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+# For bulk portfolio valuations (advisor dashboards)
+class ValuationRequest(BaseModel):
+    client_ids: List[int] = []
+    portfolio_ids: List[int] = []
+    include_holdings: bool = True # False returns only the (materialized) totals
+
+class HoldingValuation(BaseModel):
+    asset_id: int
+    ticker_symbol: str
+    quantity: float
+    current_price: float
+    value: float
+
+class PortfolioValuation(BaseModel):
+    portfolio_id: int
+    client_id: int
+    name: str
+    total_value: float = 0.0
+    holdings: List[HoldingValuation] = []
+
+# Daily portfolio values from the price history (price_history.py)
+class PortfolioHistoryPoint(BaseModel):
+    date: date
+    value: float # Sum of quantity * closing price over the priced holdings
+    priced_holdings: int # Holdings with a recorded price on or before this date
+
+class PortfolioHistory(BaseModel):
+    portfolio_id: int
+    client_id: int
+    start: date
+    end: date
+    holdings: int
+    points: List[PortfolioHistoryPoint] = []
+
+class AssetPriceHistory(BaseModel): # Columnar: timestamps[i] is the time of prices[i]
+    asset_id: int
+    timestamps: List[int] # Unix seconds
+    prices: List[float]
+
+# Live valuations (WS /ws/valuations): messages sent by the client
+class SubscriptionAction(str, Enum):
+    subscribe = "subscribe"
+    unsubscribe = "unsubscribe"
+
+class ValuationSubscription(BaseModel):
+    action: SubscriptionAction
+    portfolio_ids: List[int] = Field(min_length=1)
+
+# Rebalancing (see rebalancing.py): target weights -> proposed trades -> applied in one transaction
+class RebalanceRequest(BaseModel):
+    # Which portfolios: the given ids, or every portfolio of clients with risk_profile
+    # (by portfolio id, after after_portfolio_id, at most limit of them)
+    portfolio_ids: List[int] = []
+    risk_profile: Optional[RiskProfile] = None
+    after_portfolio_id: int = 0
+    limit: Optional[int] = Field(None, ge=1)
+    # The targets, exactly one of: weights by asset id, weights by asset type (both are
+    # normalized to sum to 1), or the recommendations for each client's risk profile in
+    # this market trend, weighted by suitability score
+    asset_weights: Dict[int, float] = {}
+    asset_type_weights: Dict[str, float] = {}
+    recommendation_trend: Optional[MarketTrend] = None
+    min_trade_value: float = Field(0.0, ge=0) # Smaller trades are left out
+
+    @model_validator(mode="after")
+    def check_selection_and_targets(self):
+        if bool(self.portfolio_ids) == (self.risk_profile is not None):
+            raise ValueError("Give either portfolio_ids or risk_profile")
+        if sum(bool(t) for t in (self.asset_weights, self.asset_type_weights, self.recommendation_trend)) != 1:
+            raise ValueError("Give exactly one of asset_weights, asset_type_weights and recommendation_trend")
+        weights = list(self.asset_weights.values()) + list(self.asset_type_weights.values())
+        if any(w < 0 for w in weights) or (weights and sum(weights) <= 0):
+            raise ValueError("Weights must be non-negative with a positive sum")
+        return self
+
+class RebalanceTrade(BaseModel):
+    asset_id: int
+    ticker_symbol: str
+    current_quantity: float
+    target_quantity: float
+    quantity_change: float # Positive to buy, negative to sell
+    price: float
+    trade_value: float # quantity_change * price
+
+class PortfolioRebalance(BaseModel):
+    portfolio_id: int
+    client_id: int
+    total_value: float
+    unfilled_weight: float = 0.0 # Target weight the portfolio could not be given (see rebalancing.py)
+    trades: List[RebalanceTrade] = []
+
+class RebalanceProposal(BaseModel):
+    portfolios: List[PortfolioRebalance] = [] # Those with at least one trade
+    portfolios_considered: int
+    trades: int
+    buy_value: float
+    sell_value: float
+    next_after_portfolio_id: Optional[int] = None # For a risk_profile cohort cut off by limit
+
+class RebalanceApplyTrade(BaseModel):
+    asset_id: int
+    current_quantity: float = Field(ge=0) # As proposed; the trade is refused if the holding changed since
+    target_quantity: float = Field(ge=0) # 0 removes the holding
+
+class RebalanceApplyPortfolio(BaseModel):
+    portfolio_id: int
+    trades: List[RebalanceApplyTrade] = Field(min_length=1)
+
+class RebalanceApplyRequest(BaseModel):
+    portfolios: List[RebalanceApplyPortfolio] = Field(min_length=1)
+
+class RebalanceApplyResult(BaseModel):
+    portfolios: int
+    trades: int
+    buy_value: float
+    sell_value: float
+
+# Book-wide exposure analytics (see exposure.py)
+class ExposureGroupBy(str, Enum):
+    asset_type = "asset_type"
+    ticker = "ticker"
+    risk_profile = "risk_profile" # The client's
+
+class ExposureGroup(BaseModel):
+    key: str
+    market_value: float
+    share: float # Of the total market value of the matching holdings
+    holdings: int
+    portfolios: int # Holding at least one of the group's assets
+    quantity: Optional[float] = None # For tickers only
+
+class ExposureSnapshotStatus(BaseModel):
+    built: bool
+    built_at: Optional[datetime] = None
+    build_seconds: Optional[float] = None
+    as_of: Optional[datetime] = None # Last time the snapshot was known to match the database
+    age_seconds: Optional[float] = None # Since as_of
+    stale: bool # age_seconds above EXPOSURE_MAX_AGE_SECONDS, or not built yet
+    refreshing: bool
+    refresh_seconds: int # 0: no scheduled refresh
+    last_error: Optional[str] = None # Of the last scheduled refresh, if it failed
+    holdings: int = 0
+    portfolios: int = 0
+    assets: int = 0
+
+class ExposureReport(BaseModel):
+    group_by: ExposureGroupBy
+    asset_type: Optional[str] = None
+    risk_profile: Optional[RiskProfile] = None
+    total_market_value: float
+    holdings: int
+    groups: List[ExposureGroup] = [] # By market value, largest first
+    snapshot: ExposureSnapshotStatus
 
 # For AI Recommendations
 class RecommendationRequest(BaseModel):
@@ -70,3 +254,52 @@ class RecommendationRequest(BaseModel):
 class RecommendedAsset(AssetBase): # Similar to Asset, but for recommendation output
     suitability_score: Optional[float] = Field(None, ge=0, le=1) # 0 to 1
     rationale: Optional[str] = None
+
+class RecommendationRunStatus(str, Enum):
+    pending = "pending"
+    scoring = "scoring" # Scoring the asset universe per (risk_profile, market_trend) group
+    writing = "writing" # Recording each client's results
+    completed = "completed"
+    failed = "failed"
+    interrupted = "interrupted"
+
+class RecommendationRunCreate(BaseModel):
+    market_trends: List[MarketTrend] = Field(default_factory=lambda: [MarketTrend.neutral], min_length=1)
+
+class RecommendationRun(BaseModel):
+    id: int
+    market_trends: List[MarketTrend]
+    status: RecommendationRunStatus
+    total_clients: int
+    processed_clients: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class ClientBatchRecommendations(BaseModel):
+    run_id: int
+    client_id: int
+    risk_profile: RiskProfile
+    recommendations: Dict[MarketTrend, List[RecommendedAsset]] # Per market trend of the run
+
+class RecommendationCacheStats(BaseModel):
+    hits: int
+    misses: int
+    invalidations: int
+    entries: int
+
+
+class PoolStats(BaseModel):
+    engine: str # "sync" or "async"
+    url: str
+    pool_class: str
+    pool_size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    checked_in: Optional[int] = None
+    checked_out: Optional[int] = None
+    overflow: Optional[int] = None
+    connections_opened: int
+    checkouts: int
+    max_checked_out: int
@@ -0,0 +1,24 @@
+import base64
+import json
+
+# Opaque cursors for keyset pagination (see crud.get_assets_page / crud.get_clients_page).
+# A cursor wraps the id of the last row returned; the next page seeks past it on the
+# primary key index instead of scanning and discarding skipped rows like OFFSET does.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after_id": last_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    # Raises ValueError for cursors that were not produced by encode_cursor
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after_id = json.loads(base64.urlsafe_b64decode(padded.encode()))["after_id"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(after_id, int):
+        raise ValueError("Invalid cursor")
+    return after_id
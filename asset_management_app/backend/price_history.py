@@ -0,0 +1,178 @@
+import os
+import threading
+from datetime import date
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Price history: every asset's (timestamp, price) ticks as contiguous int64 / float64
+# arrays in two memory-mapped files, times.i64 and prices.f64, plus index.i64 mapping
+# asset id -> (offset, length, capacity) of the asset's region in them. Asset ids are
+# dense, so the index is an array indexed by asset id; its row 0 holds the number of
+# slots allocated so far.
+# Each asset owns a region of capacity slots; a tick is appended by writing the next
+# slot, vectorized over a whole price feed batch. A full region is copied to the end of
+# the files with twice the capacity (amortized O(1) per tick) and its old slots are left
+# unused, so the files hold two to four slots per recorded tick. Reads are slices of the mapped arrays: views of the page cache, not copies.
+# Timestamps are Unix seconds, non-decreasing per asset, so a time range is found by
+# binary search.
+# The files are written by one process (the API server: the price feed, and the first
+# tick of each asset from crud.record_initial_prices); run a single worker, or give each
+# its own PRICE_HISTORY_DIR.
+
+PRICE_HISTORY_DIR = os.getenv("PRICE_HISTORY_DIR", "./price_history")
+INITIAL_REGION_CAPACITY = 64 # Ticks per asset before its region first moves
+INITIAL_SLOTS = 1 << 16 # Size of new data files, in ticks; they double as needed
+INDEX_COLUMNS = 3 # offset, length, capacity
+
+
+class PriceHistoryStore:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock() # Appends, and reads of the index / current mappings
+        self.times = self.map_file("times.i64", np.int64, INITIAL_SLOTS)
+        self.prices = self.map_file("prices.f64", np.float64, INITIAL_SLOTS)
+        self.index = self.map_file("index.i64", np.int64, 1024 * INDEX_COLUMNS).reshape(-1, INDEX_COLUMNS)
+
+    def map_file(self, name: str, dtype, min_items: int) -> np.memmap:
+        # Maps the file, first extending it (sparse, zero-filled) to at least min_items
+        path = os.path.join(self.directory, name)
+        size = min_items * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+")
+
+    def flush(self):
+        with self.lock:
+            for mapping in (self.times, self.prices, self.index):
+                mapping.flush()
+
+    # Writes (with self.lock held)
+
+    def ensure_index(self, max_asset_id: int):
+        if max_asset_id >= len(self.index):
+            self.index.flush()
+            rows = max(max_asset_id + 1, 2 * len(self.index))
+            self.index = self.map_file("index.i64", np.int64, rows * INDEX_COLUMNS).reshape(-1, INDEX_COLUMNS)
+
+    def allocate(self, slots: int) -> int:
+        end = int(self.index[0, 0])
+        if end + slots > len(self.times):
+            # Readers holding views of the old mappings keep them; new reads use the new ones
+            items = max(end + slots, 2 * len(self.times))
+            for name, attribute, dtype in (("times.i64", "times", np.int64), ("prices.f64", "prices", np.float64)):
+                getattr(self, attribute).flush()
+                setattr(self, attribute, self.map_file(name, dtype, items))
+        self.index[0, 0] = end + slots
+        return end
+
+    def move_region(self, asset_id: int):
+        offset, length, capacity = (int(v) for v in self.index[asset_id])
+        new_capacity = max(INITIAL_REGION_CAPACITY, 2 * capacity)
+        new_offset = self.allocate(new_capacity)
+        self.times[new_offset:new_offset + length] = self.times[offset:offset + length]
+        self.prices[new_offset:new_offset + length] = self.prices[offset:offset + length]
+        self.index[asset_id] = (new_offset, length, new_capacity)
+
+    def append(self, asset_ids, prices, timestamp: int):
+        # Appends one tick per asset, all at timestamp (clamped to each asset's last tick,
+        # keeping every series sorted). If an asset id repeats, its last price is kept.
+        asset_ids = np.asarray(asset_ids, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        if not len(asset_ids):
+            return
+        if np.any(asset_ids < 1):
+            raise ValueError("asset ids start at 1")
+        unique_ids, last = np.unique(asset_ids[::-1], return_index=True)
+        prices = prices[::-1][last]
+        with self.lock:
+            self.ensure_index(int(unique_ids[-1]))
+            full = unique_ids[self.index[unique_ids, 1] >= self.index[unique_ids, 2]]
+            for asset_id in full.tolist():
+                self.move_region(asset_id)
+            offsets, lengths = self.index[unique_ids, 0], self.index[unique_ids, 1]
+            positions = offsets + lengths
+            last_times = np.where(lengths > 0, self.times[np.maximum(positions - 1, 0)], timestamp)
+            self.times[positions] = np.maximum(last_times, timestamp)
+            self.prices[positions] = prices
+            # The data is in place before the lengths that expose it change
+            self.index[unique_ids, 1] = lengths + 1
+
+    # Reads
+
+    def series(self, asset_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        # (timestamps, prices) views of the asset's whole series; empty if it has none
+        with self.lock:
+            times, prices = self.times, self.prices
+            if asset_id < 1 or asset_id >= len(self.index):
+                return times[:0], prices[:0]
+            offset, length, _ = (int(v) for v in self.index[asset_id])
+        return times[offset:offset + length], prices[offset:offset + length]
+
+    def recorded(self, asset_ids) -> np.ndarray:
+        # Whether each asset has at least one tick
+        asset_ids = np.asarray(asset_ids, dtype=np.int64)
+        with self.lock:
+            known = (asset_ids >= 1) & (asset_ids < len(self.index))
+            lengths = np.zeros(len(asset_ids), dtype=np.int64)
+            lengths[known] = self.index[asset_ids[known], 1]
+        return lengths > 0
+
+    def range(self, asset_id: int, start: Optional[int] = None, end: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # Views of the ticks with start <= timestamp <= end
+        times, prices = self.series(asset_id)
+        lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        hi = len(times) if end is None else int(np.searchsorted(times, end, side="right"))
+        return times[lo:hi], prices[lo:hi]
+
+    def prices_at(self, asset_ids, timestamps) -> np.ndarray:
+        # (len(timestamps), len(asset_ids)) matrix of each asset's last price at or before
+        # each timestamp; NaN where the asset has no tick that early
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        matrix = np.full((len(timestamps), len(asset_ids)), np.nan)
+        for column, asset_id in enumerate(asset_ids):
+            times, prices = self.series(int(asset_id))
+            if not len(times):
+                continue
+            positions = np.searchsorted(times, timestamps, side="right") - 1
+            known = positions >= 0
+            matrix[known, column] = prices[positions[known]]
+        return matrix
+
+
+def day_end_timestamps(start: date, end: date) -> Tuple[np.ndarray, np.ndarray]:
+    # The days from start to end inclusive, and the last second (UTC) of each
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+    return days, (days + 1).astype("datetime64[s]").astype(np.int64) - 1
+
+
+def portfolio_value_history(history: PriceHistoryStore, holdings, start: date, end: date) -> dict:
+    # Daily values of the given (asset_id, quantity) holdings at each day's closing
+    # (last recorded) prices: one matrix-vector product, i.e. one dot product of the
+    # price vector with the quantity vector per date. Holdings without a price yet on a
+    # date add nothing to it; priced_holdings counts the ones that do.
+    days, day_ends = day_end_timestamps(start, end)
+    asset_ids = np.array([asset_id for asset_id, _ in holdings], dtype=np.int64)
+    quantities = np.array([quantity for _, quantity in holdings], dtype=np.float64)
+    prices = history.prices_at(asset_ids, day_ends)
+    priced = ~np.isnan(prices)
+    return {
+        "dates": days,
+        "values": np.where(priced, prices, 0.0) @ quantities,
+        "priced_holdings": priced.sum(axis=1)
+    }
+
+
+store: Optional[PriceHistoryStore] = None
+store_lock = threading.Lock()
+
+
+def get_store() -> PriceHistoryStore:
+    # Opened on first use, so processes that never touch the history do not map it
+    global store
+    with store_lock:
+        if store is None:
+            store = PriceHistoryStore(PRICE_HISTORY_DIR)
+        return store
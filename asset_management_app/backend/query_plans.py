@@ -0,0 +1,215 @@
+import re
+from typing import Optional
+
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import crud, database, models
+
+# Query plan review for the statements crud.py issues (see manage.py explain-queries).
+# Each scenario below calls crud functions against the real database, inside one
+# transaction that is rolled back at the end, so writes are exercised but nothing is
+# kept. Every statement they execute is captured and run through SQLite's
+# EXPLAIN QUERY PLAN; a full scan of a table holding at least min_rows rows is flagged,
+# unless the scenario lists that table as an intended scan (full exports, OFFSET paging,
+# the consistency check, the exposure snapshot).
+
+SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+TEMP_BTREE = "USE TEMP B-TREE"
+CONTROL_STATEMENTS = ("SAVEPOINT", "RELEASE", "ROLLBACK", "BEGIN", "COMMIT")
+
+
+def first(iterable):
+    # The first item of a generator, closing it (and its cursor) afterwards
+    iterator = iter(iterable)
+    try:
+        return next(iterator, None)
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+
+def create_and_delete_client(db: Session, sample: dict):
+    db_client = crud.create_client(db, models.ClientCreate(
+        first_name="Plan", last_name="Review", email="query.plan.review@example.com"
+    ))
+    crud.delete_client(db, db_client.id)
+
+
+def bulk_load_assets(db: Session, sample: dict):
+    records = [({"name": "Plan Review", "ticker_symbol": "QPRVW", "asset_type": "Stock", "current_price": 1.0}, None)]
+    crud.finish_asset_bulk_load(db, crud.insert_asset_batch(db, records, 1, set()))
+
+
+def update_prices(db: Session, sample: dict):
+    # The SQL of a feed only: finish_price_update / publish_price_update also update the
+    # recommendation cache and append to the price history files, which no rollback undoes
+    state = crud.start_price_update()
+    crud.apply_price_batch(db, [({"ticker_symbol": sample["ticker_symbol"], "current_price": sample["current_price"] + 1}, None)], state)
+
+
+def replace_portfolio(db: Session, sample: dict):
+    _, db_portfolio = crud.get_client_portfolio(db, sample["client_id"])
+    crud.update_portfolio_assets(db, db_portfolio, models.PortfolioCreate(
+        name="Plan Review", assets=[models.PortfolioAsset(asset_id=sample["asset_id"], quantity=2.0)]
+    ))
+
+
+def patch_portfolio(db: Session, sample: dict):
+    _, db_portfolio = crud.get_client_portfolio(db, sample["client_id"])
+    crud.patch_portfolio_assets(db, db_portfolio, models.PortfolioPatch(
+        upsert=[models.PortfolioAsset(asset_id=sample["asset_id"], quantity=3.0)], remove=[sample["asset_id"] + 1]
+    ))
+
+
+def apply_rebalance(db: Session, sample: dict):
+    # The holding as the scenarios before left it: with a stale current_quantity the
+    # trade is refused as a conflict before anything is written
+    holding = crud.get_rebalance_holdings(db, [sample["portfolio_id"]])[0]
+    conflicts, _ = crud.apply_rebalance_trades(db, [(holding.portfolio_id, holding.asset_id, holding.quantity, holding.quantity + 1)])
+    if conflicts:
+        raise RuntimeError("apply_rebalance_trades scenario conflicted; its writes were not exercised")
+
+
+# (name, call(db, sample), tables it is meant to scan in full)
+SCENARIOS = [
+    ("get_table_version", lambda db, s: crud.get_table_version(db, "assets"), ()),
+    ("client_versions_stmt", lambda db, s: db.execute(crud.client_versions_stmt(s["client_id"])).all(), ()),
+    ("get_client", lambda db, s: crud.get_client(db, s["client_id"]), ()),
+    ("get_client_by_email", lambda db, s: crud.get_client_by_email(db, s["email"]), ()),
+    ("get_clients (OFFSET)", lambda db, s: crud.get_clients(db, skip=100), ("clients",)),
+    ("get_clients_page", lambda db, s: crud.get_clients_page(db, after_id=s["client_id"]), ()),
+    ("get_client_rows_page (name_prefix)", lambda db, s: crud.get_client_rows_page(db, name_prefix=s["last_name"][:3]), ()),
+    ("get_portfolio_rows_for_clients", lambda db, s: crud.get_portfolio_rows_for_clients(db, [s["client_id"]]), ()),
+    ("iter_client_chunks (export)", lambda db, s: first(crud.iter_client_chunks(db)), ("clients",)),
+    ("get_asset", lambda db, s: crud.get_asset(db, s["asset_id"]), ()),
+    ("get_asset_by_ticker", lambda db, s: crud.get_asset_by_ticker(db, s["ticker_symbol"]), ()),
+    ("get_assets (OFFSET)", lambda db, s: crud.get_assets(db, skip=100), ("assets",)),
+    ("get_asset_rows_page (asset_type)", lambda db, s: crud.get_asset_rows_page(db, after_id=s["asset_id"], asset_type=s["asset_type"]), ()),
+    ("get_asset_rows_page (name_prefix)", lambda db, s: crud.get_asset_rows_page(db, name_prefix=s["asset_name"][:3]), ()),
+    ("iter_asset_chunks (asset universe)", lambda db, s: first(crud.iter_asset_chunks(db)), ("assets",)),
+    ("get_portfolio", lambda db, s: crud.get_portfolio(db, s["portfolio_id"]), ()),
+    ("get_portfolios_by_client", lambda db, s: crud.get_portfolios_by_client(db, s["client_id"]), ()),
+    ("get_client_portfolio", lambda db, s: crud.get_client_portfolio(db, s["client_id"]), ()),
+    ("get_portfolio_holdings", lambda db, s: crud.get_portfolio_holdings(db, s["portfolio_id"]), ()),
+    ("get_portfolio_total_value", lambda db, s: crud.get_portfolio_total_value(db, s["portfolio_id"]), ()),
+    ("get_portfolio_details", lambda db, s: crud.get_portfolio_details(db, s["portfolio_id"]), ()),
+    ("get_portfolio_valuations", lambda db, s: crud.get_portfolio_valuations(db, client_ids=[s["client_id"]]), ()),
+    ("check_portfolio_values", lambda db, s: crud.check_portfolio_values(db), ("portfolio_asset_association", "portfolios")),
+    ("create_client + delete_client", create_and_delete_client, ()),
+    ("update_client", lambda db, s: crud.update_client(db, s["client_id"], models.ClientCreate(
+        first_name="Plan", last_name="Review", email=s["email"]
+    )), ()),
+    ("create_asset", lambda db, s: crud.create_asset(db, models.AssetCreate(
+        name="Plan Review", ticker_symbol="QPRVW", asset_type="Stock", current_price=1.0
+    )), ()),
+    ("insert_asset_batch + finish_asset_bulk_load", bulk_load_assets, ()),
+    ("apply_price_batch", update_prices, ()),
+    ("create_client_portfolio", lambda db, s: crud.create_client_portfolio(db, models.PortfolioCreate(
+        name="Plan Review", assets=[models.PortfolioAsset(asset_id=s["asset_id"], quantity=1.0)]
+    ), s["client_id"]), ()),
+    ("update_portfolio_assets", replace_portfolio, ()),
+    ("patch_portfolio_assets", patch_portfolio, ()),
+    ("get_rebalance_portfolios (portfolio_ids)", lambda db, s: crud.get_rebalance_portfolios(db, portfolio_ids=[s["portfolio_id"]]), ()),
+    ("get_rebalance_portfolios (risk_profile cohort)", lambda db, s: crud.get_rebalance_portfolios(
+        db, risk_profile=s["risk_profile"], after_portfolio_id=s["portfolio_id"], limit=100
+    ), ()),
+    ("get_rebalance_holdings", lambda db, s: crud.get_rebalance_holdings(db, [s["portfolio_id"]]), ()),
+    ("get_rebalance_assets", lambda db, s: crud.get_rebalance_assets(db, [s["asset_id"]]), ()),
+    ("get_asset_ids_by_ticker", lambda db, s: crud.get_asset_ids_by_ticker(db, [s["ticker_symbol"]]), ()),
+    ("apply_rebalance_trades", apply_rebalance, ()),
+    ("get_portfolio_quantities", lambda db, s: crud.get_portfolio_quantities(db, s["portfolio_id"]), ()),
+    ("get_portfolio_total_values", lambda db, s: crud.get_portfolio_total_values(db, [s["portfolio_id"]]), ()),
+    # The exposure snapshot reads whole tables by design (see exposure.py)
+    ("get_exposure_source_version", lambda db, s: crud.get_exposure_source_version(db), ("portfolios", "clients")),
+    ("get_exposure_assets", lambda db, s: crud.get_exposure_assets(db), ("assets",)),
+    ("get_exposure_portfolios", lambda db, s: crud.get_exposure_portfolios(db), ("portfolios",)),
+    ("iter_exposure_holdings", lambda db, s: first(crud.iter_exposure_holdings(db)), ("portfolio_asset_association",)),
+]
+
+
+def load_sample(conn) -> Optional[dict]:
+    # Ids and values of one client with a portfolio holding an asset, for the scenarios
+    holdings = database.PortfolioAssetAssociation
+    row = conn.execute(
+        select(holdings.portfolio_id, holdings.asset_id, database.DbPortfolio.client_id)
+        .join(database.DbPortfolio, database.DbPortfolio.id == holdings.portfolio_id).limit(1)
+    ).first()
+    if row is None:
+        return None
+    portfolio_id, asset_id, client_id = row
+    email, last_name, risk_profile = conn.execute(
+        select(database.DbClient.email, database.DbClient.last_name, database.DbClient.risk_profile).where(database.DbClient.id == client_id)
+    ).one()
+    ticker_symbol, asset_type, asset_name, current_price = conn.execute(
+        select(database.DbAsset.ticker_symbol, database.DbAsset.asset_type, database.DbAsset.name, database.DbAsset.current_price)
+        .where(database.DbAsset.id == asset_id)
+    ).one()
+    return {
+        "client_id": client_id, "email": email, "last_name": last_name, "risk_profile": risk_profile,
+        "portfolio_id": portfolio_id, "asset_id": asset_id, "ticker_symbol": ticker_symbol,
+        "asset_type": asset_type, "asset_name": asset_name, "current_price": current_price or 1.0
+    }
+
+
+def explain_crud_queries(engine: Engine, min_rows: int = 1000):
+    # Returns one entry per captured statement: its scenario, SQL, plan lines, the tables
+    # it scans in full, which of those are flagged, and whether it sorts in a temp b-tree.
+    # Raises ValueError for non-SQLite databases or a database without holdings.
+    if not database.is_sqlite(str(engine.url)):
+        raise ValueError("explain-queries uses SQLite's EXPLAIN QUERY PLAN; point DATABASE_URL at a SQLite database")
+    with engine.connect() as conn:
+        conn.begin()
+        # pysqlite only opens its transaction at the first write, so a SAVEPOINT issued
+        # before that would start (and its RELEASE commit) a transaction of its own
+        conn.exec_driver_sql("BEGIN")
+        try:
+            return explain_scenarios(conn, min_rows)
+        finally:
+            conn.rollback()
+
+
+def explain_scenarios(conn, min_rows: int):
+    row_counts = {
+        table.name: conn.execute(select(func.count()).select_from(table)).scalar()
+        for table in database.Base.metadata.sorted_tables
+    }
+    sample = load_sample(conn)
+    if sample is None:
+        raise ValueError("Needs at least one client with a portfolio holding an asset; seed the database first")
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters[0] if executemany else parameters))
+
+    db = Session(bind=conn, join_transaction_mode="create_savepoint")
+    results = []
+    try:
+        for name, call, intended_scans in SCENARIOS:
+            captured.clear()
+            event.listen(conn, "before_cursor_execute", capture)
+            try:
+                call(db, sample)
+            finally:
+                event.remove(conn, "before_cursor_execute", capture)
+            for statement, parameters in captured:
+                if statement.lstrip().upper().startswith(CONTROL_STATEMENTS):
+                    continue
+                plan = [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+                scanned = [m.group(1) for m in map(SCAN_PATTERN.match, plan) if m and m.group(1) in row_counts]
+                results.append({
+                    "scenario": name,
+                    "statement": " ".join(statement.split()),
+                    "plan": plan,
+                    "full_scans": scanned,
+                    "flagged_scans": [
+                        table for table in scanned
+                        if table not in intended_scans and row_counts[table] >= min_rows
+                    ],
+                    "temp_btree": any(line.startswith(TEMP_BTREE) for line in plan)
+                })
+    finally:
+        db.close()
+    return results
@@ -0,0 +1,249 @@
+import os
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import ai_engine, crud, models
+
+# Rebalancing (POST /rebalance/proposals, POST /rebalance/apply): turns target weights into
+# the trades that bring portfolios to them, for thousands of portfolios per call.
+# A batch of REBALANCE_BATCH_SIZE portfolios is loaded with one holdings query into flat
+# arrays (portfolio index, asset index, quantity), and the rest is array math over them:
+# values, portfolio totals (bincount), target values and quantities, and the changes.
+# Rebalancing is self-financing: a portfolio keeps its current total value, redistributed
+# over the targets.
+#   - By asset: asset a is targeted at weight[a] * total; held assets without a weight are
+#     sold. Targets without a price cannot be bought; their weight is unfilled.
+#   - By asset type: a type's weight is spread over the portfolio's holdings of that type in
+#     proportion to their current value. Types the portfolio holds none of cannot be filled.
+#   - By recommendation: the assets recommended for the client's risk profile (ai_engine),
+#     weighted by suitability score, as for asset weights.
+# Unfilled weight is reported per portfolio and the filled targets are scaled up to cover
+# it; a portfolio that can fill none of them is left as it is. Holdings without a price
+# are never traded.
+# The result is a proposal; apply writes it (or an edited subset of it) in one
+# transaction, refusing it if any traded holding changed in between.
+
+REBALANCE_BATCH_SIZE = int(os.getenv("REBALANCE_BATCH_SIZE", "2000")) # Portfolios per vectorized batch
+REBALANCE_MAX_PORTFOLIOS = int(os.getenv("REBALANCE_MAX_PORTFOLIOS", "10000")) # Per proposal
+QUANTITY_DECIMALS = 6 # Target quantities are rounded to this; smaller changes are not trades
+
+
+class RebalanceConflict(Exception):
+    def __init__(self, message: str, portfolio_ids: List[int]):
+        super().__init__(message)
+        self.portfolio_ids = portfolio_ids
+
+
+class Holdings(NamedTuple):
+    # One entry per (portfolio, asset) held
+    portfolio: np.ndarray # Index into the batch's portfolios
+    asset: np.ndarray # Index into the batch's asset arrays
+    quantity: np.ndarray
+
+
+def portfolio_totals(holdings: Holdings, portfolio_count: int, prices: np.ndarray) -> np.ndarray:
+    return np.bincount(holdings.portfolio, holdings.quantity * prices[holdings.asset], minlength=portfolio_count)
+
+
+def targets_by_asset(holdings: Holdings, portfolio_count: int, prices: np.ndarray, weights: np.ndarray):
+    # weights: normalized, per asset index. Returns (portfolio, asset, current, target,
+    # unfilled): every held or targeted (portfolio, asset) pair, ordered by portfolio then
+    # asset index, and the unfilled weight per portfolio.
+    targeted = np.flatnonzero(weights > 0)
+    buyable = prices[targeted] > 0
+    unfilled_weight = float(weights[targeted[~buyable]].sum())
+    targeted = targeted[buyable]
+    effective = np.zeros_like(weights)
+    if targeted.size:
+        effective[targeted] = weights[targeted] / (1.0 - unfilled_weight)
+
+    # Every (portfolio, targeted asset) pair is added with quantity 0, so unheld targets are bought
+    asset_count = len(prices)
+    keys = np.concatenate([
+        holdings.portfolio * asset_count + holdings.asset,
+        (np.arange(portfolio_count)[:, None] * asset_count + targeted).ravel()
+    ])
+    quantities = np.concatenate([holdings.quantity, np.zeros(portfolio_count * targeted.size)])
+    keys, inverse = np.unique(keys, return_inverse=True)
+    current = np.bincount(inverse, quantities, minlength=len(keys))
+    portfolio, asset = np.divmod(keys, asset_count)
+
+    totals = portfolio_totals(holdings, portfolio_count, prices)
+    target = np.divide(totals[portfolio] * effective[asset], prices[asset], out=current.copy(), where=prices[asset] > 0)
+    if not targeted.size:
+        target, unfilled_weight = current.copy(), 1.0
+    return portfolio, asset, current, target, np.full(portfolio_count, unfilled_weight)
+
+
+def targets_by_type(holdings: Holdings, portfolio_count: int, prices: np.ndarray, asset_types: np.ndarray, type_weights: np.ndarray):
+    # asset_types: type code per asset index; type_weights: normalized, per type code (0
+    # for types without a target). Same return shape as targets_by_asset, held pairs only.
+    type_count = len(type_weights)
+    portfolio, asset, current = holdings
+    values = current * prices[asset]
+    totals = portfolio_totals(holdings, portfolio_count, prices)
+    types = asset_types[asset]
+    type_values = np.bincount(portfolio * type_count + types, values, minlength=portfolio_count * type_count).reshape(portfolio_count, type_count)
+
+    filled = np.where(type_values > 0, type_weights, 0.0)
+    filled_weight = filled.sum(axis=1)
+    shares = np.divide(filled, filled_weight[:, None], out=np.zeros_like(filled), where=filled_weight[:, None] > 0)
+    held_type_values = type_values[portfolio, types]
+    target_values = np.divide(totals[portfolio] * shares[portfolio, types] * values, held_type_values, out=np.zeros_like(values), where=held_type_values > 0)
+    target = np.divide(target_values, prices[asset], out=current.copy(), where=prices[asset] > 0)
+    unchanged = filled_weight[portfolio] == 0
+    target[unchanged] = current[unchanged]
+    return portfolio, asset, current, target, 1.0 - filled_weight
+
+
+def trade_mask(current: np.ndarray, target: np.ndarray, prices: np.ndarray, min_trade_value: float):
+    # Rounds the targets and selects the entries that are trades worth at least min_trade_value
+    target = np.round(target, QUANTITY_DECIMALS)
+    change = target - current
+    trading = (np.abs(change) >= 10.0 ** -QUANTITY_DECIMALS) & (np.abs(change * prices) >= min_trade_value)
+    return target, trading
+
+
+def recommendation_weights(db: Session, risk_profile: models.RiskProfile, market_trend: models.MarketTrend) -> Dict[int, float]:
+    # Asset id -> suitability score of the (cached) recommendations for the risk profile
+    recommendations = ai_engine.get_cached_recommendations(
+        risk_profile=risk_profile,
+        market_trends=market_trend,
+        load_asset_chunks=lambda: crud.iter_asset_chunks(db)
+    )
+    ids = crud.get_asset_ids_by_ticker(db, [r.ticker_symbol for r in recommendations])
+    return {ids[r.ticker_symbol]: r.suitability_score or 0.0 for r in recommendations if r.ticker_symbol in ids}
+
+
+def propose_rebalance(db: Session, request: models.RebalanceRequest) -> dict:
+    # Raises LookupError for unknown portfolio ids and ValueError for unknown target assets
+    limit = min(request.limit or REBALANCE_MAX_PORTFOLIOS, REBALANCE_MAX_PORTFOLIOS)
+    if request.portfolio_ids:
+        if len(set(request.portfolio_ids)) > REBALANCE_MAX_PORTFOLIOS:
+            raise ValueError(f"At most {REBALANCE_MAX_PORTFOLIOS} portfolios per proposal")
+        portfolios = crud.get_rebalance_portfolios(db, portfolio_ids=request.portfolio_ids)
+        missing = sorted(set(request.portfolio_ids) - {p.id for p in portfolios})
+        if missing:
+            raise LookupError(f"Portfolios not found: {missing[:20]}")
+    else:
+        portfolios = crud.get_rebalance_portfolios(db, risk_profile=request.risk_profile, after_portfolio_id=request.after_portfolio_id, limit=limit + 1)
+
+    # Targets by group of portfolios: a single group except with recommendations, which
+    # differ per risk profile
+    if request.asset_weights:
+        group_weights = {None: request.asset_weights}
+    elif request.recommendation_trend is not None:
+        group_weights = {rp: recommendation_weights(db, rp, request.recommendation_trend) for rp in {p.risk_profile for p in portfolios[:limit]}}
+    else:
+        group_weights = {None: {}}
+    target_assets = crud.get_rebalance_assets(db, {asset_id for weights in group_weights.values() for asset_id in weights})
+    unknown = sorted({asset_id for weights in group_weights.values() for asset_id in weights} - set(target_assets))
+    if unknown:
+        raise ValueError(f"Unknown asset ids in asset_weights: {unknown[:20]}")
+    type_names = list(request.asset_type_weights)
+
+    proposals = []
+    summary = {"portfolios_considered": 0, "trades": 0, "buy_value": 0.0, "sell_value": 0.0}
+    for start in range(0, min(len(portfolios), limit), REBALANCE_BATCH_SIZE):
+        batch = portfolios[start:min(start + REBALANCE_BATCH_SIZE, limit)]
+        rows = crud.get_rebalance_holdings(db, [p.id for p in batch])
+        portfolio_column, asset_column, quantity_column, ticker_column, price_column, type_column = zip(*rows) if rows else ((),) * 6
+        held_asset_ids = np.array(asset_column, dtype=np.int64)
+        # Each held asset's attributes, taken from its first row
+        unique_held, first_rows = np.unique(held_asset_ids, return_index=True)
+        assets = dict(target_assets)
+        assets.update({asset_id: (ticker_column[i], price_column[i], type_column[i]) for asset_id, i in zip(unique_held.tolist(), first_rows.tolist())})
+        asset_ids = np.array(sorted(assets), dtype=np.int64)
+        asset_id_list = asset_ids.tolist()
+        tickers = [assets[a][0] for a in asset_id_list]
+        prices = np.array([assets[a][1] or 0.0 for a in asset_id_list])
+        price_list = prices.tolist()
+        batch_ids = np.array([p.id for p in batch], dtype=np.int64)
+        holdings = Holdings(
+            np.searchsorted(batch_ids, np.array(portfolio_column, dtype=np.int64)),
+            np.searchsorted(asset_ids, held_asset_ids),
+            np.array(quantity_column, dtype=np.float64)
+        )
+        totals = portfolio_totals(holdings, len(batch), prices)
+
+        results = []
+        if request.asset_type_weights:
+            type_codes = {name: i for i, name in enumerate(type_names)}
+            asset_types = np.array([type_codes.get(assets[a][2], len(type_names)) for a in asset_id_list], dtype=np.int64)
+            type_weights = np.array([request.asset_type_weights[name] for name in type_names] + [0.0])
+            results.append((np.arange(len(batch)), targets_by_type(holdings, len(batch), prices, asset_types, type_weights / type_weights.sum())))
+        else:
+            for group, weights in group_weights.items():
+                members = np.array([i for i, p in enumerate(batch) if group is None or p.risk_profile == group], dtype=np.int64)
+                if not members.size:
+                    continue
+                local = np.full(len(batch), -1, dtype=np.int64)
+                local[members] = np.arange(members.size)
+                in_group = local[holdings.portfolio] >= 0
+                weight_vector = np.zeros(len(asset_ids))
+                weight_vector[np.searchsorted(asset_ids, np.array(list(weights), dtype=np.int64))] = list(weights.values())
+                if weight_vector.sum() > 0:
+                    weight_vector /= weight_vector.sum()
+                group_holdings = Holdings(local[holdings.portfolio[in_group]], holdings.asset[in_group], holdings.quantity[in_group])
+                results.append((members, targets_by_asset(group_holdings, members.size, prices, weight_vector)))
+
+        for members, (portfolio, asset, current, target, unfilled) in results:
+            target, trading = trade_mask(current, target, prices[asset], request.min_trade_value)
+            portfolio, asset, current, target = portfolio[trading], asset[trading], current[trading], target[trading]
+            change = target - current
+            trade_values = change * prices[asset]
+            summary["trades"] += int(trading.sum())
+            summary["buy_value"] += float(trade_values[trade_values > 0].sum())
+            summary["sell_value"] += float(-trade_values[trade_values < 0].sum())
+            # Entries are ordered by portfolio, so each portfolio's trades are one slice
+            bounds = np.searchsorted(portfolio, np.arange(members.size + 1))
+            for local_index, batch_index in enumerate(members.tolist()):
+                lo, hi = bounds[local_index], bounds[local_index + 1]
+                if lo == hi:
+                    continue
+                p = batch[batch_index]
+                proposals.append({
+                    "portfolio_id": p.id,
+                    "client_id": p.client_id,
+                    "total_value": float(totals[batch_index]),
+                    "unfilled_weight": round(float(unfilled[local_index]), 6),
+                    "trades": [
+                        {
+                            "asset_id": asset_id_list[a],
+                            "ticker_symbol": tickers[a],
+                            "current_quantity": q,
+                            "target_quantity": t,
+                            "quantity_change": t - q,
+                            "price": price_list[a],
+                            "trade_value": v
+                        }
+                        for a, q, t, v in zip(asset[lo:hi].tolist(), current[lo:hi].tolist(), target[lo:hi].tolist(), trade_values[lo:hi].tolist())
+                    ]
+                })
+        summary["portfolios_considered"] += len(batch)
+
+    proposals.sort(key=lambda p: p["portfolio_id"])
+    truncated = request.risk_profile is not None and len(portfolios) > limit
+    return {
+        "portfolios": proposals,
+        **summary,
+        "next_after_portfolio_id": portfolios[limit - 1].id if truncated else None
+    }
+
+
+def apply_rebalance(db: Session, request: models.RebalanceApplyRequest) -> dict:
+    # Writes the trades in one transaction (see crud.apply_rebalance_trades). Raises
+    # RebalanceConflict, writing nothing, if a portfolio is gone or a traded holding's
+    # quantity is no longer the proposal's current_quantity.
+    trades = [
+        (p.portfolio_id, t.asset_id, t.current_quantity, round(t.target_quantity, QUANTITY_DECIMALS))
+        for p in request.portfolios for t in p.trades
+    ]
+    if len({(portfolio_id, asset_id) for portfolio_id, asset_id, _, _ in trades}) != len(trades):
+        raise ValueError("An asset is traded twice in the same portfolio")
+    conflicts, summary = crud.apply_rebalance_trades(db, trades)
+    if conflicts:
+        raise RebalanceConflict("Portfolios missing or changed since the proposal", conflicts)
+    return summary
@@ -0,0 +1,127 @@
+import random
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Engine
+
+from . import crud, database, models
+
+# Synthetic data generator for benchmarks and local testing. Fills the clients, assets,
+# portfolios and holdings tables at a configurable scale, deterministically for a given
+# seed, with batched executemany inserts. Every client gets one portfolio and the
+# holdings are spread evenly over the portfolios, each holding distinct assets.
+# Portfolio total_value is computed while generating, so no recompute pass is needed.
+# Used by `python -m backend.manage seed` and the benchmarks.
+
+SEED_BATCH_SIZE = 20000
+ASSET_TYPES = ("Stock", "Bond", "ETF", "REIT", "Commodity") # The scored types plus one that gets the default rule
+FIRST_NAMES = ("Ada", "Ben", "Chloe", "Dev", "Emma", "Farid", "Grace", "Hugo", "Ines", "Jon", "Kira", "Liam", "Maya", "Noah", "Olu", "Priya")
+LAST_NAMES = ("Adams", "Brown", "Chen", "Dlamini", "Evans", "Fischer", "Garcia", "Hughes", "Ito", "Jones", "Khan", "Lopez", "Mokoena", "Nguyen", "Okafor", "Patel")
+
+
+def ticker_for(i: int) -> str:
+    # Distinct tickers matching ^[A-Z]{1,5}$: A..Z, AA..ZZ, AAA.., i.e. bijective base 26
+    letters = ""
+    while True:
+        i, r = divmod(i, 26)
+        letters = chr(ord("A") + r) + letters
+        if i == 0:
+            return letters
+        i -= 1
+
+
+def insert_in_batches(conn, table, rows, batch_size: int = SEED_BATCH_SIZE) -> int:
+    # rows is an iterable of dicts; returns the number inserted
+    inserted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.execute(insert(table), batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        conn.execute(insert(table), batch)
+        inserted += len(batch)
+    return inserted
+
+
+def seed_database(
+    engine: Engine,
+    clients: int,
+    assets: int,
+    holdings: int,
+    seed: int = 42,
+    batch_size: int = SEED_BATCH_SIZE,
+    progress: Optional[Callable[[str, int], None]] = None
+) -> dict:
+    # Expects empty tables (ids are assigned from 1). holdings is the total number of
+    # portfolio holdings and is capped at clients * assets. Returns row counts and timings.
+    with engine.connect() as conn:
+        existing = conn.execute(select(func.count()).select_from(database.DbClient)).scalar() + \
+            conn.execute(select(func.count()).select_from(database.DbAsset)).scalar()
+    if existing:
+        raise ValueError("Database already contains clients or assets; seed an empty database")
+    holdings = min(holdings, clients * assets)
+    report = progress or (lambda table, rows: None)
+    rng = random.Random(seed)
+    timings = {}
+
+    start = time.perf_counter()
+    prices = [round(rng.uniform(1.0, 500.0), 2) for _ in range(assets)]
+    with engine.begin() as conn:
+        rows = insert_in_batches(conn, database.DbAsset, (
+            {"name": f"Asset {ticker_for(i)}", "ticker_symbol": ticker_for(i), "asset_type": ASSET_TYPES[i % len(ASSET_TYPES)], "current_price": prices[i]}
+            for i in range(assets)
+        ), batch_size)
+        crud.bump_table_version(conn, "assets") # Invalidates cached asset lists (see http_cache.py)
+    timings["assets"] = time.perf_counter() - start
+    report("assets", rows)
+
+    start = time.perf_counter()
+    risk_profiles = list(models.RiskProfile)
+    with engine.begin() as conn:
+        rows = insert_in_batches(conn, database.DbClient, (
+            {
+                "first_name": FIRST_NAMES[i % len(FIRST_NAMES)],
+                "last_name": f"{LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]}{i}",
+                "email": f"client{i}@example.com",
+                "risk_profile": rng.choice(risk_profiles)
+            }
+            for i in range(clients)
+        ), batch_size)
+    timings["clients"] = time.perf_counter() - start
+    report("clients", rows)
+
+    # Holdings per portfolio: holdings // clients, with the remainder spread over the first
+    # ones. Generated a chunk of portfolios at a time, so each chunk's portfolios (with their
+    # total_value) are inserted before the holdings referencing them.
+    start = time.perf_counter()
+    per_portfolio, remainder = divmod(holdings, clients) if clients else (0, 0)
+    chunk = max(1, batch_size // max(per_portfolio, 1))
+    portfolios = rows = 0
+    with engine.begin() as conn:
+        for first_id in range(1, clients + 1, chunk):
+            portfolio_rows, holding_rows = [], []
+            for portfolio_id in range(first_id, min(first_id + chunk, clients + 1)):
+                count = per_portfolio + (1 if portfolio_id <= remainder else 0)
+                total_value = 0.0
+                for asset_index in rng.sample(range(assets), count):
+                    quantity = round(rng.uniform(1.0, 1000.0), 2)
+                    total_value += quantity * prices[asset_index]
+                    holding_rows.append({"portfolio_id": portfolio_id, "asset_id": asset_index + 1, "quantity": quantity})
+                portfolio_rows.append({"id": portfolio_id, "name": "Main Portfolio", "client_id": portfolio_id, "total_value": total_value})
+            portfolios += insert_in_batches(conn, database.DbPortfolio, portfolio_rows, batch_size)
+            rows += insert_in_batches(conn, database.PortfolioAssetAssociation, holding_rows, batch_size)
+            report("holdings", rows)
+    timings["portfolios_and_holdings"] = time.perf_counter() - start
+
+    return {
+        "clients": clients,
+        "assets": assets,
+        "portfolios": portfolios,
+        "holdings": rows,
+        "seed": seed,
+        "seconds": {table: round(seconds, 2) for table, seconds in timings.items()}
+    }
@@ -0,0 +1,63 @@
+from typing import Iterable, Iterator, List
+
+import orjson
+
+# Fast serialization for the list endpoints. Rows come straight from the database as
+# plain tuples (see crud.client_rows_stmt / crud.asset_rows_stmt) and are shaped into
+# dicts with the same fields, in the same order, as models.Client / models.Asset. They
+# are trusted DB output, so they are not run through Pydantic validation, and are
+# encoded with orjson (ORJSONResponse) instead of the stdlib json module.
+
+def asset_row_to_dict(row) -> dict:
+    asset_id, name, ticker_symbol, asset_type, current_price = row
+    return {
+        "name": name,
+        "ticker_symbol": ticker_symbol,
+        "asset_type": asset_type,
+        "current_price": current_price,
+        "id": asset_id
+    }
+
+
+def asset_rows_to_dicts(rows) -> List[dict]:
+    return [asset_row_to_dict(row) for row in rows]
+
+
+def client_rows_to_dicts(rows, portfolio_rows) -> List[dict]:
+    # portfolio_rows are (id, name, client_id, total_value) rows for the clients in rows.
+    # As in models.Client, portfolios are listed without their holdings (assets is empty).
+    portfolios_by_client = {}
+    for portfolio_id, name, client_id, total_value in portfolio_rows:
+        portfolios_by_client.setdefault(client_id, []).append({
+            "name": name,
+            "assets": [],
+            "id": portfolio_id,
+            "client_id": client_id,
+            "total_value": total_value
+        })
+    return [
+        {
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": email,
+            "risk_profile": risk_profile.value if risk_profile is not None else None,
+            "id": client_id,
+            "portfolios": portfolios_by_client.get(client_id, [])
+        }
+        for client_id, first_name, last_name, email, risk_profile in rows
+    ]
+
+
+def json_array_chunks(chunks: Iterable[List[dict]]) -> Iterator[bytes]:
+    # Encodes a JSON array incrementally, one chunk of dicts at a time, for the streaming
+    # list responses: the output is the same array orjson would produce for all the dicts
+    # at once, but only one chunk is ever held in memory.
+    yield b"["
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        encoded = orjson.dumps(chunk)[1:-1] # Elements without the enclosing brackets
+        yield encoded if first else b"," + encoded
+        first = False
+    yield b"]"
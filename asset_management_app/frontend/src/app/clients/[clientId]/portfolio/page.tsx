@@ -2,7 +2,7 @@
 
 import React, { useEffect, useState } from 'react';
 import { useParams, useRouter } from 'next/navigation'; // App router hooks
-import { getClientById, getClientPortfolio, Client, PortfolioDetailsResponse, RecommendedAsset } from '@/services/api';
+import { getClientById, getClientPortfolio, subscribeToValuations, Client, PortfolioDetailsResponse, RecommendedAsset } from '@/services/api';
 import AssetTable from '@/components/AssetTable'; // Re-use AssetTable
 import Link from 'next/link';
 
@@ -41,6 +41,15 @@ const ClientPortfolioPage = () => {
     fetchData();
   }, [clientId]);
 
+  // Keep the total value current from the live valuation socket instead of re-polling
+  const portfolioId = portfolio?.id;
+  useEffect(() => {
+    if (!portfolioId) return;
+    return subscribeToValuations([portfolioId], updates => {
+      updates.forEach(u => setPortfolio(current => current && current.id === u.portfolio_id ? { ...current, total_value: u.total_value } : current));
+    });
+  }, [portfolioId]);
+
   if (loading) return <p className="text-center text-gray-600 py-10">Loading portfolio details...</p>;
   if (error) return <p className="text-center text-red-500 py-10">Error: {error}</p>;
   if (!client || !portfolio) return <p className="text-center text-gray-500 py-10">Client or portfolio data not found.</p>;
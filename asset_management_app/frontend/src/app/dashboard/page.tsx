@@ -1,12 +1,14 @@
 "use client";
 
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useMemo, useState } from 'react';
 import ClientCard from '@/components/ClientCard';
-import { getClients, Client } from '@/services/api'; // Assuming api.ts is in src/services
+import { getClients, getPortfolioValuations, subscribeToValuations, Client } from '@/services/api'; // Assuming api.ts is in src/services
 import Link from 'next/link';
 
 const DashboardPage = () => {
   const [clients, setClients] = useState<Client[]>([]);
+  const [portfolioValues, setPortfolioValues] = useState<Record<number, number>>({}); // portfolio id -> latest total_value
+  const [portfolioClients, setPortfolioClients] = useState<Record<number, number>>({}); // portfolio id -> client id
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
 
@@ -16,6 +18,18 @@ const DashboardPage = () => {
         setLoading(true);
         const data = await getClients();
         setClients(data);
+        // One bulk request values every client's portfolios, instead of one request per client
+        if (data.length > 0) {
+          const valuations = await getPortfolioValuations({ client_ids: data.map(client => client.id), include_holdings: false });
+          const values: Record<number, number> = {};
+          const owners: Record<number, number> = {};
+          valuations.forEach(v => {
+            values[v.portfolio_id] = v.total_value;
+            owners[v.portfolio_id] = v.client_id;
+          });
+          setPortfolioValues(values);
+          setPortfolioClients(owners);
+        }
         setError(null);
       } catch (err) {
         console.error("Failed to fetch clients:", err);
@@ -27,6 +41,32 @@ const DashboardPage = () => {
     fetchClients();
   }, []);
 
+  // Live totals: every pushed value, the initial one included, replaces the portfolio's
+  // value, so a change made between the bulk fetch and the subscription is not lost
+  useEffect(() => {
+    const portfolioIds = Object.keys(portfolioClients).map(Number);
+    if (portfolioIds.length === 0) return;
+    return subscribeToValuations(portfolioIds, updates => {
+      setPortfolioValues(current => {
+        const values = { ...current };
+        updates.forEach(u => { values[u.portfolio_id] = u.total_value; });
+        return values;
+      });
+    });
+  }, [portfolioClients]);
+
+  // Each client's total is the sum of its portfolios' latest values
+  const totalValues = useMemo(() => {
+    const totals: Record<number, number> = {};
+    Object.entries(portfolioValues).forEach(([portfolioId, value]) => {
+      const clientId = portfolioClients[Number(portfolioId)];
+      if (clientId !== undefined) {
+        totals[clientId] = (totals[clientId] || 0) + value;
+      }
+    });
+    return totals;
+  }, [portfolioValues, portfolioClients]);
+
   if (loading) return <p className="text-center text-gray-600 py-10">Loading clients...</p>;
   if (error) return <p className="text-center text-red-500 py-10">Error loading clients: {error}. Ensure backend is running.</p>;
 
@@ -45,7 +85,7 @@ const DashboardPage = () => {
       ) : (
         <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
           {clients.map(client => (
-            <ClientCard key={client.id} client={client} />
+            <ClientCard key={client.id} client={client} totalValue={totalValues[client.id]} />
           ))}
         </div>
       )}
@@ -74,6 +74,12 @@ export interface PortfolioCreate {
     assets: PortfolioAsset[];
 }
 
+export interface PortfolioPatch {
+    name?: string;
+    upsert?: PortfolioAsset[]; // Added, or quantity replaced if already held
+    remove?: number[]; // Asset ids to remove
+}
+
 export interface Client {
     id: number;
     first_name: string;
@@ -107,6 +113,29 @@ export interface PortfolioDetailsResponse {
     total_value: number;
 }
 
+// For the bulk valuation response from POST /portfolios/valuations
+export interface HoldingValuation {
+    asset_id: number;
+    ticker_symbol: string;
+    quantity: number;
+    current_price: number;
+    value: number;
+}
+
+export interface PortfolioValuation {
+    portfolio_id: number;
+    client_id: number;
+    name: string;
+    total_value: number;
+    holdings: HoldingValuation[];
+}
+
+export interface ValuationRequest {
+    client_ids?: number[];
+    portfolio_ids?: number[];
+    include_holdings?: boolean; // false returns only the totals
+}
+
 
 // --- Client Endpoints ---
 export const createClient = (clientData: ClientCreate): Promise<Client> => {
@@ -161,10 +190,48 @@ export const createOrUpdateClientPortfolio = (clientId: number, portfolioData: P
     });
 };
 
+export const patchClientPortfolio = (clientId: number, portfolioPatch: PortfolioPatch): Promise<Portfolio> => {
+    return fetchAPI<Portfolio>(`/clients/${clientId}/portfolio`, {
+        method: 'PATCH',
+        body: JSON.stringify(portfolioPatch),
+    });
+};
+
 export const getClientPortfolio = (clientId: number): Promise<PortfolioDetailsResponse> => {
     return fetchAPI<PortfolioDetailsResponse>(`/clients/${clientId}/portfolio`);
 };
 
+// Values many clients' portfolios in a single request (used by the dashboard)
+export const getPortfolioValuations = (requestData: ValuationRequest): Promise<PortfolioValuation[]> => {
+    return fetchAPI<PortfolioValuation[]>('/portfolios/valuations', {
+        method: 'POST',
+        body: JSON.stringify(requestData),
+    });
+};
+
+// --- Live valuations (WebSocket) ---
+// Pushed after price feeds and holding changes; change is null for a portfolio's first value
+export interface ValuationUpdate {
+    portfolio_id: number;
+    total_value: number;
+    change: number | null;
+}
+
+// Subscribes to the given portfolios' total values; returns a function that closes the socket
+export const subscribeToValuations = (portfolioIds: number[], onUpdates: (updates: ValuationUpdate[]) => void): (() => void) => {
+    const socket = new WebSocket(`${API_BASE_URL.replace(/^http/, 'ws')}/ws/valuations`);
+    socket.onopen = () => socket.send(JSON.stringify({ action: 'subscribe', portfolio_ids: portfolioIds }));
+    socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'valuations') {
+            onUpdates(message.updates);
+        } else {
+            console.error('Live valuations error:', message.detail);
+        }
+    };
+    return () => socket.close();
+};
+
 // --- AI Recommendation Endpoints ---
 export const getRecommendations = (clientId: number, requestData: RecommendationRequest): Promise<RecommendedAsset[]> => {
     return fetchAPI<RecommendedAsset[]>(`/clients/${clientId}/recommendations`, {